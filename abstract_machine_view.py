@@ -1,10 +1,12 @@
 from import_proxy import Bunch, Hashable_Bunch
-from shared import format_bytes, wait_cursor, Text_Edit_Dialog
-import m5copy_widget
+from shared import format_bytes
+from tree_model import Tree_Node, Lazy_Tree_Model, Padding_Delegate
 
 import PyQt4.QtGui as QtGui
 import PyQt4.QtCore as QtCore
 
+import collections
+
 class Invalid_Selection_Exception(RuntimeError):
     pass
 
@@ -16,32 +18,11 @@ class Target_Thread(QtCore.QThread):
     def run(self):
         self.target()
 
-class Tree_Widget_Item(QtGui.QTreeWidgetItem):
-    """
-    In automatic column resizing mode (good), columns are close together (bad)
-    I (Bob) couldn't find a way to set spacing, so instead this class will
-    add spaces around the text and remove them on retrieval
-    """
-    spaces = 2
-    def text(self, column):
-        text = str(super(Tree_Widget_Item, self).text(column))
-        if not text:
-            return text
-        return text[2:-2]
-
-    def setText(self, column, text):
-        if text:
-            add = self.spaces * " "
-            new_text = add + text + add
-        else:
-            new_text = text
-        super(Tree_Widget_Item, self).setText(column, new_text)
-
 class Abstract_Machine_View(QtGui.QWidget):
     # how many characters for a size string
     bytes_print_size = 6
 
-    # source name, list of m5copy style (source, recording) tuples
+    # source name, list of m5copy style (source, recording, bytes) tuples
     copy_from = QtCore.pyqtSignal(str, list)
 
     # probably want to overwrite these in subclass
@@ -54,10 +35,10 @@ class Abstract_Machine_View(QtGui.QWidget):
         """
         raise NotImplementedError()
         
-    def _check_selection(self, selection):
+    def _check_tasks(self, selection):
         """
         Pre: it's a valid, non-empty, selection
-        return text to display
+        return list of checks.Check_Task to run
         """
         raise NotImplementedError()
 
@@ -74,19 +55,36 @@ class Abstract_Machine_View(QtGui.QWidget):
         """
         raise NotImplementedError()
 
-    def _selection_size(self, selection):
+    def _row_totals(self, index):
         """
-        Pre: it's a valid, non-empty, selection
-        return number of bytes in selected recordings
+        Pre: index is a selected row
+        return (group, number of items, number of bytes) the row adds to
+        the selection, rows of different groups cannot be selected together
+        raise Invalid_Selection_Exception if the row cannot be selected
         """
         raise NotImplementedError()
 
     def _create_view_widget(self):
         """
-        return QWidget, create a self.view QTreeWidget
+        return QWidget, create a self.view QTreeView 
+        (using self._create_tree_view)
         """
         raise NotImplementedError()
 
+    def _create_tree_view(self, parent):
+        """
+        return a QTreeView, with a Lazy_Tree_Model as self.model
+        """
+        view = QtGui.QTreeView(parent)
+        add_spacing = Padding_Delegate.spaces * " "
+        self.model = Lazy_Tree_Model([add_spacing + l + add_spacing \
+                                      for l in self.header_labels], view)
+        view.setModel(self.model)
+        view.setItemDelegate(Padding_Delegate(view))
+        # all rows have the same height, saves Qt from asking for every row
+        view.setUniformRowHeights(True)
+        return view
+
     def copy_to(self, from_, recordings):
         try:
             (to, recording_base) = self._get_m5copy_to()
@@ -103,6 +101,8 @@ class Abstract_Machine_View(QtGui.QWidget):
 
         options = self._get_m5copy_options()
 
+        # the dialogs are imported when first used, for a fast startup
+        import m5copy_widget
         dialog = m5copy_widget.M5copy_Dialog(
             recordings, recording_base, from_, to, options, grandparent)
         dialog.show()
@@ -119,11 +119,16 @@ class Abstract_Machine_View(QtGui.QWidget):
             return
         if not selection:
             return
-        with wait_cursor(QtGui.QApplication):
-            text = self._check_selection(selection)
-        box = Text_Edit_Dialog(text, self)
-        box.show()
-        box.raise_()
+        # the checks run in the background, the dialog lives on with the
+        # base widget as parent
+        grandparent = self
+        while grandparent.parentWidget():
+            grandparent = grandparent.parentWidget()
+        import check_widget
+        dialog = check_widget.Check_Dialog(self._check_tasks(selection),
+                                           grandparent)
+        dialog.show()
+        dialog.raise_()
             
     def _do_copy(self):
         try:
@@ -141,59 +146,118 @@ class Abstract_Machine_View(QtGui.QWidget):
             QtGui.QMessageBox.critical(self, "Cannot copy", str(e))
 
 
-    def _update_selection_label(self):
+    def _reset_selection_totals(self):
+        # the selection size is kept up to date from the selection changes
+        # {Tree_Node : (group, items, bytes) or None if invalid}
+        self.selected_rows = {}
+        self.selected_groups = collections.defaultdict(int)
+        self.selected_invalid = 0
+        self.selected_items = 0
+        self.selected_bytes = 0
+
+    def _add_selected_row(self, index):
+        node = self.model.node(index)
+        if node in self.selected_rows:
+            return
         try:
-            selection = self._get_selection()
+            totals = self._row_totals(index)
         except Invalid_Selection_Exception:
+            totals = None
+        self.selected_rows[node] = totals
+        if totals is None:
+            self.selected_invalid += 1
+        else:
+            (group, items, bytes_) = totals
+            self.selected_groups[group] += 1
+            self.selected_items += items
+            self.selected_bytes += bytes_
+
+    def _remove_selected_row(self, node):
+        if node not in self.selected_rows:
+            return
+        totals = self.selected_rows.pop(node)
+        if totals is None:
+            self.selected_invalid -= 1
+        else:
+            (group, items, bytes_) = totals
+            self.selected_groups[group] -= 1
+            if self.selected_groups[group] == 0:
+                del self.selected_groups[group]
+            self.selected_items -= items
+            self.selected_bytes -= bytes_
+
+    def _selection_changed(self, selected, deselected):
+        # we get one index for each row and column, only use the first column
+        for index in deselected.indexes():
+            if index.column() == 0:
+                self._remove_selected_row(self.model.node(index))
+        for index in selected.indexes():
+            if index.column() == 0:
+                self._add_selected_row(index)
+        self._update_selection_label()
+
+    def _recount_selection(self):
+        """
+        recompute the selection totals from the current selection, 
+        rows can disappear from the selection without a selection change
+        """
+        self._reset_selection_totals()
+        for index in self.view.selectionModel().selectedRows():
+            self._add_selected_row(index)
+        self._update_selection_label()
+
+    def _update_selection_label(self):
+        if self.selected_invalid or (len(self.selected_groups) > 1):
             self.selection_label.setText("invalid selection")
             return
 
-        if not selection:
+        if not self.selected_rows:
             self.selection_label.setText("no selection")
             return
             
         self.selection_label.setText("{size} ({n} items)".format(
-            size=format_bytes(self._selection_size(selection), 
-                              self.bytes_print_size),
-            n=len(selection)))
+            size=format_bytes(self.selected_bytes, self.bytes_print_size),
+            n=self.selected_items))
 
     def _deselect_children(self, index):
-        item = self.view.itemFromIndex(index)
-        # disconnect update selection label and call manually, 
-        # otherwise it might be called many times
-        self.view.itemSelectionChanged.disconnect(self._update_selection_label)
-        for child in [item.child(i) for i in xrange(item.childCount())]:
-            child.setSelected(False)
-        self._update_selection_label()
-        self.view.itemSelectionChanged.connect(self._update_selection_label)
+        rows = self.model.rowCount(index)
+        if rows == 0:
+            return
+        # one selection change for all children
+        self.view.selectionModel().select(
+            QtGui.QItemSelection(
+                self.model.index(0, 0, index), 
+                self.model.index(rows - 1, self.model.columnCount() - 1, 
+                                 index)),
+            QtGui.QItemSelectionModel.Deselect)
 
     def _cleanup_background_loading(self, root):
         del self.background_data[root]
 
-    def load_in_background(self, root, compute_func, display_func):
+    def load_in_background(self, root, compute_func, display_func,
+                           show_loading=True):
         """
-        root: QTreeWidget or QTreeWidgetItem
+        root: Tree_Node of self.model (self.model.root for the whole view)
         compute_func, display_func: callables, 
             can use self.background_data[root] Bunch as storage
         compute func shouldn't do anything with Qt as it's run in a thread
+        show_loading: whether to add a "Loading" item to root while loading
         """
         if root in self.background_data:
             # already loading
             return
+        if not isinstance(root, Tree_Node):
+            raise TypeError("root has to be a Tree_Node, "
+                            "not {t}".format(t=type(root)))
             
-        load_item = QtGui.QTreeWidgetItem(root)
-        load_item.setFirstColumnSpanned(True)
-        load_item.setText(0, "Loading")
+        load_item = Tree_Node({0: "Loading"})
+        if show_loading:
+            self.model.append_child(root, load_item)
+            self.view.setFirstColumnSpanned(
+                load_item.row, self.model.index_of(root), True)
 
         thread = Target_Thread(compute_func, self)
-        if isinstance(root, QtGui.QTreeWidget):
-            remove_load_item = lambda: root.takeTopLevelItem(
-                root.topLevelItemCount() - 1)
-        elif isinstance(root, QtGui.QTreeWidgetItem):
-            remove_load_item = lambda: root.removeChild(load_item)
-        else:
-            raise TypeError("root has to be a QTreeWidget or QTreeWidgetItem, "
-                            "not {t}".format(t=type(root)))
+        remove_load_item = lambda: self.model.remove_child(load_item)
         thread.finished.connect(remove_load_item, QtCore.Qt.QueuedConnection)
         thread.finished.connect(display_func, QtCore.Qt.QueuedConnection)
         cleanup = lambda: self._cleanup_background_loading(root)
@@ -227,9 +291,6 @@ class Abstract_Machine_View(QtGui.QWidget):
         self.selection_layout.addStretch(1)
         layout.addLayout(self.selection_layout)
 
-        add_spacing = Tree_Widget_Item.spaces * " "
-        self.view.setHeaderLabels([add_spacing + l + add_spacing for l in \
-                                   self.header_labels])
         self.view.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
         self.view.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
         self.view.header().setResizeMode(
@@ -247,6 +308,12 @@ class Abstract_Machine_View(QtGui.QWidget):
             QtCore.Qt.WidgetWithChildrenShortcut)
         self.clear_selection_action.triggered.connect(self.view.clearSelection)
         self.view.addAction(self.clear_selection_action)
-        self.view.itemSelectionChanged.connect(self._update_selection_label)
+        self._reset_selection_totals()
+        self.view.selectionModel().selectionChanged.connect(
+            self._selection_changed)
+        self.model.rowsRemoved.connect(
+            lambda parent, first, last: self._recount_selection())
+        self.model.modelReset.connect(self._recount_selection)
+        self.model.layoutChanged.connect(self._recount_selection)
         self.view.collapsed.connect(self._deselect_children)
 
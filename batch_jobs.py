@@ -0,0 +1,145 @@
+"""
+Bookkeeping of the jobs (commands) of a batch, shared by the command
+dialogs and the command line interface: the state of every job, the batch
+in the transfer journal, the telemetry of the transfers and the capture of
+the output of the running commands. Failing journal or telemetry calls are
+reported, they don't stop the batch.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import get_settings
+from transfer_journal import get_journal
+from transfer_telemetry import get_telemetry, parse_progress, parse_rate
+from output_capture import Output_Capture
+
+import time
+
+def print_warning(text):
+    print text
+
+class Batch_Jobs(object):
+    def __init__(self, kind, commands, expected_sizes, telemetry=False,
+                 warn=print_warning):
+        """
+        kind: the command of the batch, e.g. "m5copy", also the prefix of
+          the log files
+        commands: the command line of every job, empty lines are no jobs
+        expected_sizes: {command : bytes at the destination}
+        telemetry: whether to record the progress of the jobs in the
+          transfer telemetry
+        warn: callable(text) to report failures of the journal, telemetry
+          and log files
+        """
+        self.kind = kind
+        self.commands = commands
+        self.expected_sizes = expected_sizes
+        self.telemetry = get_telemetry() if telemetry else None
+        self.warn = warn
+        self.states = ["pending"] * len(commands)
+        self.durations = [None] * len(commands)
+        self.batch = None # id of the batch in the transfer journal
+        # the program is stopping, the journal keeps the states of the
+        # running jobs to resume them
+        self.stopping = False
+        self._output = {} # {index : Output_Capture}
+        self._start = {} # {index : start time}
+        settings = get_settings()
+        self._output_lines = settings["command_output_lines"]
+        self._log_directory = settings["command_log_directory"]
+        self._keep_logs = settings["command_keep_logs"]
+
+    def _journal(self, method, *args):
+        journal = get_journal()
+        if journal is None:
+            return None
+        try:
+            return getattr(journal, method)(*args)
+        except Exception as e:
+            self.warn("warning, transfer journal failed: {e}".format(e=e))
+            return None
+
+    def _telemetry(self, method, index, *args):
+        if not self.telemetry:
+            return
+        try:
+            getattr(self.telemetry, method)(
+                "{b:x}.{i}".format(b=id(self), i=index), *args)
+        except Exception as e:
+            self.warn("warning, transfer telemetry failed: {e}".format(e=e))
+
+    def create_batch(self, title):
+        """
+        journal the jobs as a new batch
+        """
+        self.discard_batch()
+        self.batch = self._journal(
+            "create_batch", self.kind, title,
+            [(index, command, self.expected_sizes.get(command)) \
+             for (index, command) in enumerate(self.commands) \
+             if command.strip()])
+
+    def discard_batch(self):
+        """
+        remove the batch from the journal, e.g. once all jobs are done
+        """
+        if self.batch is not None:
+            self._journal("discard_batch", self.batch)
+            self.batch = None
+
+    def set_state(self, index, state):
+        self.states[index] = state
+        if (self.batch is not None) and (not self.stopping):
+            self._journal("set_state", self.batch, index, state)
+
+    def start(self, index):
+        """
+        the command of job index is started
+        """
+        try:
+            output = Output_Capture(
+                self._output_lines, self._log_directory,
+                "{k}-{i}-".format(k=self.kind, i=index+1))
+        except Exception as e:
+            self.warn("warning, failed to create a log file in '{d}': "
+                      "{e}".format(d=self._log_directory, e=e))
+            output = Output_Capture(self._output_lines)
+        self._output[index] = output
+        self._start[index] = time.time()
+        self.set_state(index, "running")
+        command = self.commands[index]
+        self._telemetry("start", index, command,
+                        self.expected_sizes.get(command))
+
+    def output(self, index, text):
+        """
+        returns [(line, progress)] of the lines completed by text,
+        progress: (percentage, rate string or None) of an m5copy progress
+        line, else None
+        """
+        output = self._output.get(index)
+        if output is None:
+            return []
+        result = []
+        for line in output.feed(text):
+            progress = parse_progress(line)
+            if progress is not None:
+                (percentage, rate) = progress
+                self._telemetry("sample", index, percentage,
+                                None if rate is None else parse_rate(rate))
+            result.append((line, progress))
+        return result
+
+    def finish(self, index, success):
+        """
+        the command of job index stopped,
+        returns its Output_Capture, None if it wasn't started
+        """
+        output = self._output.pop(index, None)
+        if output is not None:
+            output.close(keep_log=self._keep_logs or (not success))
+        start = self._start.pop(index, None)
+        if start is not None:
+            self.durations[index] = time.time() - start
+            self._telemetry("finish", index, success)
+        self.set_state(index, "done" if success else "failed")
+        return output
@@ -0,0 +1,94 @@
+"""
+Synthetic FlexBuff disk layouts for the benchmarks.
+A layout is created under <directory>/<host>/mnt, such that the stand-in ssh
+(benchmarks/ssh) can map /mnt of a remote command to it. The recording
+chunks are sparse files, a layout of 100k scans takes little disk space
+(but a few hundred thousand inodes).
+This module doesn't depend on Qt.
+"""
+
+import json
+import os
+import os.path
+
+# station codes of the synthetic recordings
+stations = ["on", "wb", "ef", "mc", "nt", "tr", "ys", "hh", "jb", "sr"]
+
+def recording_names(scans, scans_per_station=100):
+    """
+    returns scans vbs style recording names, e.g. 'bm001_on_no0001',
+    experiments of len(stations) stations of scans_per_station scans each
+    """
+    names = []
+    for index in xrange(scans):
+        scan = index % scans_per_station
+        station = (index // scans_per_station) % len(stations)
+        experiment = index // (scans_per_station * len(stations))
+        names.append("bm{e:03d}_{s}_no{n:04d}".format(
+            e=experiment + 1, s=stations[station], n=scan + 1))
+    return names
+
+def chunk_paths(mnt, index, recording, layout, disks, chunks):
+    """
+    returns the paths of the chunks of recording (the index-th recording),
+    spread over the disks round robin
+    """
+    paths = []
+    for chunk in xrange(chunks):
+        disk = (index + chunk) % disks
+        if layout == "mark6":
+            # a file per disk, module 1-4 with disk 0-7
+            paths.append(os.path.join(
+                mnt, "disks", str(disk // 8 + 1), str(disk % 8), "data",
+                recording))
+        else:
+            paths.append(os.path.join(
+                mnt, "disk{d}".format(d=disk), recording,
+                "{r}.{c:08d}".format(r=recording, c=chunk)))
+    return paths
+
+def create_layout(directory, host, scans, layout="flexbuff", disks=8,
+                  chunks=2, chunk_size=256 * 1024**2):
+    """
+    create the disks of host with scans recordings, unless the layout
+    already exists with the same parameters
+    layout: "flexbuff" (/mnt/diskN/rec/rec.NNNNNNNN) or "mark6"
+      (/mnt/disks/M/D/data/rec)
+    chunks: number of chunks (files) per recording, at most disks
+    chunk_size: (apparent) number of bytes per chunk
+    returns the mnt directory of the layout
+    """
+    if layout == "mark6":
+        disks = min(disks, 32)
+    chunks = min(chunks, disks)
+    parameters = {"scans": scans, "layout": layout, "disks": disks,
+                  "chunks": chunks, "chunk_size": chunk_size}
+    root = os.path.join(directory, host)
+    mnt = os.path.join(root, "mnt")
+    marker = os.path.join(root, "layout.json")
+    try:
+        with open(marker, "r") as input_:
+            if json.load(input_) == parameters:
+                return mnt
+    except (IOError, ValueError):
+        pass
+    if os.path.exists(mnt):
+        # shutil.rmtree is slow on this many files
+        os.system("rm -rf '{m}'".format(m=mnt))
+
+    for disk in xrange(disks):
+        if layout == "mark6":
+            os.makedirs(os.path.join(mnt, "disks", str(disk // 8 + 1),
+                                     str(disk % 8), "data"))
+        else:
+            os.makedirs(os.path.join(mnt, "disk{d}".format(d=disk)))
+    for (index, recording) in enumerate(recording_names(scans)):
+        for path in chunk_paths(mnt, index, recording, layout, disks, chunks):
+            if layout != "mark6":
+                os.mkdir(os.path.dirname(path))
+            with open(path, "wb") as chunk:
+                chunk.truncate(chunk_size)
+
+    with open(marker, "w") as output:
+        json.dump(parameters, output)
+    return mnt
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the FlexBuff inventory path, on synthetic disk layouts (see
+fixtures.py) reached through a stand-in ssh (benchmarks/ssh) that runs the
+remote commands locally, with a configurable latency.
+For every layout and number of scans this times:
+- the inventory, get_flexbuff_meta_data in single pass and du mode, and the
+  local inventory backend
+- building the Inventory_Store of the inventory, and the tree of the
+  FlexBuff view from it (the tree only if PyQt4 is available)
+- expanding a scan to its chunks, listed over ssh (mean per expansion)
+- resolving a selection of an experiment and of a list of recordings
+Timings are the minimum of a few repetitions. They are compared to the
+baseline (from an earlier run with --save-baseline on the same machine),
+the exit status is 1 if any benchmark got slower than the tolerance.
+
+Examples:
+  benchmarks/run_benchmarks.py --save-baseline
+  benchmarks/run_benchmarks.py --scans 1000 10000 --latency 0.05
+"""
+
+import os
+import os.path
+import sys
+
+benchmark_directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmark_directory))
+# the stand-in ssh takes the place of the real one
+os.environ["PATH"] = benchmark_directory + os.pathsep + os.environ["PATH"]
+
+from fixtures import create_layout, recording_names
+from inventory import get_flexbuff_meta_data
+from inventory_backend import (get_backend, Local_Inventory_Backend,
+                               disk_pattern)
+from inventory_store import Inventory_Store, Chunk_Store
+from import_proxy import Hashable_Bunch
+import ssh_pool
+
+import argparse
+import collections
+import json
+import time
+
+def timed(function, repeat):
+    """
+    returns (minimum seconds of repeat calls to function, last result)
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+        if (best is None) or (seconds < best):
+            best = seconds
+    return (best, result)
+
+def scan_inventory(flexbuff, mark6, scan_mode, disk_parallelism):
+    failed = set()
+    chunks = {}
+    (usage, _, _) = get_flexbuff_meta_data(
+        [flexbuff], mark6, failed, scan_mode, chunks, None, 1,
+        disk_parallelism)
+    if failed:
+        raise RuntimeError("inventory of {m} failed".format(
+            m=flexbuff.machine))
+    return (usage, chunks)
+
+def scan_local(flexbuff, mnt, mark6, disk_parallelism):
+    pattern = disk_pattern[flexbuff.machine_type].replace(
+        "/mnt", mnt, 1)
+    backend = Local_Inventory_Backend(flexbuff, pattern)
+    usage = collections.defaultdict(
+        lambda: collections.defaultdict(
+            lambda: collections.defaultdict(int)))
+    backend.scan(usage, [], collections.defaultdict(list), Chunk_Store(),
+                 mark6, None, disk_parallelism)
+    return usage
+
+def build_tree(store):
+    """
+    build the experiment and station nodes of the FlexBuff view and fetch
+    the first scans of every station, as if all were expanded
+    """
+    from tree_model import Tree_Node, Lazy_Tree_Model
+    from shared import format_bytes
+    model = Lazy_Tree_Model(["Experiment", "Station", "Scan", "Chunk",
+                             "Size"])
+    for experiment_group in xrange(len(store.experiment_groups)):
+        experiment_item = Tree_Node(
+            {0: store.experiment_name(experiment_group),
+             4: format_bytes(store.experiment_size[experiment_group], 6)},
+            key=experiment_group)
+        model.insert_child(model.root, experiment_group, experiment_item)
+        stations = []
+        for station_group in store.station_group_range(experiment_group):
+            station_item = Tree_Node(
+                {1: store.station_name(station_group),
+                 4: format_bytes(store.station_size[station_group], 6)},
+                key=station_group)
+            rows = store.row_range(station_group)
+            first = rows[0] if rows else 0
+            station_item.source = lambda row, first=first: Tree_Node(
+                {2: store.scan_name(first + row),
+                 4: format_bytes(store.size[first + row], 6)},
+                key=first + row, expandable=True)
+            station_item.source_size = len(rows)
+            stations.append(station_item)
+        model.append_children(experiment_item, stations)
+        for station_item in stations:
+            model.fetchMore(model.index_of(station_item))
+    return model
+
+def expand_chunks(flexbuff, recordings, mark6):
+    """
+    list the chunks of recordings over ssh, and order them for display
+    """
+    backend = get_backend(flexbuff, "du")
+    for recording in recordings:
+        chunks = backend.list_chunks(recording, mark6)
+        if not chunks:
+            raise RuntimeError("no chunks of {r}".format(r=recording))
+        if mark6:
+            sorted(("/".join(chunk.split("/")[3:5]), size, chunk) \
+                   for (chunk, size) in chunks.items())
+        else:
+            sorted((chunk.split(".")[-1], chunk.split("/")[2], size, chunk) \
+                   for (chunk, size) in chunks.items())
+
+def resolve_rows(store, rows):
+    """
+    returns [(host, recording, bytes)], as the FlexBuff view resolves
+    a selection
+    """
+    return [(host, store.recordings[row], store.row_host_size(row, host)) \
+            for row in rows for host in store.row_hosts(row)]
+
+def run_layout(args, layout, scans, tree):
+    """
+    returns [(benchmark name, seconds)] of layout with scans recordings
+    """
+    mark6 = (layout == "mark6")
+    host = "{l}-{s}".format(l=layout, s=scans)
+    start = time.time()
+    mnt = create_layout(args.directory, host, scans, layout, args.disks,
+                        args.chunks)
+    print >> sys.stderr, "{h}: layout ready in {t:.1f} s".format(
+        h=host, t=time.time() - start)
+    flexbuff = Hashable_Bunch(user=None, machine=host, port=2620,
+                              control_ip=host, data_ip=host,
+                              machine_type=layout,
+                              inventory_backend="ssh")
+    timings = []
+    (seconds, (usage, _)) = timed(
+        lambda: scan_inventory(flexbuff, mark6, "single_pass",
+                               args.disk_parallelism), args.repeat)
+    timings.append(("inventory_single_pass", seconds))
+    (seconds, _) = timed(
+        lambda: scan_inventory(flexbuff, mark6, "du",
+                               args.disk_parallelism), args.repeat)
+    timings.append(("inventory_du", seconds))
+    (seconds, _) = timed(
+        lambda: scan_local(flexbuff, mnt, mark6, args.disk_parallelism),
+        args.repeat)
+    timings.append(("inventory_local", seconds))
+
+    (seconds, store) = timed(lambda: Inventory_Store(usage), args.repeat)
+    if len(store) != scans:
+        raise RuntimeError("{h}: found {n} of {s} scans".format(
+            h=host, n=len(store), s=scans))
+    timings.append(("inventory_store", seconds))
+    if tree:
+        (seconds, _) = timed(lambda: build_tree(store), args.repeat)
+        timings.append(("tree", seconds))
+
+    names = recording_names(scans)
+    step = max(1, scans // args.expansions)
+    sample = names[::step][:args.expansions]
+    (seconds, _) = timed(lambda: expand_chunks(flexbuff, sample, mark6),
+                         args.repeat)
+    timings.append(("chunk_expansion", seconds / len(sample)))
+
+    experiment = store.experiment_name(0)
+    (seconds, _) = timed(
+        lambda: resolve_rows(store, store.select(experiment)), args.repeat)
+    timings.append(("select_experiment", seconds))
+    selected = names[::max(1, scans // 1000)]
+    (seconds, _) = timed(
+        lambda: resolve_rows(store, store.select(recordings=selected)),
+        args.repeat)
+    timings.append(("select_recordings", seconds))
+    return timings
+
+def parameters(args):
+    """
+    the arguments that change the timings besides the code,
+    baselines are only comparable with the same parameters
+    """
+    return {"latency": args.latency, "connect_latency": args.connect_latency,
+            "disks": args.disks, "chunks": args.chunks,
+            "disk_parallelism": args.disk_parallelism,
+            "expansions": args.expansions}
+
+def load_baseline(file_name):
+    try:
+        with open(file_name, "r") as input_:
+            return json.load(input_)
+    except IOError:
+        return None
+
+def report(results, baseline, tolerance, minimum_difference):
+    """
+    print the timings, compared to the baseline
+    returns the number of regressions
+    """
+    regressions = 0
+    print "\t".join(["benchmark", "seconds", "baseline", "change", ""])
+    for (key, seconds) in results:
+        reference = None if baseline is None \
+                    else baseline["timings"].get(key)
+        if reference is None:
+            print "\t".join([key, "{s:.4f}".format(s=seconds), "", "", ""])
+            continue
+        change = (seconds - reference) / reference if reference else 0.0
+        verdict = ""
+        if (change > tolerance) and \
+           (seconds - reference > minimum_difference):
+            verdict = "REGRESSION"
+            regressions += 1
+        elif (change < -tolerance) and \
+             (reference - seconds > minimum_difference):
+            verdict = "improved"
+        print "\t".join([key, "{s:.4f}".format(s=seconds),
+                         "{r:.4f}".format(r=reference),
+                         "{c:+.0%}".format(c=change), verdict])
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the FlexBuff inventory path")
+    parser.add_argument("--scans", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="numbers of scans of the layouts")
+    parser.add_argument("--layouts", nargs="+", default=["flexbuff", "mark6"],
+                        choices=["flexbuff", "mark6"])
+    parser.add_argument("--directory", default="/tmp/jcm_benchmarks",
+                        help="where to create the layouts, they are reused "
+                        "by later runs")
+    parser.add_argument("--disks", type=int, default=8,
+                        help="number of disks per layout")
+    parser.add_argument("--chunks", type=int, default=2,
+                        help="number of chunks per recording")
+    parser.add_argument("--disk-parallelism", type=int, default=8,
+                        help="see inventory_disk_parallelism in config.json")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds the stand-in ssh adds per command")
+    parser.add_argument("--connect-latency", type=float, default=0.1,
+                        help="seconds the stand-in ssh adds per connection")
+    parser.add_argument("--expansions", type=int, default=20,
+                        help="number of scans to expand to their chunks")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repetitions per benchmark, the fastest counts")
+    parser.add_argument("--baseline", default="~/.jcm/benchmarks.json",
+                        help="JSON file of the timings to compare to")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the timings of this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown counted as a regression")
+    parser.add_argument("--minimum-difference", type=float, default=0.005,
+                        help="seconds of slowdown below which a slowdown "
+                        "is noise, not a regression")
+    args = parser.parse_args(argv)
+
+    os.environ["JCM_BENCH_ROOT"] = args.directory
+    os.environ["JCM_BENCH_SSH_LATENCY"] = str(args.latency)
+    os.environ["JCM_BENCH_SSH_CONNECT"] = str(args.connect_latency)
+    try:
+        # the model of the FlexBuff view needs PyQt4
+        build_tree(Inventory_Store({}))
+        tree = True
+    except ImportError:
+        print >> sys.stderr, "PyQt4 is not available, skipping the tree "\
+            "benchmark"
+        tree = False
+
+    results = []
+    try:
+        for layout in args.layouts:
+            for scans in args.scans:
+                results.extend(
+                    ("{l} {s} {b}".format(l=layout, s=scans, b=name), seconds)
+                    for (name, seconds) in run_layout(args, layout, scans,
+                                                      tree))
+    finally:
+        ssh_pool.close_all()
+
+    file_name = os.path.expanduser(args.baseline)
+    baseline = load_baseline(file_name)
+    if (baseline is not None) and \
+       (baseline.get("parameters") != parameters(args)):
+        print >> sys.stderr, "the baseline was measured with other "\
+            "parameters, not comparing: {p}".format(p=baseline["parameters"])
+        baseline = None
+    regressions = report(results, baseline, args.tolerance,
+                         args.minimum_difference)
+    if args.save_baseline:
+        timings = {} if baseline is None else dict(baseline["timings"])
+        timings.update(results)
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(file_name, "w") as output:
+            json.dump({"parameters": parameters(args), "timings": timings},
+                      output, indent=1, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
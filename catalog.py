@@ -0,0 +1,280 @@
+"""
+Local on-disk catalog of FlexBuff inventories and Mark5 module directories.
+The last known inventory of every host is stored, such that a view can be
+displayed immediately (and browsed while a host is unreachable),
+while a refresh is running in the background.
+The scan directory of Mark5 modules is stored by VSN, such that a module
+doesn't have to be listed again.
+Successful scan/file check replies are stored by recording identity, such
+that an unchanged recording doesn't have to be checked again.
+"""
+
+import import_proxy
+
+import sqlite3
+import contextlib
+import collections
+import threading
+import time
+import os
+import os.path
+
+class Inventory_Catalog(object):
+    schema = [
+        "CREATE TABLE IF NOT EXISTS host ("
+        " machine TEXT NOT NULL,"
+        " data_format TEXT NOT NULL,"
+        " updated REAL NOT NULL,"
+        " total INTEGER,"
+        " used INTEGER,"
+        " available INTEGER,"
+        " PRIMARY KEY (machine, data_format))",
+        "CREATE TABLE IF NOT EXISTS recording ("
+        " machine TEXT NOT NULL,"
+        " data_format TEXT NOT NULL,"
+        " experiment TEXT,"
+        " station TEXT,"
+        " scan TEXT,"
+        " recording TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " PRIMARY KEY (machine, data_format, recording))",
+        "CREATE INDEX IF NOT EXISTS recording_tree ON recording "
+        " (machine, data_format, experiment, station, scan)",
+        "CREATE TABLE IF NOT EXISTS chunk ("
+        " machine TEXT NOT NULL,"
+        " data_format TEXT NOT NULL,"
+        " recording TEXT NOT NULL,"
+        " path TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " PRIMARY KEY (machine, data_format, path))",
+        "CREATE INDEX IF NOT EXISTS chunk_recording ON chunk "
+        " (machine, data_format, recording)",
+        "CREATE TABLE IF NOT EXISTS module ("
+        " vsn TEXT PRIMARY KEY,"
+        " updated REAL NOT NULL,"
+        " scans INTEGER NOT NULL,"
+        " bytes INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS module_scan ("
+        " vsn TEXT NOT NULL,"
+        " number INTEGER NOT NULL,"
+        " recording TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " PRIMARY KEY (vsn, number))",
+        "CREATE TABLE IF NOT EXISTS check_result ("
+        " host TEXT NOT NULL,"
+        " recording TEXT NOT NULL,"
+        " chunks TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " checked REAL NOT NULL,"
+        " reply TEXT NOT NULL,"
+        " PRIMARY KEY (host, recording, chunks, size))",
+    ]
+
+    def __init__(self, file_name):
+        self.file_name = os.path.expanduser(file_name)
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            for statement in self.schema:
+                connection.execute(statement)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        sqlite connections cannot be shared between threads,
+        so use a short lived connection per transaction
+        """
+        connection = sqlite3.connect(self.file_name, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def store(self, machine, data_format, usage, available, chunks=None):
+        """
+        Replace the inventory of one host.
+        usage = { experiment : { station : { (scan, recording) : bytes } } }
+        available = [total, used, available] or [] if unknown
+        chunks = optional, inventory_store.Chunk_Store,
+          replaces all known chunks of the host
+        """
+        rows = [(machine, data_format, experiment, station, scan, recording,
+                 size)
+                for experiment, station_data in usage.items()
+                for station, scan_data in station_data.items()
+                for ((scan, recording), size) in scan_data.items()]
+        (total, used, free) = available if len(available) == 3 \
+                              else (None, None, None)
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM recording WHERE machine=? AND data_format=?",
+                (machine, data_format))
+            connection.executemany(
+                "INSERT OR REPLACE INTO recording VALUES (?,?,?,?,?,?,?)",
+                rows)
+            if chunks is not None:
+                connection.execute(
+                    "DELETE FROM chunk WHERE machine=? AND data_format=?",
+                    (machine, data_format))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO chunk VALUES (?,?,?,?,?)",
+                    ((machine, data_format, recording, path, size)
+                     for (recording, path, size) in chunks.rows()))
+            # chunks of recordings that are gone are stale
+            connection.execute(
+                "DELETE FROM chunk WHERE machine=? AND data_format=? AND "
+                "recording NOT IN (SELECT recording FROM recording "
+                "WHERE machine=? AND data_format=?)",
+                (machine, data_format, machine, data_format))
+            # checks of recordings and chunks that changed size are stale
+            connection.execute(
+                "DELETE FROM check_result WHERE host=? AND ("
+                "EXISTS (SELECT 1 FROM recording WHERE machine=? AND "
+                "data_format=? AND recording=check_result.recording AND "
+                "size!=check_result.size) OR "
+                "EXISTS (SELECT 1 FROM chunk WHERE machine=? AND "
+                "data_format=? AND path=check_result.recording AND "
+                "size!=check_result.size))",
+                (machine, machine, data_format, machine, data_format))
+            connection.execute(
+                "INSERT OR REPLACE INTO host VALUES (?,?,?,?,?,?)",
+                (machine, data_format, time.time(), total, used, free))
+
+    def load(self, machines, data_format):
+        """
+        Returns a 3-tuple (usage, available, updated), in the format of
+        shared.get_flexbuff_meta_data, for the hosts which are in the catalog
+        updated = { flexbuff : time of the last inventory (seconds since epoch)}
+        """
+        usage = collections.defaultdict(
+            lambda: collections.defaultdict(
+                lambda: collections.defaultdict(
+                    lambda: collections.defaultdict(int))))
+        available = collections.defaultdict(list)
+        updated = {}
+        with self._connect() as connection:
+            for machine in machines:
+                host = connection.execute(
+                    "SELECT updated, total, used, available FROM host "
+                    "WHERE machine=? AND data_format=?",
+                    (machine, data_format)).fetchone()
+                if host is None:
+                    continue
+                updated[machine] = host[0]
+                if host[1] is not None:
+                    available[machine] = list(host[1:])
+                machine_usage = usage[machine]
+                for (experiment, station, scan, recording, size) in \
+                    connection.execute(
+                        "SELECT experiment, station, scan, recording, size "
+                        "FROM recording WHERE machine=? AND data_format=?",
+                        (machine, data_format)):
+                    machine_usage[_str(experiment)][_str(station)]\
+                        [(_str(scan), str(recording))] += size
+        return (usage, available, updated)
+
+    def store_chunks(self, machine, data_format, recording, chunks):
+        """
+        chunks = { chunk path : bytes }
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM chunk WHERE machine=? AND data_format=? AND "
+                "recording=?", (machine, data_format, recording))
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunk VALUES (?,?,?,?,?)",
+                [(machine, data_format, recording, path, size)
+                 for path, size in chunks.items()])
+
+    def load_chunks(self, machine, data_format, recording):
+        """
+        Returns { chunk path : bytes }, empty if the chunks are not known
+        """
+        with self._connect() as connection:
+            return {str(path) : size for (path, size) in connection.execute(
+                "SELECT path, size FROM chunk WHERE machine=? AND "
+                "data_format=? AND recording=?",
+                (machine, data_format, recording))}
+
+    def store_module(self, vsn, scans, bytes_, entries):
+        """
+        Replace the directory of a Mark5 module.
+        scans, bytes_: as reported by dir_info?
+        entries = [(scan number, recording, bytes)]
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM module_scan WHERE vsn=?", (vsn,))
+            connection.executemany(
+                "INSERT OR REPLACE INTO module_scan VALUES (?,?,?,?)",
+                [(vsn, number, recording, size) \
+                 for (number, recording, size) in entries])
+            connection.execute(
+                "INSERT OR REPLACE INTO module VALUES (?,?,?,?)",
+                (vsn, time.time(), scans, bytes_))
+
+    def load_module(self, vsn):
+        """
+        Returns Bunch(scans, bytes, entries, updated) in the format of 
+        store_module, or None if the module is not in the catalog
+        """
+        with self._connect() as connection:
+            module = connection.execute(
+                "SELECT updated, scans, bytes FROM module WHERE vsn=?",
+                (vsn,)).fetchone()
+            if module is None:
+                return None
+            entries = [(number, str(recording), size) \
+                       for (number, recording, size) in connection.execute(
+                           "SELECT number, recording, size FROM module_scan "
+                           "WHERE vsn=? ORDER BY number", (vsn,))]
+        return import_proxy.Bunch(updated=module[0], scans=module[1], 
+                                  bytes=module[2], entries=entries)
+
+    def store_check(self, host, recording, chunks, size, reply):
+        """
+        Store the reply of a successful check of recording (or file) on host
+        chunks: identification of the chunk set, see checks.chunk_set_key
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO check_result VALUES (?,?,?,?,?,?)",
+                (host, recording, chunks, size, time.time(), reply))
+
+    def load_check(self, host, recording, chunks, size):
+        """
+        Returns the reply of the check stored by store_check, None if unknown
+        """
+        with self._connect() as connection:
+            check = connection.execute(
+                "SELECT reply FROM check_result WHERE host=? AND "
+                "recording=? AND chunks=? AND size=?",
+                (host, recording, chunks, size)).fetchone()
+        return None if check is None else str(check[0])
+
+def _str(value):
+    # sqlite returns unicode, the rest of the code works with str
+    return None if value is None else str(value)
+
+_catalog = None
+_catalog_lock = threading.Lock()
+def get_catalog():
+    """
+    Returns the process wide catalog,
+    or None if the catalog is disabled or cannot be opened
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            file_name = import_proxy.get_settings()["catalog"]
+            if not file_name:
+                _catalog = False
+            else:
+                try:
+                    _catalog = Inventory_Catalog(file_name)
+                except Exception as e:
+                    print "warning, failed to open inventory catalog "\
+                        "'{f}': {e}".format(f=file_name, e=e)
+                    _catalog = False
+        return _catalog or None
@@ -0,0 +1,162 @@
+from checks import run_checks
+from import_proxy import get_settings
+from shared import Text_Edit_Dialog
+
+import PyQt4.QtGui as QtGui
+import PyQt4.QtCore as QtCore
+
+import threading
+
+class Sort_Item(QtGui.QTableWidgetItem):
+    """
+    Table item sorting on a key instead of the displayed text
+    """
+    def __init__(self, text, sort_key):
+        super(Sort_Item, self).__init__(text)
+        self.sort_key = sort_key
+
+    def __lt__(self, other):
+        return self.sort_key < getattr(other, "sort_key", None)
+
+class Check_Dialog(QtGui.QDialog):
+    """
+    Runs the check tasks (see checks.Check_Task) in the background,
+    and shows the results in a sortable table as they arrive
+    """
+    header_labels = ["Recording", "Host", "Format", "Data rate", "Problems"]
+
+    # task, raw reply, parsed result
+    check_done = QtCore.pyqtSignal(object, str, object)
+    checks_finished = QtCore.pyqtSignal()
+
+    def __init__(self, tasks, parent=None):
+        super(Check_Dialog, self).__init__(parent)
+        self.setWindowTitle("Scan check")
+        self.setSizeGripEnabled(True)
+        self.total = len(tasks)
+        self.replies = [] # [(task, raw reply)] in order of arrival
+        self.problem_count = 0
+        self.cached_count = 0
+
+        layout = QtGui.QVBoxLayout(self)
+        self.status_label = QtGui.QLabel(self)
+        layout.addWidget(self.status_label)
+        self.table = QtGui.QTableWidget(0, len(self.header_labels), self)
+        self.table.setHorizontalHeaderLabels(self.header_labels)
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSortingEnabled(True)
+        self.table.cellDoubleClicked.connect(self._show_reply)
+        layout.addWidget(self.table)
+
+        button_box = QtGui.QDialogButtonBox(self)
+        self.replies_button = button_box.addButton(
+            "Show replies", QtGui.QDialogButtonBox.ActionRole)
+        self.replies_button.clicked.connect(self._show_replies)
+        self.stop_button = button_box.addButton(
+            "Stop", QtGui.QDialogButtonBox.ActionRole)
+        self.stop_button.clicked.connect(self.stop)
+        close_button = button_box.addButton(QtGui.QDialogButtonBox.Close)
+        close_button.clicked.connect(self.close)
+        layout.addWidget(button_box)
+        self.resize(800, 400)
+
+        self.check_done.connect(self._add_result)
+        self.checks_finished.connect(self._finished)
+        self._update_status()
+
+        settings = get_settings()
+        self.stop_event = threading.Event()
+        # the checks report back through signals, which are delivered in the
+        # GUI thread
+        self.thread = threading.Thread(
+            target=self._run,
+            args=(tasks, settings["check_max_hosts"],
+                  settings["check_max_per_host"]))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, tasks, max_hosts, max_per_host):
+        try:
+            run_checks(tasks,
+                       lambda task, reply, result: \
+                       self.check_done.emit(task, reply, result),
+                       max_hosts, max_per_host, self.stop_event)
+        finally:
+            self.checks_finished.emit()
+
+    def _update_status(self, finished=False):
+        done = len(self.replies)
+        text = "Checked {d} of {t}, {p} with problems".format(
+            d=done, t=self.total, p=self.problem_count)
+        if self.cached_count > 0:
+            text += ", {c} unchanged since an earlier check".format(
+                c=self.cached_count)
+        if finished and (done < self.total):
+            text += ", stopped"
+        self.status_label.setText(text)
+
+    def _add_result(self, task, reply, result):
+        reply = str(reply)
+        index = len(self.replies)
+        self.replies.append((task, reply))
+        if result.problems:
+            self.problem_count += 1
+        if result.cached:
+            self.cached_count += 1
+            reply += "\n(unchanged since an earlier check)"
+
+        # inserting with sorting enabled would move the row while it is
+        # being filled
+        self.table.setSortingEnabled(False)
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        data_rate = Sort_Item(result.data_rate, result.data_rate_value)
+        data_rate.setTextAlignment(QtCore.Qt.AlignRight |
+                                   QtCore.Qt.AlignVCenter)
+        items = [QtGui.QTableWidgetItem(task.recording),
+                 QtGui.QTableWidgetItem(task.machine),
+                 QtGui.QTableWidgetItem(result.format),
+                 data_rate,
+                 QtGui.QTableWidgetItem(result.problems)]
+        for column, item in enumerate(items):
+            item.setData(QtCore.Qt.UserRole, index)
+            item.setToolTip(reply)
+            if result.problems:
+                item.setForeground(QtGui.QBrush(QtCore.Qt.red))
+            self.table.setItem(row, column, item)
+        self.table.setSortingEnabled(True)
+        if index == 0:
+            self.table.resizeColumnsToContents()
+        self._update_status()
+
+    def _finished(self):
+        self.stop_button.setEnabled(False)
+        self.table.resizeColumnsToContents()
+        self._update_status(True)
+
+    def _show_reply(self, row, column):
+        (index, ok) = self.table.item(row, 0).data(QtCore.Qt.UserRole).toInt()
+        if ok:
+            self._show_text(self.replies[index][1])
+
+    def _show_replies(self):
+        self._show_text("\n".join(reply for (_, reply) in self.replies))
+
+    def _show_text(self, text):
+        box = Text_Edit_Dialog(text, self)
+        box.show()
+        box.raise_()
+
+    def stop(self):
+        """
+        don't start new checks, the running checks are finished
+        """
+        self.stop_event.set()
+        self.stop_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        self.stop()
+        super(Check_Dialog, self).closeEvent(event)
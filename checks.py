@@ -0,0 +1,274 @@
+"""
+Running scan_check?/file_check? on (many) recordings in the background.
+The checks run concurrently over hosts, and, as far as the state of jive5ab
+allows, concurrently on each host. Results are reported as they complete.
+Successful replies are cached by recording identity (host, recording,
+chunk set, size), in memory and in the catalog, such that checking an
+unchanged recording again doesn't read the data again.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import (execute_query, send_query, split_reply,
+                          get_settings, Bunch)
+from inventory_backend import run_in_threads
+from catalog import get_catalog
+from mark5_directory import select_bank
+import control_pool
+
+import collections
+import threading
+import hashlib
+import Queue
+import re
+
+class Check_Task(object):
+    def __init__(self, machine, host, port, recording, query, prepare=None,
+                 stateful=False, cache_key=None):
+        """
+        machine: host name to display
+        host, port: jive5ab control address
+        recording: recording (or file) name to display
+        query: the check query, e.g. "scan_check?"
+        prepare: list of queries (with acceptable return codes "0") or
+          callable(socket), to execute before the query
+        stateful: whether the check depends on state of jive5ab shared with
+          other checks (e.g. the scan set or the bank), stateful checks run
+          one at a time per host
+        cache_key: (host, recording, chunk set, size) identifying the checked
+          data (see chunk_set_key), None to always check
+        """
+        self.machine = machine
+        self.host = host
+        self.port = port
+        self.recording = recording
+        self.query = query
+        self.prepare = prepare if prepare is not None else []
+        self.stateful = stateful
+        self.cache_key = cache_key
+
+    def run(self, socket):
+        """
+        returns the reply of the check query
+        """
+        for step in self.prepare:
+            if callable(step):
+                step(socket)
+            else:
+                execute_query(socket, step, ["0"])
+        return send_query(socket, self.query)
+
+def chunk_set_key(chunks):
+    """
+    chunks = { chunk path : bytes } or None if unknown
+    returns a short string identifying the chunk set, for use in a cache key
+    """
+    if chunks is None:
+        return ""
+    digest = hashlib.sha1()
+    for (path, size) in sorted(chunks.items()):
+        digest.update("{p}:{s}\n".format(p=path, s=size))
+    return digest.hexdigest()
+
+def flexbuff_check(flexbuff, recording, size=None, chunks=None):
+    """
+    returns the Check_Task of a recording on a FlexBuff, or of a file chunk
+    if recording is a path
+    size: bytes of the recording (or chunk), None if unknown (not cached)
+    chunks: { chunk path : bytes } of the recording, None if unknown
+    """
+    if recording.startswith("/"):
+        return Check_Task(
+            flexbuff.machine, flexbuff.machine, flexbuff.port, recording,
+            "file_check?::{f}".format(f=recording),
+            cache_key=None if size is None else \
+            (flexbuff.machine, recording, "", size))
+    # the scan set is shared by the connections
+    return Check_Task(
+        flexbuff.machine, flexbuff.machine, flexbuff.port,
+        recording, "scan_check?",
+        ["scan_set={r}".format(r=recording)],
+        stateful=True,
+        cache_key=None if size is None else \
+        (flexbuff.machine, recording, chunk_set_key(chunks), size))
+
+def mark5_check(mark5, bank, number, scan, vsn=None, size=None):
+    """
+    returns the Check_Task of scan number of the module in bank of a Mark5
+    vsn, size: of the module and scan, None if unknown (not cached)
+    """
+    # the scan on the module is identified by the VSN and number
+    return Check_Task(
+        mark5.control_ip, mark5.control_ip, mark5.port,
+        scan, "scan_check?",
+        [lambda s: select_bank(s, bank),
+         "scan_set={scan}".format(scan=number)],
+        stateful=True,
+        cache_key=None if (vsn is None) or (size is None) else \
+        (mark5.control_ip, scan, "{v}#{n}".format(v=vsn, n=number), size))
+
+def file_check(machine, path, size=None):
+    """
+    returns the Check_Task of a file on a file machine
+    """
+    return Check_Task(machine.control_ip, machine.control_ip, machine.port,
+                      path, "file_check?::{f}".format(f=path),
+                      cache_key=None if size is None else \
+                      (machine.control_ip, path, "", size))
+
+_results = {} # {cache key : reply}
+_results_lock = threading.Lock()
+def get_cached_reply(cache_key):
+    """
+    returns the cached reply of the check of cache_key, None if unknown
+    """
+    with _results_lock:
+        reply = _results.get(cache_key)
+    if reply is not None:
+        return reply
+    settings = get_settings()
+    catalog = get_catalog() if settings["check_cache_on_disk"] else None
+    if catalog:
+        try:
+            reply = catalog.load_check(*cache_key)
+        except Exception as e:
+            print "warning, check catalog failed: {e}".format(e=e)
+    if reply is not None:
+        with _results_lock:
+            _results[cache_key] = reply
+    return reply
+
+def store_cached_reply(cache_key, reply):
+    with _results_lock:
+        _results[cache_key] = reply
+    settings = get_settings()
+    catalog = get_catalog() if settings["check_cache_on_disk"] else None
+    if catalog:
+        try:
+            catalog.store_check(cache_key[0], cache_key[1], cache_key[2],
+                                cache_key[3], reply)
+        except Exception as e:
+            print "warning, check catalog failed: {e}".format(e=e)
+
+def invalidate_checks(host, sizes):
+    """
+    drop the cached checks on host of the recordings (or chunk paths) in
+    sizes = { recording : bytes }, of which the size changed
+    (the catalog does the same when an inventory is stored)
+    """
+    with _results_lock:
+        for key in [key for key in _results.keys() \
+                    if (key[0] == host) and (key[1] in sizes) and \
+                    (sizes[key[1]] != key[3])]:
+            del _results[key]
+
+# the leading number of e.g. "2048.000Mbps"
+number_regexp = re.compile("[-+]?\d+(\.\d*)?")
+
+def parse_check_reply(reply):
+    """
+    returns Bunch(format, data_rate, data_rate_value, problems, cached)
+    of a scan_check?/file_check? reply
+    !scan_check? 0 : <recording> : <format> : ... : <start time> :
+      <length> : <data rate> : <missing bytes> [: ...] ;
+    fields after the missing bytes are optional and ignored
+    """
+    split = split_reply(reply)
+    problems = []
+    data_format = ""
+    data_rate = ""
+    data_rate_value = None
+    if len(split) < 2:
+        problems.append("unexpected reply")
+    elif split[1] != "0":
+        problems.append("return code {c}: {m}".format(
+            c=split[1], m=" : ".join(split[2:])))
+    elif len(split) < 9:
+        problems.append("unexpected reply")
+    else:
+        data_format = split[3]
+        if data_format in ["?", "-", "none", "unknown"]:
+            problems.append("unknown data format")
+        data_rate = split[7]
+        match = number_regexp.match(data_rate)
+        if match:
+            data_rate_value = float(match.group(0))
+        try:
+            missing = int(split[8])
+        except ValueError:
+            missing = 0
+        if missing != 0:
+            problems.append("{n} missing bytes".format(n=missing))
+    return Bunch(format=data_format, data_rate=data_rate,
+                 data_rate_value=data_rate_value,
+                 problems=", ".join(problems), cached=False)
+
+def _is_success(reply):
+    split = split_reply(reply)
+    return (len(split) >= 2) and (split[1] == "0")
+
+def run_checks(tasks, callback, max_hosts=4, max_per_host=2, stop=None):
+    """
+    run the check tasks, blocks until done
+    callback: callable(task, reply, result), called from the checking
+      threads as each check completes,
+      reply is the raw reply (or the error message),
+      result as returned by parse_check_reply, with cached True if the
+      reply came from the cache
+    max_hosts: number of hosts to check at the same time
+    max_per_host: number of concurrent checks per host
+    stop: optional threading.Event, no new checks are started once set
+    """
+    use_cache = get_settings()["check_cache"]
+    host_tasks = collections.OrderedDict()
+    for task in tasks:
+        if use_cache and (task.cache_key is not None):
+            reply = get_cached_reply(task.cache_key)
+            if reply is not None:
+                result = parse_check_reply(reply)
+                result.cached = True
+                callback(task, reply, result)
+                continue
+        host_tasks.setdefault((task.host, task.port), []).append(task)
+
+    def check_host((host, port), tasks):
+        queue = Queue.Queue()
+        for task in tasks:
+            queue.put(task)
+        # stateful checks share the state of jive5ab on the host
+        stateful_lock = threading.Lock()
+        def worker():
+            while (stop is None) or (not stop.is_set()):
+                try:
+                    task = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    if task.stateful:
+                        with stateful_lock:
+                            with control_pool.connection(host, port,
+                                                         timeout=60) as s:
+                                reply = task.run(s)
+                    else:
+                        with control_pool.connection(host, port,
+                                                     timeout=60) as s:
+                            reply = task.run(s)
+                    result = parse_check_reply(reply)
+                    if use_cache and (task.cache_key is not None) and \
+                       _is_success(reply):
+                        # errors might be temporary, don't remember those
+                        store_cached_reply(task.cache_key, reply)
+                except Exception as e:
+                    reply = str(e)
+                    result = Bunch(format="", data_rate="",
+                                   data_rate_value=None,
+                                   problems="check failed: " + reply,
+                                   cached=False)
+                callback(task, reply, result)
+        workers = min(max_per_host, len(tasks))
+        run_in_threads([worker] * workers, workers)
+
+    run_in_threads([lambda host_address=host_address,
+                           host_task_list=host_task_list: \
+                    check_host(host_address, host_task_list) \
+                    for (host_address, host_task_list) in host_tasks.items()],
+                   max_hosts)
@@ -1,4 +1,8 @@
 from shared import Text_Edit_Dialog
+from transfer_scheduler import Transfer_Scheduler
+from transfer_journal import get_journal, reconcile
+from batch_jobs import Batch_Jobs
+from job_model import Job_List_Model
 
 import PyQt4.QtGui as QtGui
 import PyQt4.QtCore as QtCore
@@ -10,6 +14,7 @@ except AttributeError:
     QtGui.QWIDGETSIZE_MAX = ((1 << 24) - 1)
 
 import subprocess
+import threading
 import shlex
 import signal
 import os
@@ -72,13 +77,23 @@ class Command_Progress_Widget(QtGui.QWidget):
         self.label_layout.addWidget(self.command_label)
         self.layout.addLayout(self.label_layout)
         self.total_commands = total_commands
+        self.running = [] # indices of the running commands
 
-    def set_command_index(self, index):
-        self.command_label.setText("Executing command {n} of {t}".format(
-            n=index+1,
+    def _update_label(self):
+        self.command_label.setText("Executing command{s} {n} of {t}".format(
+            s="s" if len(self.running) > 1 else "",
+            n=", ".join(str(index+1) for index in sorted(self.running)),
             t=self.total_commands))
 
-    def process_output(self, text):
+    def command_started(self, index):
+        self.running.append(index)
+        self._update_label()
+
+    def command_finished(self, index):
+        self.running.remove(index)
+        self._update_label()
+
+    def process_output(self, index, line):
         pass
 
 class Command_Dialog(QtGui.QDialog):
@@ -88,7 +103,22 @@ class Command_Dialog(QtGui.QDialog):
     - generate_commands: a list of shell commands to execute.
     - self.progress_display_class: a (subclass of) Command_Progress_Widget
     - add_config_widgets: which adds widgets to the given (QVBox) layout
+    and might override:
+    - create_scheduler: to run commands concurrently
+    - prepare_command: to adapt a command to the slot it runs in
+    - journaled: to keep the state of the commands in the transfer journal,
+      such that they can be resumed after the program stopped
+    - telemetry: to record the progress of the commands in the transfer
+      telemetry
+    - command_output: to follow the output of the commands as they run,
+      it is called per line of output
     """
+    journaled = False
+    telemetry = False
+
+    # the commands of a resumed batch that are not done
+    reconciled = QtCore.pyqtSignal(list)
+
     def _show_help(self):
         output = subprocess.check_output(shlex.split("{command} -h".format(
             command=self.command)))
@@ -100,30 +130,134 @@ class Command_Dialog(QtGui.QDialog):
         raise NotImplementedError()
 
     def _display_commands(self):
-        commands = self.generate_commands()
-        
-        # set the width of the window such that no horizontal scroll is
-        # required for bold text (indicating done)
-        font =  self.commands_widget.document().defaultFont()
-        font.setWeight(QtGui.QFont.Bold)
-        metrics = QtGui.QFontMetrics(font)
-        text = "\n".join(commands)
-        size = metrics.size(0, text)
-        self.commands_widget.setMinimumWidth(size.width() + 30)
-        
-        self.commands_widget.setText(text)
+        self._show_commands(self.generate_commands())
+
+    def _show_commands(self, commands):
+        self.jobs.set_commands(commands)
+        if self.edit_button.isChecked():
+            self.commands_widget.setPlainText("\n".join(commands))
+        # the view only measures the rows in view
+        self.jobs_view.resizeColumnToContents(self.jobs.command_column)
+        self.jobs_view.setMinimumWidth(
+            min(1200, self.jobs_view.horizontalHeader().length() + 30))
+
+    def _set_text_mode(self, text_mode):
+        """
+        switch between the job list and editing the commands as text
+        """
+        if text_mode:
+            self.commands_widget.setPlainText("\n".join(self.jobs.commands()))
+            self.commands_stack.setCurrentWidget(self.commands_widget)
+        else:
+            self._show_commands(
+                [command for command in \
+                 str(self.commands_widget.toPlainText()).split("\n") \
+                 if command.strip()])
+            self.commands_stack.setCurrentWidget(self.jobs_view)
+
+    def create_scheduler(self):
+        """
+        return the transfer_scheduler.Transfer_Scheduler deciding which
+        commands run at the same time, by default one at a time
+        """
+        return Transfer_Scheduler(max_total=1)
+
+    def expected_size(self, command):
+        """
+        return the number of bytes command should produce at the
+        destination, None if unknown
+        """
+        return self.expected_sizes.get(command)
+
+    def _show_job_state(self, index):
+        self.jobs.set_state(index, self._batch_jobs.states[index],
+                            self.expected_size(self._commands[index]))
+
+    def _discard_batch(self):
+        if self._batch_jobs is not None:
+            self._batch_jobs.discard_batch()
+
+    def resume(self, batch):
+        """
+        continue with the unfinished commands of a journaled batch of an
+        earlier session, the commands that were running are checked first
+        """
+        self.setWindowTitle(batch.title)
+        self.apply_button.setEnabled(False)
+        self.go_button.setEnabled(False)
+        self.edit_button.setChecked(True)
+        self.edit_button.setEnabled(False)
+        self.commands_widget.setReadOnly(True)
+        self.commands_widget.setPlainText(
+            "Checking the destinations of interrupted commands...")
+        self.expected_sizes = {job.command : job.size for job in batch.jobs \
+                               if job.size is not None}
+        def check():
+            journal = get_journal()
+            try:
+                jobs = reconcile(journal, batch)
+            except Exception as e:
+                print "warning, failed to check the destinations: "\
+                    "{e}".format(e=e)
+                jobs = [job for job in batch.jobs if job.state != "done"]
+            try:
+                # the remaining commands run as a new batch
+                journal.discard_batch(batch.id)
+            except Exception as e:
+                print "warning, transfer journal failed: {e}".format(e=e)
+            self.reconciled.emit([job.command for job in jobs])
+        thread = threading.Thread(target=check)
+        thread.daemon = True
+        thread.start()
+
+    def _show_reconciled(self, commands):
+        self.commands_widget.setPlainText("\n".join(commands))
+        self.commands_widget.setReadOnly(False)
+        self.edit_button.setEnabled(True)
+        # back to the job list, which takes the commands from the text
+        self.edit_button.setChecked(False)
+        self.go_button.setEnabled(True)
+
+    def command_output(self, index, line, progress):
+        """
+        progress: see Batch_Jobs.output
+        """
+        pass
+
+    def prepare_command(self, command, slot):
+        """
+        return command as it should be executed,
+        slot: see Transfer_Scheduler.next_jobs
+        """
+        return command
 
     def _run_commands(self):
-        if self._process:
+        if self._processes:
             return
         self.apply_button.setEnabled(False)
         self.go_button.setEnabled(False)
         self.cancel_button.setText("Abort")
-        self.commands_widget.setReadOnly(True)
-        self._line_number = 0
+        self.edit_button.setChecked(False)
+        self.edit_button.setEnabled(False)
         self._continue = True
+        self._failed = False
+        self.jobs.reset_states()
+        self._commands = self.jobs.commands()
+        # a batch of an earlier run of the dialog is replaced
+        self._discard_batch()
+        self._batch_jobs = Batch_Jobs(
+            self.command, self._commands,
+            {command : self.expected_size(command) \
+             for command in self._commands},
+            self.telemetry)
+        if self.journaled:
+            self._batch_jobs.create_batch(str(self.windowTitle()))
+        self._scheduler = self.create_scheduler()
+        for (index, command) in enumerate(self._commands):
+            if command.strip():
+                self._scheduler.add(index, command)
         self.progress_widget = self.progress_display_class(
-            len(str(self.commands_widget.toPlainText()).split("\n")), self)
+            len(self._commands), self)
         self.stop_button = QtGui.QPushButton("Stop on next", self)
         self.stop_button.setCheckable(True)
         # replace stretch with the progress widget and stop on next button
@@ -131,65 +265,85 @@ class Command_Dialog(QtGui.QDialog):
         self.control_layout.insertWidget(0, self.progress_widget, 1)
         self.control_layout.insertWidget(1, self.stop_button)
         
-        self._start_process()
-
-    def _set_command_line_format(self, line_number, format_):
-        self.commands_widget.moveCursor(QtGui.QTextCursor.Start)
-        for i in xrange(line_number):
-            self.commands_widget.moveCursor(QtGui.QTextCursor.Down)
-        self.commands_widget.moveCursor(QtGui.QTextCursor.EndOfLine,
-                                        QtGui.QTextCursor.KeepAnchor)
-        self.commands_widget.mergeCurrentCharFormat(format_)
-        self.commands_widget.moveCursor(QtGui.QTextCursor.StartOfLine)
-        self.commands_widget.ensureCursorVisible()
-
-    def _start_process(self):
+        self._start_processes()
+
+    def _show_running(self):
+        if self._processes:
+            self.jobs_view.scrollTo(self.jobs.index(min(self._processes), 0))
+
+    def _start_processes(self):
+        if self._continue and (not self._failed) and \
+           (not self.stop_button.isChecked()):
+            for (index, slot) in self._scheduler.next_jobs():
+                self._start_process(index, slot)
+        self._show_running()
+        if not self._processes:
+            self._batch_finished()
+
+    def _batch_finished(self):
+        if self._failed or (not self._continue):
+            self._handle_error()
+            return
+        self.cancel_button.setText("Done")
+        if self.stop_button.isChecked():
+            self.go_button.setText("Reuse")
+            self.go_button.setEnabled(True)
+        else:
+            # nothing left to resume
+            self._discard_batch()
+
+    def _start_process(self, index, slot):
         try:
-            commands = str(self.commands_widget.toPlainText()).split("\n")
-            if (self._line_number >= len(commands)) or \
-               self.stop_button.isChecked():
-                self.cancel_button.setText("Done")
-                if self.stop_button.isChecked():
-                    self.go_button.setText("Reuse")
-                    self.go_button.setEnabled(True)
-                return
-            self.progress_widget.set_command_index(self._line_number)
-            
-            # highlight current line
-            self.commands_widget.moveCursor(QtGui.QTextCursor.Start)
-            for i in xrange(self._line_number):
-                self.commands_widget.moveCursor(QtGui.QTextCursor.Down)
-            line = QtGui.QTextEdit.ExtraSelection()
-            line.format.setBackground(
-                QtGui.QColor(QtCore.Qt.yellow).lighter(160))
-            line.format.setProperty(QtGui.QTextFormat.FullWidthSelection, True)
-            line.cursor = self.commands_widget.textCursor()
-            line.cursor.clearSelection()
-            self.commands_widget.setExtraSelections([line])
-
-            command = shlex.split(commands[self._line_number])
-            self._process = QtCore.QProcess(self)
+            command = shlex.split(
+                self.prepare_command(self._commands[index], slot))
+            process = QtCore.QProcess(self)
             # be sure we get all output, merge stdout with stderr
-            self._process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
-            self._output = [] # list of strings
-            self._process.readyReadStandardOutput.connect(self._check_progress)
-            self._process.finished.connect(self._process_finished)
-            self._process.error.connect(self._process_error)
-            self._process.start(command[0], command[1:])
+            process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+            process.readyReadStandardOutput.connect(
+                lambda: self._check_progress(index))
+            process.finished.connect(
+                lambda exit_code, exit_status: \
+                self._process_finished(index, exit_code, exit_status))
+            process.error.connect(
+                lambda error: self._process_error(index, error))
+            self._processes[index] = process
+            self.progress_widget.command_started(index)
+            self._batch_jobs.start(index)
+            self._show_job_state(index)
+            process.start(command[0], command[1:])
         except Exception as e:
             QtGui.QMessageBox.critical(self, 
                                        "Failed to start {}".format(self.command),
                                        "Exception: {e}".format(e=e))
-            self._process = None
-            self.cancel_button.setText("Close")
+            if self._command_done(index) is None:
+                self._scheduler.finish(index)
+            self._batch_jobs.finish(index, False)
+            self._show_job_state(index)
+            self._failed = True
+
+    def _command_done(self, index):
+        """
+        returns the process of the command, None if it was already done
+        """
+        process = self._processes.pop(index, None)
+        if process is None:
+            return None
+        self._scheduler.finish(index)
+        self.progress_widget.command_finished(index)
+        return process
 
     def _handle_error(self):
         self.cancel_button.setText("Close")
         self.go_button.setText("Reuse")
         self.go_button.setEnabled(True)
 
-    def _process_error(self, error):
-        self.commands_widget.setExtraSelections([])
+    def _process_error(self, index, error):
+        if self._command_done(index) is None:
+            # already handled as finished
+            return
+        self._batch_jobs.finish(index, False)
+        self._show_job_state(index)
+        self._failed = True
         box = QtGui.QMessageBox(
             QtGui.QMessageBox.Warning,
             "Command failed",
@@ -197,45 +351,53 @@ class Command_Dialog(QtGui.QDialog):
             QtGui.QMessageBox.Ok,
             self)
         box.exec_()
-        self._process = None
-
-        self._handle_error()
-
-    def _process_finished(self, exit_code, exit_status):
-        self.commands_widget.setExtraSelections([])
-        if self._process:
-            text = str(self._process.readAllStandardOutput())
-            self._output.append(text)
-        self._process = None
-        if (exit_code != 0) or (not self._continue):
-            if self._continue:
+
+        self._start_processes()
+
+    def _process_finished(self, index, exit_code, exit_status):
+        success = (exit_code == 0) and \
+            (exit_status == QtCore.QProcess.NormalExit)
+        process = self._processes.get(index)
+        if process is None:
+            # already handled as error
+            return
+        # the last output, before the progress of the command is closed
+        self._handle_output(index, str(process.readAllStandardOutput()))
+        self._command_done(index)
+        output = self._batch_jobs.finish(index, success)
+        self._show_job_state(index)
+        if (not success) or (not self._continue):
+            if self._continue and (not self._failed):
                 # only show error if it's unexpected
+                self._failed = True
+                message = "{} returned an error, click for its last "\
+                    "output".format(self.command)
+                if output.log_file_name:
+                    message += "\nFull output: {f}".format(
+                        f=output.log_file_name)
                 box = Message_Box_Resize(
                     QtGui.QMessageBox.Warning,
                     "Command failed",
-                    "{} returned an error, click for all output".format(
-                        self.command),
+                    message,
                     QtGui.QMessageBox.Ok,
                     self)
-                box.setDetailedText(''.join(self._output))
+                box.setDetailedText(output.text())
                 box.exec_()
-            self._handle_error()
-        else:
-            # make the just finished line bold
-            format_ = QtGui.QTextCharFormat()
-            format_.setFontWeight(QtGui.QFont.Bold)
-            self._set_command_line_format(self._line_number, format_)
+            self._failed = True
             
-            self._line_number += 1
-            self._start_process()
+        self._start_processes()
             
+    def _interrupt_all(self):
+        for process in self._processes.values():
+            os.kill(process.pid(), signal.SIGINT)
+
     def _cancel_button_clicked(self):
         if str(self.cancel_button.text()) == "Abort":
             self._continue = False
-            if self._process:
-                os.kill(self._process.pid(), signal.SIGINT)
+            self._interrupt_all()
         else:
             # close
+            self._discard_batch()
             self.deleteLater()
             self.accept()
 
@@ -248,7 +410,7 @@ class Command_Dialog(QtGui.QDialog):
         self.control_layout.insertStretch(0, 1)
 
         self.apply_button.setEnabled(True)
-        self.commands_widget.setReadOnly(False)
+        self.edit_button.setEnabled(True)
         self.go_button.setText("Go")
 
     def _go_button_clicked(self):
@@ -258,18 +420,27 @@ class Command_Dialog(QtGui.QDialog):
             self._set_reuse()
 
     def stop(self):
-        if self._process:
-            os.kill(self._process.pid(), signal.SIGINT)
-            self._process.waitForFinished(-1)
+        # the program is closing, keep the journal as it is, such that the
+        # interrupted commands are resumed on the next start
+        if self._batch_jobs is not None:
+            self._batch_jobs.stopping = True
+        processes = self._processes.values()
+        self._interrupt_all()
+        for process in processes:
+            process.waitForFinished(-1)
 
     def _disconnect_stop(self):
         QtGui.QApplication.instance().lastWindowClosed.disconnect(self.stop)
 
-    def _check_progress(self):
-        if self._process:
-            text = str(self._process.readAllStandardOutput())
-            self._output.append(text)
-            self.progress_widget.process_output(text)
+    def _check_progress(self, index):
+        process = self._processes.get(index)
+        if process:
+            self._handle_output(index, str(process.readAllStandardOutput()))
+
+    def _handle_output(self, index, text):
+        for (line, progress) in self._batch_jobs.output(index, text):
+            self.progress_widget.process_output(index, line)
+            self.command_output(index, line, progress)
 
     def _suggest_click_apply(self):
         self.apply_button.setStyleSheet("background-color: firebrick")
@@ -292,14 +463,33 @@ class Command_Dialog(QtGui.QDialog):
         button_layout.addWidget(help_button)
         help_button.clicked.connect(self._show_help)
         button_layout.addStretch(1)
+        self.edit_button = QtGui.QPushButton("Edit as text", self)
+        self.edit_button.setCheckable(True)
+        button_layout.addWidget(self.edit_button)
         self.apply_button = QtGui.QPushButton("Apply", self)
         button_layout.addWidget(self.apply_button)
         self.apply_button.clicked.connect(self._display_commands)
         master_layout.addLayout(button_layout)
 
-        self.commands_widget = QtGui.QTextEdit(self)
+        # the commands are shown as a job list, or as free text for editing
+        self.commands_stack = QtGui.QStackedWidget(self)
+        self.jobs = Job_List_Model(self)
+        self.jobs_view = QtGui.QTableView(self.commands_stack)
+        self.jobs_view.setModel(self.jobs)
+        self.jobs_view.setSelectionBehavior(
+            QtGui.QAbstractItemView.SelectRows)
+        self.jobs_view.setShowGrid(False)
+        self.jobs_view.setWordWrap(False)
+        self.jobs_view.horizontalHeader().setStretchLastSection(True)
+        self.jobs_view.verticalHeader().setResizeMode(
+            QtGui.QHeaderView.Fixed)
+        self.commands_stack.addWidget(self.jobs_view)
+        self.commands_widget = QtGui.QTextEdit(self.commands_stack)
         self.commands_widget.setLineWrapMode(QtGui.QTextEdit.NoWrap)
-        master_layout.addWidget(self.commands_widget)
+        self.commands_widget.setAcceptRichText(False)
+        self.commands_stack.addWidget(self.commands_widget)
+        master_layout.addWidget(self.commands_stack)
+        self.edit_button.toggled.connect(self._set_text_mode)
 
         self.control_layout = QtGui.QHBoxLayout()
         self.control_layout.addStretch(1)
@@ -315,8 +505,16 @@ class Command_Dialog(QtGui.QDialog):
         
         master_layout.addLayout(self.control_layout)
 
+        self.expected_sizes = {} # {command : bytes at the destination}
         self._display_commands()
-        self._process = None
+        self._processes = {} # {command index : QProcess}
+        # the states, journal and output of the commands of the last run
+        self._batch_jobs = None
+        self.reconciled.connect(self._show_reconciled)
+
+        self.duration_timer = QtCore.QTimer(self)
+        self.duration_timer.timeout.connect(self.jobs.update_durations)
+        self.duration_timer.start(1000)
 
         # make sure the process is stopped when the application is
         QtGui.QApplication.instance().lastWindowClosed.connect(self.stop)
@@ -0,0 +1,109 @@
+"""
+jive5ab control connection driven by the Qt event loop.
+Queries are queued on a QTcpSocket and their replies are delivered to
+callbacks, such that waiting for (or failing to reach) a jive5ab never
+blocks the GUI thread. For queries from background threads, use the
+blocking connections of control_pool.
+"""
+
+from import_proxy import (pop_reply, check_reply, split_reply,
+                          QueryReturnCodeError)
+
+import PyQt4.QtCore as QtCore
+import PyQt4.QtNetwork as QtNetwork
+
+import collections
+
+def _print_error(query, error):
+    print "'{q}' failed: {e}".format(q=query, e=error)
+
+class Control_Client(QtCore.QObject):
+    def __init__(self, host, port, timeout=10, parent=None):
+        """
+        timeout: seconds to wait for a connection or reply, after which all
+          queued queries fail
+        """
+        super(Control_Client, self).__init__(parent)
+        self.host = host
+        self.port = port
+        self.buffer = ""
+        # [(query, callback, errback, acceptable replies)]
+        self.unsent = collections.deque()
+        self.sent = collections.deque()
+
+        self.socket = QtNetwork.QTcpSocket(self)
+        self.socket.connected.connect(self._send_queued)
+        self.socket.readyRead.connect(self._read)
+        self.socket.error.connect(self._socket_error)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(int(timeout * 1000))
+        self.timer.timeout.connect(self._timeout)
+
+    def query(self, query, callback, errback=None,
+              acceptable_replies=["0", "1"]):
+        """
+        send query, callback(split reply) is called when the reply arrives,
+        errback(exception) if the query failed or the return code is not in
+        acceptable_replies (None to accept any)
+        """
+        if errback is None:
+            errback = lambda error: _print_error(query, error)
+        self.unsent.append((query, callback, errback, acceptable_replies))
+        state = self.socket.state()
+        if state == QtNetwork.QAbstractSocket.UnconnectedState:
+            self.socket.connectToHost(self.host, self.port)
+            self.timer.start()
+        elif state == QtNetwork.QAbstractSocket.ConnectedState:
+            self._send_queued()
+
+    def close(self):
+        self._fail_all(RuntimeError("connection closed"))
+
+    def _send_queued(self):
+        while self.unsent:
+            entry = self.unsent.popleft()
+            self.socket.write(entry[0] + ";\n\r")
+            self.sent.append(entry)
+        if self.sent:
+            self.timer.start()
+
+    def _read(self):
+        self.buffer += str(self.socket.readAll())
+        while self.sent:
+            (reply, self.buffer) = pop_reply(self.buffer)
+            if reply is None:
+                break
+            (query, callback, errback, acceptable) = self.sent.popleft()
+            if self.sent:
+                self.timer.start()
+            else:
+                self.timer.stop()
+            if acceptable is None:
+                callback(split_reply(reply))
+                continue
+            try:
+                split = check_reply(query, reply, acceptable)
+            except QueryReturnCodeError as e:
+                errback(e)
+                continue
+            callback(split)
+
+    def _fail_all(self, error):
+        self.timer.stop()
+        self.socket.abort()
+        self.buffer = ""
+        failed = list(self.sent) + list(self.unsent)
+        self.sent.clear()
+        self.unsent.clear()
+        for (_, _, errback, _) in failed:
+            errback(error)
+
+    def _socket_error(self, _):
+        self._fail_all(RuntimeError("{h}:{p}: {e}".format(
+            h=self.host, p=self.port, e=self.socket.errorString())))
+
+    def _timeout(self):
+        self._fail_all(RuntimeError("{h}:{p}: no reply within {t}s".format(
+            h=self.host, p=self.port, t=self.timer.interval() // 1000)))
@@ -0,0 +1,149 @@
+"""
+Shared connections to the jive5ab control ports.
+Connections are kept open after use, such that repeated checks and listings
+don't have to connect again. An idle connection is checked before it is
+handed out again, connections that are closed by jive5ab or have been idle
+for too long are replaced by a new connection.
+"""
+
+import import_proxy
+
+import socket
+import select
+import threading
+import contextlib
+import time
+
+class Control_Connection(object):
+    """
+    A jive5ab control socket with the reader of its replies,
+    usable where the query functions of import_proxy expect a socket
+    """
+    def __init__(self, host, port, timeout=10):
+        self.address = (host, port)
+        self.socket = socket.create_connection(self.address, timeout)
+        # let the OS detect a peer that disappeared
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.reader = import_proxy.Reply_Reader(self.socket)
+        self.last_used = time.time()
+
+    def send(self, data):
+        return self.socket.send(data)
+
+    def sendall(self, data):
+        return self.socket.sendall(data)
+
+    def recv(self, size):
+        return self.socket.recv(size)
+
+    def getpeername(self):
+        return self.socket.getpeername()
+
+    def settimeout(self, timeout):
+        self.socket.settimeout(timeout)
+
+    def close(self):
+        self.socket.close()
+
+    def is_healthy(self):
+        """
+        an idle connection has nothing to read, if there is, the connection
+        is either closed or out of sync with the replies
+        """
+        if self.reader.buffer:
+            return False
+        try:
+            (readable, _, _) = select.select([self.socket], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+class Control_Connection_Pool(object):
+    def __init__(self, idle_timeout=60, max_idle=4):
+        """
+        idle_timeout: seconds after which an unused connection is closed
+        max_idle: maximum number of unused connections kept per
+          (host, port)
+        """
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {} # {(host, port) : [Control_Connection]}
+
+    def _take_idle(self, address):
+        now = time.time()
+        with self._lock:
+            connections = self._idle.get(address, [])
+            while connections:
+                connection = connections.pop()
+                if (now - connection.last_used < self.idle_timeout) and \
+                   connection.is_healthy():
+                    return connection
+                connection.close()
+        return None
+
+    def _return(self, connection):
+        connection.last_used = time.time()
+        with self._lock:
+            connections = self._idle.setdefault(connection.address, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    @contextlib.contextmanager
+    def connection(self, host, port, timeout=10):
+        """
+        a connection to jive5ab on (host, port) for the duration of the
+        context, for exclusive use
+        """
+        connection = self._take_idle((host, port))
+        if connection is None:
+            connection = Control_Connection(host, port, timeout)
+        else:
+            connection.settimeout(timeout)
+        try:
+            yield connection
+        except Exception as e:
+            if isinstance(e, (socket.error, EOFError)):
+                # (socket.timeout is a socket.error) the state of the
+                # connection is unknown, e.g. a reply might still be underway
+                connection.close()
+            else:
+                # e.g. QueryReturnCodeError, the connection is fine, 
+                # replies still underway are caught by is_healthy on reuse
+                self._return(connection)
+            raise
+        except:
+            connection.close()
+            raise
+        self._return(connection)
+
+    def close_all(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+_pool = None
+_pool_lock = threading.Lock()
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = import_proxy.get_settings()
+            _pool = Control_Connection_Pool(
+                idle_timeout=settings["control_idle_timeout"],
+                max_idle=settings["control_max_idle"])
+        return _pool
+
+def connection(host, port, timeout=10):
+    return get_pool().connection(host, port, timeout)
+
+def close_all():
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close_all()
@@ -0,0 +1,43 @@
+"""
+Listing directories of file machines, with ls over ssh.
+This module doesn't depend on Qt.
+"""
+
+import ssh_pool
+
+import subprocess
+import pipes
+import re
+
+#-rw-rw-r-- 1 jops jive    700 Sep  9 14:07 time_conversion.py
+# for now only handle directories and regular files
+ls_re = re.compile(
+    "\s*(?P<type>[d-])"
+    "(?P<permissions>([r-][w-][xTtsS-]){3})\s+"
+    "(?P<links>\d+)\s+"
+    "(?P<owner>\S+)\s+"
+    "(?P<group>\S+)\s+"
+    "(?P<size>\d+)\s+"
+    "(?P<date_time>\S+\s+\S+\s+\S+)\s+"
+    "(?P<name>.+)")
+
+def list_directory(user, host, directory):
+    """
+    returns [(name, is directory, number of bytes)] of the entries of
+    directory on host, number of bytes is None for directories
+    """
+    with ssh_pool.channel(user, host):
+        output = subprocess.check_output(ssh_pool.ssh_args(
+            user, host, "ls -l {dir_}".format(dir_=pipes.quote(directory))))
+    entries = []
+    for line in output.split("\n")[1:]: # first line is total line
+        match = ls_re.match(line)
+        if match:
+            groups = match.groupdict()
+            if groups["type"] == "d":
+                entries.append((groups["name"], True, None))
+            else:
+                entries.append((groups["name"], False, int(groups["size"])))
+        elif line:
+            print "warning, failed to match:", line
+    return entries
@@ -1,26 +1,30 @@
-from shared import get_flexbuff_meta_data, check_flexbuff, format_bytes
-from import_proxy import execute_query, send_query, Hashable_Bunch
+from shared import format_bytes, format_age
+from inventory import get_flexbuff_meta_data
+from inventory_backend import get_backend
+from import_proxy import get_settings, Bunch, Hashable_Bunch
+from catalog import get_catalog
+from checks import flexbuff_check, invalidate_checks
+from m5copy_commands import flexbuff_source, flexbuff_destination
+from inventory_store import Inventory_Store, diff_sorted
 from abstract_machine_view import (Invalid_Selection_Exception, 
-                                   Abstract_Machine_View, Tree_Widget_Item)
-import rename_widget
+                                   Abstract_Machine_View)
+from tree_model import Tree_Node
 
 
 import PyQt4.QtGui as QtGui
 import PyQt4.QtCore as QtCore
 
 import collections
-import contextlib
-import socket
-
-def disk_selection(flexbuff):
-    if flexbuff.machine_type == "mark6":
-        return "mk6"
-    else:
-        return flexbuff.machine_type
+import time
+import bisect
 
 class Flexbuff_View(Abstract_Machine_View):
     header_labels = ["Experiment", "Station", "Scan", "Chunk", "Size", 
                      "FlexBuff"]
+
+    # flexbuff, [(experiment, station, scan, recording, bytes)], scan state
+    # emitted from the loading thread while the inventory is being scanned
+    inventory_progress = QtCore.pyqtSignal(str, list, str)
     
     def _get_selection(self):
         """
@@ -30,124 +34,74 @@ class Flexbuff_View(Abstract_Machine_View):
         indices = self.view.selectedIndexes()
         if not indices:
             return []
+        if self.streaming:
+            raise Invalid_Selection_Exception("The inventory is still being "
+                                              "scanned.")
 
         # the meaning of operating on a selection including different levels
         # at same time is not immediately clear, so show an error in such a case
         levels = set()
         # we get one index for each row and column, so remove doubles
-        row_index = {}
+        row_node = {}
         for index in indices:
-            rows = [index.row()]
-            level = 0
-            parent = index.parent()
-            while parent.isValid():
-                level += 1
-                rows.insert(0, parent.row())
-                parent = parent.parent()
+            if index.column() != 0:
+                continue
+            node = self.model.node(index)
+            level = node.depth
             levels.add(level)
             if len(levels) > 1:
                 raise Invalid_Selection_Exception("Can only operate on "
                     "selections that contain one group "
                     "(experiments, stations, recordings or file chunks).")
-            row_index[tuple(rows)] = index
+            # order the nodes as in the tree
+            rows = []
+            while node.parent is not None:
+                rows.insert(0, node.parent.row_of(node))
+                node = node.parent
+            row_node[tuple(rows)] = self.model.node(index)
 
         flexbuff_recordings = [] # [(flexbuff, Bunch(recording,size))]
-        def handle_scan_item(experiment, station, scan_item):
-            scan = str(scan_item.text(self.header_labels.index("Scan")))
-            if len(self.flexbuffs) > 1:
-                for machine in str(scan_item.text(
-                        self.header_labels.index("FlexBuff"))).split(", "):
+        store = self.store
+        def handle_rows(rows):
+            for row in rows:
+                for machine in store.row_hosts(row):
                     flexbuff_recordings.append(
                         (self.flexbuffs[machine],
-                         self.data[experiment][station][scan]))
-            else:
-                flexbuff_recordings.append(
-                    (self.flexbuffs.values()[0],
-                     self.data[experiment][station][scan]))
-
-        def handle_station_item(experiment, station_item):
-            station = str(station_item.text(
-                self.header_labels.index("Station")))
-            for scan_item in [station_item.child(i) for i in \
-                              xrange(station_item.childCount())]:
-                handle_scan_item(experiment, station, scan_item)
-
-        def handle_experiment_item(experiment_item):
-            experiment = str(experiment_item.text(self.header_labels.index(
-                "Experiment")))
-            for station_item in [experiment_item.child(i) for i in \
-                                 xrange(experiment_item.childCount())]:
-                handle_station_item(experiment, station_item)
-
-        for _, index in sorted(row_index.items()):
+                         Hashable_Bunch(
+                             recording=store.recordings[row],
+                             size=store.row_host_size(row, machine))))
+
+        for _, node in sorted(row_node.items()):
+            key = node.key
+            if key is None:
+                # loading item
+                continue
             if level == 0:
                 # experiment level
-                handle_experiment_item(self.view.itemFromIndex(index))
+                for station_group in store.station_group_range(key):
+                    handle_rows(store.row_range(station_group))
             elif level == 1:
                 # station level
-                experiment = str(self.view.itemFromIndex(index.parent()).text(
-                    self.header_labels.index("Experiment")))
-                station_item = self.view.itemFromIndex(index)
-                handle_station_item(experiment, station_item)
+                handle_rows(store.row_range(key))
             elif level == 2:
                 # scan level
-                station_index = index.parent()
-                experiment = str(self.view.itemFromIndex(
-                    station_index.parent()).text(
-                        self.header_labels.index("Experiment")))
-                station = str(self.view.itemFromIndex(station_index).text(
-                    self.header_labels.index("Station")))
-                scan_item = self.view.itemFromIndex(index)
-                handle_scan_item(experiment, station, scan_item)
+                handle_rows([key])
             elif level == 3:
                 # chunk level
-                scan_index = index.parent()
-                scan = str(self.view.itemFromIndex(scan_index).text(
-                        self.header_labels.index("Scan")))
-                station_index = scan_index.parent()
-                experiment = str(self.view.itemFromIndex(
-                    station_index.parent()).text(
-                        self.header_labels.index("Experiment")))
-                station = str(self.view.itemFromIndex(station_index).text(
-                    self.header_labels.index("Station")))
-                scan_item = self.view.itemFromIndex(index)
-                chunk_index = str(self.view.itemFromIndex(index).text(
-                    self.header_labels.index("Chunk"))).split()[0]
-                if len(self.flexbuffs) > 1:
-                    for machine in str(scan_item.text(
-                            self.header_labels.index("FlexBuff"))).split(", "):
-                        flexbuff_recordings.append(
-                            (self.flexbuffs[machine],
-                             self.chunks[experiment][station][scan]\
-                             [chunk_index]))
-                else:
-                    flexbuff_recordings.append(
-                        (self.flexbuffs.values()[0],
-                         self.chunks[experiment][station][scan][chunk_index]))
+                (machine, chunk) = key
+                flexbuff_recordings.append((self.flexbuffs[machine], chunk))
             else:
                 raise RuntimeError("Invalid level {l}.".format(l=level))
                     
         return flexbuff_recordings
 
-    def _check_selection(self, selection):
-        text = ""
-        flexbuffs = set(flexbuff for (flexbuff, _) in selection)
-        for fb in flexbuffs:
-            with contextlib.closing(self._create_socket(fb, timeout=60)) as s:
-                flexbuff_recordings = [data.recording for (flexbuff, data) \
-                                       in selection if flexbuff == fb]
-                for recording in flexbuff_recordings:
-                    if recording.startswith("/"):
-                        # chunk
-                        text += send_query(s, "file_check?::{f}".format(
-                            f=recording))
-                    else:
-                        # recording
-                        execute_query(s, "scan_set={r}".format(r=recording), 
-                                      ["0"])
-                        reply = send_query(s, "scan_check?")
-                        text += reply
-        return text
+    def _check_tasks(self, selection):
+        return [flexbuff_check(
+                    flexbuff, data.recording, data.size,
+                    None if data.recording.startswith("/") else \
+                    self.chunk_lists.get(flexbuff.machine, {}).get(
+                        data.recording)) \
+                for (flexbuff, data) in selection]
 
     def _emit_copy(self, selection):
         if any([data.recording.startswith("/") for (_, data) in selection]):
@@ -156,7 +110,8 @@ class Flexbuff_View(Abstract_Machine_View):
                 "Cannot copy file chunks from FlexBuff view.")
             return
             
-        if len(selection) > len(set(data for (_, data) in selection)):
+        if len(selection) > len(set(data.recording \
+                                    for (_, data) in selection)):
             QtGui.QMessageBox.critical(
                 self, "Cannot copy", "Some recordings are present on multiple "
                 "FlexBuffs, reduce FlexBuff source selection first.")
@@ -165,12 +120,9 @@ class Flexbuff_View(Abstract_Machine_View):
         flexbuffs = set(fb.machine for (fb, _) in selection)
         data_format = "mk6" if self.mark6_format.isChecked() else "vbs"
         self.copy_from.emit(", ".join(flexbuffs),
-                            [("{data}://{host}:{port}/{type_}/".format(
-                                data=data_format,
-                                host=flexbuff.machine,
-                                port=flexbuff.port,
-                                type_=disk_selection(flexbuff)),
-                              data.recording) \
+                            [(flexbuff_source(flexbuff, data_format),
+                              data.recording,
+                              data.size) \
                              for (flexbuff, data) in selection])
 
 
@@ -184,20 +136,56 @@ class Flexbuff_View(Abstract_Machine_View):
                 "destination is not supported.")
         flexbuff = self.flexbuffs.values()[0]
         data_format = "mk6" if self.mark6_format.isChecked() else "vbs"
-        return (flexbuff.machine, "{data}://{host}:{port}:{data_ip}/{type_}/".
-
-                format(data=data_format,
-                       host=flexbuff.control_ip, 
-                       port=flexbuff.port, 
-                       data_ip=flexbuff.data_ip,
-                       type_=disk_selection(flexbuff)))
-
-    def _selection_size(self, selection):
-        return sum([data.size for (_, data) in selection])
+        return (flexbuff.machine, flexbuff_destination(flexbuff, data_format))
+
+    def _row_totals(self, index):
+        if self.streaming:
+            raise Invalid_Selection_Exception("The inventory is still being "
+                                              "scanned.")
+        node = self.model.node(index)
+        # the node keys are: experiment group, station group, 
+        # row in self.store or (flexbuff, Bunch(recording, size)) 
+        # for the experiment, station, scan and chunk levels
+        key = node.key
+        level = node.depth
+        if key is None:
+            # loading item
+            return (level, 0, 0)
+        if level == 0:
+            return (level, self.store.experiment_copies[key], 
+                    self.store.experiment_size[key])
+        elif level == 1:
+            return (level, self.store.station_copies[key], 
+                    self.store.station_size[key])
+        elif level == 2:
+            return (level, self.store.copies[key], self.store.size[key])
+        elif level == 3:
+            return (level, 1, key[1].size)
+        raise RuntimeError("Invalid level {l}.".format(l=level))
 
     def _display_data(self):
-        data = self.background_data[self.view]
+        self._show_data(self.background_data[self.model.root])
 
+    def _expanded_groups(self):
+        """
+        returns the set of (experiment,) and (experiment, station) tuples
+        of the expanded items
+        """
+        expanded = set()
+        for experiment_item in self.model.root.children:
+            if not self.view.isExpanded(self.model.index_of(experiment_item)):
+                continue
+            experiment = experiment_item.text(
+                self.header_labels.index("Experiment"))
+            expanded.add((experiment,))
+            for station_item in experiment_item.children:
+                if self.view.isExpanded(self.model.index_of(station_item)):
+                    expanded.add((experiment, station_item.text(
+                        self.header_labels.index("Station"))))
+        return expanded
+
+    def _show_disk_usage(self, data):
+        self.progress_label = None
         # clear the disk usage layout
         while True:
             item = self.disk_usage_layout.takeAt(0)
@@ -217,93 +205,404 @@ class Flexbuff_View(Abstract_Machine_View):
                 size = "?"
             self.disk_usage_layout.addWidget(QtGui.QLabel(
                 "{text}: {n}".format(text=text, n=size)))
+        if data.updated:
+            now = time.time()
+            status = "Cached: " + ", ".join(
+                ["{m}{u} {a} old".format(
+                    m=machine, 
+                    u=" (unreachable)" if machine in data.failed else "",
+                    a=format_age(now - updated))
+                 for machine, updated in sorted(data.updated.items())])
+            if data.refreshing:
+                status += ", refreshing"
+            self.disk_usage_layout.addStretch(1)
+            self.disk_usage_layout.addWidget(QtGui.QLabel(status))
+
+    def _experiment_texts(self, store, experiment_group):
+        texts = {self.header_labels.index("Experiment"): 
+                 store.experiment_name(experiment_group),
+                 self.header_labels.index("Size"): 
+                 format_bytes(store.experiment_size[experiment_group], 
+                              self.bytes_print_size)}
+        if len(self.flexbuffs) > 1:
+            texts[self.header_labels.index("FlexBuff")] = ", ".join(
+                store.experiment_hosts_of(experiment_group))
+        return texts
+
+    def _station_texts(self, store, station_group):
+        texts = {self.header_labels.index("Station"): 
+                 store.station_name(station_group),
+                 self.header_labels.index("Size"): 
+                 format_bytes(store.station_size[station_group], 
+                              self.bytes_print_size)}
+        if len(self.flexbuffs) > 1:
+            texts[self.header_labels.index("FlexBuff")] = ", ".join(
+                store.station_hosts_of(station_group))
+        return texts
+
+    def _scan_texts(self, store, row):
+        texts = {self.header_labels.index("Scan"): store.scan_name(row),
+                 self.header_labels.index("Size"): 
+                 format_bytes(store.size[row], self.bytes_print_size)}
+        if len(self.flexbuffs) > 1:
+            texts[self.header_labels.index("FlexBuff")] = \
+                ", ".join(store.row_hosts(row))
+        return texts
 
-        policy = Tree_Widget_Item.ShowIndicator \
-                 if self.show_file_chunks.isChecked() \
-                 else Tree_Widget_Item.DontShowIndicator
-        multi_flexbuff = (len(self.flexbuffs) > 1)
-        experiments = sorted(data.presence.keys())
-        for experiment in experiments:
-            experiment_item = Tree_Widget_Item(self.view)
-            experiment_item.setText(self.header_labels.index("Experiment"), 
-                                    experiment)
-            experiment_size = sum(
-                [scan_size for experiment_data in data.usage.values() \
-                 for station_data in experiment_data[experiment].values() \
-                 for scan_size in station_data.values()])
-            experiment_item.setText(self.header_labels.index("Size"), 
-                format_bytes(experiment_size, self.bytes_print_size))
-            if multi_flexbuff:
-                station_flexbuffs = [set.union(*scan_data.values()) \
-                    for scan_data in data.presence[experiment].values()]
-                experiment_flexbuffs = set.union(*station_flexbuffs)
-                experiment_item.setText(
-                    self.header_labels.index("FlexBuff"), 
-                    ", ".join(experiment_flexbuffs))
-            stations = sorted(data.presence[experiment].keys())
-            for station in stations:
-                station_item = Tree_Widget_Item(experiment_item)
-                station_item.setText(self.header_labels.index("Station"), 
-                                     station)
-                station_size = sum(
-                    [scan_size for experiment_data in data.usage.values() \
-                     for scan_size in \
-                     experiment_data[experiment][station].values()])
-                station_item.setText(self.header_labels.index("Size"), 
-                    format_bytes(station_size, self.bytes_print_size))
-                if multi_flexbuff:
-                    station_flexbuffs = set.union(
-                        *data.presence[experiment][station].values())
-                    station_item.setText(
-                        self.header_labels.index("FlexBuff"), 
-                        ", ".join(station_flexbuffs))
-                scans = sorted(data.presence[experiment][station].keys())
-                for (scan, recording) in scans:
-                    scan_item = Tree_Widget_Item(station_item)
-                    scan_item.setText(self.header_labels.index("Scan"), 
-                                      scan)
-                    scan_size = sum(
-                        [experiment_data[experiment][station] \
-                         [(scan, recording)] \
-                         for experiment_data in data.usage.values()])
-                    scan_item.setText(self.header_labels.index("Size"), 
-                        format_bytes(scan_size, self.bytes_print_size))
-                    scan_item.setChildIndicatorPolicy(policy)
-                    if multi_flexbuff:
-                        scan_item.setText(
-                            self.header_labels.index("FlexBuff"), 
-                            ", ".join(data.presence[experiment]\
-                                      [station][(scan, recording)]))
-
-        self.view.collapseAll()
-        self.mark6_format.setEnabled(True)
-
+    def _set_scan_source(self, store, station_item):
+        """
+        let the scans of station_item be created from store,
+        when they are scrolled into view
+        """
+        rows = store.row_range(station_item.key)
+        first = rows[0] if rows else 0
+        # the chunks are listed on expansion
+        make_scan_node = lambda row: Tree_Node(
+            self._scan_texts(store, first + row), key=first + row, 
+            expandable=True)
+        station_item.source = make_scan_node
+        station_item.source_size = len(rows)
+
+    def _add_experiment(self, store, experiment_group, row):
+        """
+        add the tree node of experiment_group, with its stations, 
+        at row of the root
+        """
+        experiment_item = Tree_Node(
+            self._experiment_texts(store, experiment_group), 
+            key=experiment_group)
+        self.model.insert_child(self.model.root, row, experiment_item)
+        self.model.append_children(experiment_item, [
+            self._new_station_item(store, station_group) \
+            for station_group in store.station_group_range(experiment_group)])
+        return experiment_item
+
+    def _new_station_item(self, store, station_group):
+        station_item = Tree_Node(self._station_texts(store, station_group),
+                                 key=station_group)
+        self._set_scan_source(store, station_item)
+        return station_item
+
+    def _show_data(self, data):
+        self._use_inventory(data)
+        expanded = self._expanded_groups()
+        self.model.clear()
+        self.expanded = set()
+        self.streaming = False
+        self._show_disk_usage(data)
+
+        store = data.store
+        self.store = store
+        # experiments and stations are created here, 
+        # the scans when they are scrolled into view
+        experiment_items = [
+            self._add_experiment(store, experiment_group, experiment_group)
+            for experiment_group in xrange(len(store.experiment_groups))]
+
+        # restore the expansion state, the view fetches the first scans
+        for experiment_item in experiment_items:
+            experiment = experiment_item.text(
+                self.header_labels.index("Experiment"))
+            for station_item in experiment_item.children:
+                if (experiment, station_item.text(
+                        self.header_labels.index("Station"))) in expanded:
+                    index = self.model.index_of(station_item)
+                    self.view.setExpanded(index, True)
+                    # the view only fetches for visible items
+                    if self.model.canFetchMore(index):
+                        self.model.fetchMore(index)
+            if (experiment,) in expanded:
+                self.view.setExpanded(self.model.index_of(experiment_item), 
+                                      True)
+
+        if not data.refreshing:
+            self.mark6_format.setEnabled(True)
+
+    def _update_texts(self, item, texts):
+        for column, text in texts.items():
+            if item.texts.get(column) != text:
+                self.model.set_text(item, column, text)
+
+    def _apply_refresh(self):
+        """
+        apply the differences between the displayed inventory and the new
+        one to the tree, keeping the expansion state and selection
+        """
+        data = self.background_data[self.model.root]
+        self._use_inventory(data)
+        self._show_disk_usage(data)
+        (old, new) = (self.store, data.store)
+        self.store = new
+
+        experiment_column = self.header_labels.index("Experiment")
+        experiment_items = list(self.model.root.children)
+        row = 0
+        for (old_index, new_group) in diff_sorted(
+                [item.text(experiment_column) for item in experiment_items],
+                new.experiments()):
+            if new_group is None:
+                self.model.remove_child(experiment_items[old_index])
+                continue
+            if old_index is None:
+                self._add_experiment(new, new_group, row)
+            else:
+                experiment_item = experiment_items[old_index]
+                experiment_item.key = new_group
+                self._update_texts(
+                    experiment_item, self._experiment_texts(new, new_group))
+                self._apply_station_diff(old, new, experiment_item)
+            row += 1
+
+        self._recount_selection()
+        if not data.refreshing:
+            self.mark6_format.setEnabled(True)
+
+    def _apply_station_diff(self, old, new, experiment_item):
+        station_column = self.header_labels.index("Station")
+        station_items = list(experiment_item.children)
+        new_groups = list(new.station_group_range(experiment_item.key))
+        row = 0
+        for (old_index, new_index) in diff_sorted(
+                [item.text(station_column) for item in station_items],
+                [new.station_name(group) for group in new_groups]):
+            if new_index is None:
+                self.model.remove_child(station_items[old_index])
+                continue
+            if old_index is None:
+                self.model.insert_child(
+                    experiment_item, row, 
+                    self._new_station_item(new, new_groups[new_index]))
+            else:
+                station_item = station_items[old_index]
+                station_item.key = new_groups[new_index]
+                self._update_texts(
+                    station_item, self._station_texts(new, station_item.key))
+                self._apply_scan_diff(old, new, station_item)
+            row += 1
+
+    def _apply_scan_diff(self, old, new, station_item):
+        scan_items = list(station_item.children)
+        # only the scans that were scrolled into view have been created,
+        # if not all, new scans after those will be created on demand
+        all_created = (len(scan_items) >= station_item.source_size)
+        rows = new.row_range(station_item.key)
+        row = 0
+        for (old_index, new_index) in diff_sorted(
+                [(old.scan_name(item.key), old.recordings[item.key]) \
+                 for item in scan_items],
+                [(new.scan_name(new_row), new.recordings[new_row]) \
+                 for new_row in rows]):
+            if new_index is None:
+                self.model.remove_child(scan_items[old_index])
+                continue
+            if old_index is None:
+                if (row >= len(station_item.children)) and (not all_created):
+                    break
+                self.model.insert_child(
+                    station_item, row, 
+                    Tree_Node(self._scan_texts(new, rows[new_index]), 
+                              key=rows[new_index], expandable=True))
+            else:
+                scan_item = scan_items[old_index]
+                old_row = scan_item.key
+                scan_item.key = rows[new_index]
+                self._update_texts(
+                    scan_item, self._scan_texts(new, scan_item.key))
+                if (old.size[old_row] != new.size[scan_item.key]) and \
+                   (scan_item in self.expanded):
+                    # the chunks changed, list them again
+                    self.expanded.discard(scan_item)
+                    self.model.remove_children(scan_item)
+                    index = self.model.index_of(scan_item)
+                    if self.view.isExpanded(index):
+                        self._expand_scan(index)
+            row += 1
+        self._set_scan_source(new, station_item)
+
+    def _data_format(self):
+        return "mark6" if self.mark6_format.isChecked() else "vbs"
 
     def _get_data(self):
-        data = self.background_data[self.view]
+        data = self.background_data[self.model.root]
 
         is_mark6_data_format = self.mark6_format.isChecked()
+        data.failed = set()
+        data.chunks = {}
+        settings = get_settings()
+        scan_mode = settings["inventory_scan_mode"]
         (data.usage, data.available, data.errors) = \
-            get_flexbuff_meta_data(self.flexbuffs.values(), is_mark6_data_format)
-
-        # {experiment : {station : {(scan, recording) : set(flexbuffs)}}}
-        data.presence = collections.defaultdict(
-            lambda: collections.defaultdict(
-                lambda: collections.defaultdict(set)))
-        # {experiment : {station : {scan : Bunch(recording, size)}}}
-        self.data = collections.defaultdict(
-            lambda: collections.defaultdict(dict))
-        for flexbuff, experiment_data in data.usage.items():
-            for experiment, station_data in experiment_data.items():
-                if experiment is None:
-                    # used to indicate not-vbs-type data
-                    continue
-                for station, scan_data in station_data.items():
-                    for ((scan, recording), size) in scan_data.items():
-                        data.presence[experiment][station]\
-                            [(scan, recording)].add(flexbuff)
-                        self.data[experiment][station][scan] = \
-                            Hashable_Bunch(recording=recording, size=size) 
+            get_flexbuff_meta_data(self.flexbuffs.values(), 
+                                   is_mark6_data_format,
+                                   data.failed,
+                                   scan_mode,
+                                   data.chunks,
+                                   self.inventory_progress.emit,
+                                   settings["inventory_max_hosts"],
+                                   settings["inventory_disk_parallelism"])
+        data.updated = {}
+        data.refreshing = False
+        catalog = get_catalog()
+        if catalog:
+            data_format = self._data_format()
+            try:
+                for machine in self.flexbuffs.keys():
+                    if machine not in data.failed:
+                        catalog.store(machine, data_format, 
+                                      data.usage[machine], 
+                                      data.available[machine],
+                                      data.chunks.get(machine))
+                if data.failed:
+                    # fall back to the last known inventory
+                    (usage, available, data.updated) = catalog.load(
+                        data.failed, data_format)
+                    data.usage.update(usage)
+                    data.available.update(available)
+            except Exception as e:
+                print "warning, inventory catalog failed: {e}".format(e=e)
+        self._process_usage(data)
+
+    def _display_catalog(self):
+        """
+        display the last known inventory from the catalog, if any
+        returns whether it was displayed
+        """
+        catalog = get_catalog()
+        if not catalog:
+            return False
+        try:
+            (usage, available, updated) = catalog.load(
+                self.flexbuffs.keys(), self._data_format())
+        except Exception as e:
+            print "warning, inventory catalog failed: {e}".format(e=e)
+            return False
+        if not updated:
+            return False
+        data = Bunch(usage=usage, available=available, errors={}, chunks={},
+                     updated=updated, failed=set(), refreshing=True)
+        self._process_usage(data)
+        self._show_data(data)
+        return True
+
+    def _reset_stream(self, streaming):
+        """
+        streaming: whether to add the scanned recordings to the tree while
+        the inventory is being scanned
+        """
+        self.streaming = streaming
+        # {(experiment[, station[, scan, recording]]) : Tree_Node}
+        self.stream_items = {}
+        # {parent key : sorted list of child keys}
+        self.stream_children = collections.defaultdict(list)
+        # {key : bytes}
+        self.stream_sizes = collections.defaultdict(int)
+        # {key : set(flexbuffs)}
+        self.stream_presence = collections.defaultdict(set)
+        # {flexbuff : (set(recordings), scan state)}
+        self.stream_progress = {}
+        self.progress_label = None
+
+    def _stream_item(self, key):
+        item = self.stream_items.get(key)
+        if item is not None:
+            return item
+        if len(key) == 1:
+            item = Tree_Node({self.header_labels.index("Experiment"): key[0]})
+        elif len(key) == 2:
+            item = Tree_Node({self.header_labels.index("Station"): key[1]})
+        else:
+            # the chunks can be shown after the scan is done
+            item = Tree_Node({self.header_labels.index("Scan"): key[2]},
+                             expandable=False)
+        # keep the items sorted, as in the final display
+        parent_key = key[:-1] if len(key) < 4 else key[:2]
+        siblings = self.stream_children[parent_key]
+        index = bisect.bisect(siblings, key)
+        siblings.insert(index, key)
+        if parent_key:
+            self.model.insert_child(self._stream_item(parent_key), index, item)
+        else:
+            # the loading item stays the last top level item
+            self.model.insert_child(self.model.root, index, item)
+        self.stream_items[key] = item
+        return item
+
+    def _add_inventory_batch(self, flexbuff, records, state):
+        flexbuff = str(flexbuff)
+        recordings = self.stream_progress.get(flexbuff, (set(), None))[0]
+        self.stream_progress[flexbuff] = (recordings, str(state))
+        multi_flexbuff = (len(self.flexbuffs) > 1)
+        for (experiment, station, scan, recording, size) in records:
+            recordings.add(recording)
+            if (not self.streaming) or (experiment is None):
+                continue
+            for key in [(experiment,), 
+                        (experiment, station), 
+                        (experiment, station, scan, recording)]:
+                item = self._stream_item(key)
+                self.stream_sizes[key] += size
+                self.model.set_text(item, self.header_labels.index("Size"), 
+                                    format_bytes(self.stream_sizes[key], 
+                                                 self.bytes_print_size))
+                if multi_flexbuff and \
+                   (flexbuff not in self.stream_presence[key]):
+                    self.stream_presence[key].add(flexbuff)
+                    self.model.set_text(item, 
+                                        self.header_labels.index("FlexBuff"),
+                                        ", ".join(self.stream_presence[key]))
+
+        if self.progress_label is None:
+            self.progress_label = QtGui.QLabel(self)
+            self.disk_usage_layout.addStretch(1)
+            self.disk_usage_layout.addWidget(self.progress_label)
+        self.progress_label.setText("Scanning: " + ", ".join(
+            ["{f} {n} recordings{s}".format(
+                f=machine, 
+                n=len(machine_recordings), 
+                s="" if machine_state == "scanning" \
+                else " ({s})".format(s=machine_state))
+             for machine, (machine_recordings, machine_state) in \
+             sorted(self.stream_progress.items())]))
+
+    def _process_usage(self, data):
+        """
+        prepare the inventory in data for display, runs in the loading thread,
+        the view is only changed by _use_inventory
+        """
+        # {flexbuff : Chunk_Store}, for the flexbuffs of which the inventory
+        # lists all chunks
+        data.chunk_lists = {machine : chunks \
+                            for machine, chunks in data.chunks.items() \
+                            if machine not in data.failed}
+
+        # {flexbuff : {recording or chunk path : size}}, to forget the checks
+        # of recordings that changed
+        data.check_sizes = {}
+        for machine in self.flexbuffs.keys():
+            if machine in data.failed:
+                continue
+            sizes = {recording : size \
+                     for station_data in data.usage[machine].values() \
+                     for scan_data in station_data.values() \
+                     for ((_, recording), size) in scan_data.items()}
+            if machine in data.chunk_lists:
+                for (_recording, path, size) in \
+                        data.chunk_lists[machine].rows():
+                    sizes[path] = size
+            data.check_sizes[machine] = sizes
+
+        # the recordings, with sizes and presence per flexbuff, 
+        # experiment and station
+        data.store = Inventory_Store(data.usage)
+
+    def _use_inventory(self, data):
+        """
+        make the inventory prepared by _process_usage the current one
+        """
+        self.chunk_lists = data.chunk_lists
+        # the flexbuffs of which the last known inventory is shown
+        self.cached_machines = set(data.updated.keys())
+        for (machine, sizes) in data.check_sizes.items():
+            invalidate_checks(machine, sizes)
 
     def _create_view_widget(self):
         widget = QtGui.QWidget(self)
@@ -313,108 +612,186 @@ class Flexbuff_View(Abstract_Machine_View):
         self.disk_usage_layout.addWidget(QtGui.QLabel("Loading", self))
         layout.addWidget(disk_usage_widget)
 
-        self.view = QtGui.QTreeWidget(widget)
+        self.view = self._create_tree_view(widget)
         layout.addWidget(self.view)
 
         return widget
 
-    def _create_socket(self, flexbuff, timeout=10):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(timeout)
-        s.connect((flexbuff.machine, flexbuff.port))
-        return s
+    def _load_data(self):
+        self.model.clear()
+        # with the cached inventory on display, only show the scan progress
+        self._reset_stream(not self._display_catalog())
+        self.load_in_background(self.model.root, self._get_data, 
+                                self._display_data)
 
     def _set_data_format(self):
         self.mark6_format.setEnabled(False)
-        self.view.clear()
-        self.load_in_background(self.view, self._get_data, self._display_data)
+        self._load_data()
+
+    def refresh(self):
+        """
+        take a new inventory and only apply the differences to the tree
+        """
+        if (self.model.root in self.background_data) or self.streaming:
+            # still loading
+            return
+        self._reset_stream(False)
+        self.load_in_background(self.model.root, self._get_data, 
+                                self._apply_refresh, show_loading=False)
+
+    def _watch_timeout(self):
+        # a view that was replaced by another one stays around hidden, 
+        # until its background threads are done
+        if self.isVisible():
+            self.refresh()
+
+    def _set_watch(self):
+        if self.watch.isChecked():
+            self.watch_timer.start(
+                int(get_settings()["inventory_watch_interval"] * 1000))
+        else:
+            self.watch_timer.stop()
 
     def _set_chunk_visibility(self):
         visible = self.show_file_chunks.isChecked()
         if visible:
             self.view.showColumn(self.header_labels.index("Chunk"))
-            policy = Tree_Widget_Item.ShowIndicator
+            self.model.set_depth_limit(None)
         else:
             self.view.hideColumn(self.header_labels.index("Chunk"))
-            policy = Tree_Widget_Item.DontShowIndicator
-
-        for experiment_item in [self.view.topLevelItem(i) for i in \
-                                xrange(self.view.topLevelItemCount())]:
-            for station_item in [experiment_item.child(i) for i in \
-                                 xrange(experiment_item.childCount())]:
-                for scan_item in [station_item.child(i) for i in \
-                              xrange(station_item.childCount())]:
-                    if not visible:
-                        scan_item.setExpanded(False)
-                    scan_item.setChildIndicatorPolicy(policy)
+            # experiment, station and scan levels only
+            self.model.set_depth_limit(3)
 
     def _expand_scan(self, index):
-        level = 0
-        parent = index.parent()
-        while parent.isValid():
-            level += 1
-            parent = parent.parent()
-        if level != 2:
+        scan_item = self.model.node(index)
+        if scan_item.depth != 2 or self.streaming:
             # no need to do work on experiment or station level indices
+            # scans still being scanned are not expandable
             return
         
-        scan_item = self.view.itemFromIndex(index)
-        if scan_item in self.expanded:
-            # already scanned for the chunks
+        if (scan_item in self.expanded) or \
+           (scan_item in self.background_data):
+            # already scanned for the chunks, or being scanned
             return
 
-        scan = str(scan_item.text(self.header_labels.index("Scan")))
-        station_item = scan_item.parent()
-        station = str(station_item.text(self.header_labels.index("Station")))
-        experiment = str(station_item.parent().text(
-            self.header_labels.index("Experiment")))
-        if len(self.flexbuffs) > 1:
-            machines = str(scan_item.text(
-                self.header_labels.index("FlexBuff"))).split(", ")
-        else:
-            machines = self.flexbuffs.keys()
-        for flexbuff in [self.flexbuffs[machine] for machine in machines]:
+        row = scan_item.key
+        recording = self.store.recordings[row]
+        # {flexbuff : {chunk path : size}}
+        known = {}
+        unknown = []
+        for machine in self.store.row_hosts(row):
+            if recording in self.chunk_lists.get(machine, {}):
+                # known from the inventory, no need to go to the flexbuff
+                known[machine] = self.chunk_lists[machine][recording]
+            else:
+                unknown.append(self.flexbuffs[machine])
+        is_mark6_data_format = self.mark6_format.isChecked()
+        self.expanded.add(scan_item)
+        if not unknown:
+            self._show_chunks(scan_item, recording, known, 
+                              is_mark6_data_format)
+            return
+
+        # listing the chunks takes a remote command per flexbuff
+        data_format = self._data_format()
+        cached = set(self.cached_machines)
+        self.load_in_background(
+            scan_item,
+            lambda: self._get_chunks(scan_item, recording, unknown, 
+                                     is_mark6_data_format, data_format, 
+                                     cached),
+            lambda: self._display_chunks(scan_item, recording, known,
+                                         is_mark6_data_format),
+            show_loading=False)
+
+    def _get_chunks(self, scan_item, recording, flexbuffs, 
+                    is_mark6_data_format, data_format, cached):
+        """
+        cached: the flexbuffs of which the displayed inventory is the last 
+          known one, their chunks are taken from the catalog if known
+        """
+        data = self.background_data[scan_item]
+        data.chunks = {} # {flexbuff : {chunk path : size}}
+        catalog = get_catalog()
+        for flexbuff in flexbuffs:
             chunks = {}
-            errors = {}
-            is_mark6_data_format = self.mark6_format.isChecked()
-            check_flexbuff(flexbuff, chunks, None, errors,
-                           self.data[experiment][station][scan].recording,
-                           is_mark6_data_format)
-            
+            if catalog and (flexbuff.machine in cached):
+                try:
+                    chunks = catalog.load_chunks(flexbuff.machine, 
+                                                 data_format, recording)
+                except Exception as e:
+                    print "warning, inventory catalog failed: {e}".format(
+                        e=e)
+            if not chunks:
+                try:
+                    chunks = get_backend(flexbuff).list_chunks(
+                        recording, is_mark6_data_format)
+                    if catalog:
+                        catalog.store_chunks(flexbuff.machine, data_format, 
+                                             recording, chunks)
+                except Exception as e:
+                    print "{f}: {e}".format(f=flexbuff.machine, e=e)
+                    if catalog and (flexbuff.machine not in cached):
+                        # show the last known chunks of an unreachable 
+                        # flexbuff
+                        try:
+                            chunks = catalog.load_chunks(
+                                flexbuff.machine, data_format, recording)
+                        except Exception as e:
+                            print "warning, inventory catalog failed: "\
+                                "{e}".format(e=e)
+            data.chunks[flexbuff.machine] = chunks
+
+    def _display_chunks(self, scan_item, recording, known, 
+                        is_mark6_data_format):
+        if scan_item not in self.expanded:
+            # the tree was rebuilt or the scan changed while listing
+            return
+        node = scan_item
+        while node.parent is not None:
+            node = node.parent
+        if node is not self.model.root:
+            # the scan was removed from the tree while listing
+            return
+        chunks = dict(known)
+        chunks.update(self.background_data[scan_item].chunks)
+        self._show_chunks(scan_item, recording, chunks, is_mark6_data_format)
+
+    def _show_chunks(self, scan_item, recording, chunks, 
+                     is_mark6_data_format):
+        """
+        chunks = {flexbuff : {chunk path : size}}
+        """
+        items = []
+        for machine in sorted(chunks.keys()):
             display = set()
             if is_mark6_data_format:
-                for chunk, size in chunks.items():
+                for chunk, size in chunks[machine].items():
                     disk = "/".join(chunk.split("/")[3:5])
-                    display.add((disk, size))
-                for (disk, size) in sorted(display):
-                    self.chunks[experiment][station][scan][disk] = \
-                        Hashable_Bunch(recording=chunk, size=size)
-                    item = Tree_Widget_Item(scan_item)
-                    item.setText(self.header_labels.index("Chunk"),
-                                 disk)
-                    item.setText(self.header_labels.index("Size"),
-                                 format_bytes(size, self.bytes_print_size))
-                    if len(self.flexbuffs) > 1:
-                        item.setText(self.header_labels.index("FlexBuff"),
-                        flexbuff.machine)
+                    display.add((disk, size, chunk))
+                display = sorted(display)
             else:
-                for chunk, size in chunks.items():
+                for chunk, size in chunks[machine].items():
                     disk = chunk.split("/")[2]
-                    index = chunk.split(".")[-1]
-                    display.add((index, disk, size))
-                    self.chunks[experiment][station][scan][index] = \
-                        Hashable_Bunch(recording=chunk, size=size)
-                for (index, disk, size) in sorted(display):
-                    item = Tree_Widget_Item(scan_item)
-                    item.setText(self.header_labels.index("Chunk"),
-                                 index + " on " + disk)
-                    item.setText(self.header_labels.index("Size"),
-                                 format_bytes(size, self.bytes_print_size))
-                    if len(self.flexbuffs) > 1:
-                        item.setText(self.header_labels.index("FlexBuff"),
-                        flexbuff.machine)
-
-        self.expanded.add(scan_item)
+                    chunk_index = chunk.split(".")[-1]
+                    display.add((chunk_index, disk, size, chunk))
+                display = [(chunk_index + " on " + chunk_disk, chunk_size,
+                            chunk_path) \
+                           for (chunk_index, chunk_disk, chunk_size,
+                                chunk_path) in sorted(display)]
+            for (text, size, chunk) in display:
+                texts = {self.header_labels.index("Chunk"): text,
+                         self.header_labels.index("Size"):
+                         format_bytes(size, self.bytes_print_size)}
+                if len(self.flexbuffs) > 1:
+                    texts[self.header_labels.index("FlexBuff")] = machine
+                items.append(Tree_Node(
+                    texts, 
+                    key=(machine, 
+                         Hashable_Bunch(recording=chunk, size=size)),
+                    expandable=False))
+
+        self.model.append_children(scan_item, items)
         
     def _get_m5copy_options(self):
         return super(Flexbuff_View, self)._get_m5copy_options() + \
@@ -429,6 +806,7 @@ class Flexbuff_View(Abstract_Machine_View):
         while grandparent.parentWidget():
             grandparent = grandparent.parentWidget()
 
+        import rename_widget
         dialog = rename_widget.Rename_Dialog(selection, grandparent)
         dialog.show()
         dialog.raise_()
@@ -450,12 +828,21 @@ class Flexbuff_View(Abstract_Machine_View):
         self.selection_layout.addWidget(self.show_file_chunks)
         self.show_file_chunks.clicked.connect(self._set_chunk_visibility)
 
+        # periodically refresh the inventory
+        self.watch = QtGui.QCheckBox("Watch", self)
+        self.selection_layout.addWidget(self.watch)
+        self.watch.clicked.connect(self._set_watch)
+        self.watch_timer = QtCore.QTimer(self)
+        self.watch_timer.timeout.connect(self._watch_timeout)
+
         self.view.expanded.connect(self._expand_scan)
         self.expanded = set()
-        self.view.hideColumn(self.header_labels.index("Chunk"))
-        # {experiment : {station : {scan : {index: Bunch(recording, size)}}}}
-        self.chunks = collections.defaultdict(lambda: collections.defaultdict(
-            lambda: collections.defaultdict(dict)))
+        self._reset_stream(False)
+        self.inventory_progress.connect(self._add_inventory_batch)
+        self.chunk_lists = {}
+        self.cached_machines = set()
+        self.store = Inventory_Store({})
+        self._set_chunk_visibility()
         
         if len(self.flexbuffs) == 1:
             self.view.hideColumn(self.header_labels.index("FlexBuff"))
@@ -464,7 +851,5 @@ class Flexbuff_View(Abstract_Machine_View):
         self.rename_action.triggered.connect(self._rename)
         self.view.addAction(self.rename_action)
 
-        self.load_in_background(self.view, self._get_data, self._display_data)
-        
-
+        self._load_data()
 
@@ -5,6 +5,8 @@ import re
 import json
 import os.path
 import logging
+import threading
+import weakref
 
 reply_end_re = re.compile("[^\s;]") # find last character which is not white space or ';'
 def split_reply(reply):
@@ -25,13 +27,63 @@ def split_reply(reply):
     return map(lambda x: x.strip(), [reply[0:separator_index]] + reply[separator_index+1:].split(': '))
 
 def send_query(socket, query):
-    socket_util.retry_interrupted(lambda: socket.send(query + "\n\r"))
-    reply = socket_util.retry_interrupted(lambda: socket.recv(1024))
+    socket_util.retry_interrupted(lambda: socket.sendall(query + "\n\r"))
+    reply = get_reader(socket).read_reply()
 
     peer = socket.getpeername()
     logging.debug("send '%s' to %s:%d, reply '%s'" % (query, peer[0], peer[1], reply))
     return reply
 
+class Reply_Reader(object):
+    """
+    Splits what is received on a jive5ab control socket into replies,
+    every reply ends with a ';'
+    """
+    def __init__(self, socket):
+        self.socket = socket
+        self.buffer = ""
+
+    def read_reply(self):
+        while True:
+            (reply, self.buffer) = pop_reply(self.buffer)
+            if reply is not None:
+                return reply
+            data = socket_util.retry_interrupted(
+                lambda: self.socket.recv(4096))
+            if not data:
+                raise EOFError("connection closed while waiting for a reply")
+            self.buffer += data
+
+def pop_reply(buffer):
+    """
+    returns (first complete reply in buffer or None, rest of buffer)
+    """
+    end = buffer.find(";")
+    if end == -1:
+        return (None, buffer)
+    # drop the line end following the ';'
+    return (buffer[:end+1].lstrip(), buffer[end+1:].lstrip())
+
+# {plain socket : Reply_Reader}, such that what is received after a reply
+# is kept for the next one
+_socket_readers = weakref.WeakKeyDictionary()
+_socket_readers_lock = threading.Lock()
+def get_reader(socket):
+    """
+    returns the reply reader of a control_pool connection, 
+    or the one of a plain socket (created on first use)
+    """
+    reader = getattr(socket, "reader", None)
+    if reader is not None:
+        return reader
+    with _socket_readers_lock:
+        reader = _socket_readers.get(socket)
+        if reader is None:
+            # the reader shouldn't keep the socket alive
+            reader = Reply_Reader(weakref.proxy(socket))
+            _socket_readers[socket] = reader
+    return reader
+
 class QueryReturnCodeError(RuntimeError):
     def __init__(self, msg, code):
         super(QueryReturnCodeError, self).__init__(msg)
@@ -40,16 +92,132 @@ class QueryReturnCodeError(RuntimeError):
 def execute_query(socket, query, acceptable_replies = ["0", "1"]):
     # add a ';', if multiple commands get queued (because of timeouts), the command will at least be interpreted correctly (although the reply, if any, will not be as expected)
     reply = send_query(socket, query + ";")
+    return check_reply(query, reply, acceptable_replies)
+
+def check_reply(query, reply, acceptable_replies = ["0", "1"]):
+    """
+    returns the split reply to query, 
+    raises QueryReturnCodeError if the return code is not acceptable
+    """
     split = split_reply(reply)
-    if split[1] not in acceptable_replies:
-        raise QueryReturnCodeError("'%s' failed with reply '%s'" % (query, reply), split[1])
+    if (len(split) < 2) or (split[1] not in acceptable_replies):
+        raise QueryReturnCodeError("'%s' failed with reply '%s'" % (query, reply), split[1] if len(split) > 1 else None)
     return split
 
+_config = None
+_config_lock = threading.Lock()
+def get_config():
+    """
+    Returns the contents of config.json, it is read once per process
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            file_name = os.path.join(os.path.split(__file__)[0], 
+                                     "config.json")
+            with open(file_name, "r") as config_file:
+                _config = json.load(config_file)
+        return _config
+
 def get_machine(type_):
-    file_name = os.path.join(os.path.split(__file__)[0], "config.json")
-    with open(file_name, "r") as config_file:
-        return [Hashable_Bunch(**x) for x in \
-                json.load(config_file)[type_]]
+    return [Hashable_Bunch(**x) for x in get_config()[type_]]
+
+default_settings = {
+    # sqlite file to store the last known inventory of each host,
+    # empty to disable
+    "catalog": "~/.jcm/catalog.sqlite",
+    # "single_pass": list all chunks and the disk usage in one remote command
+    # "du": use du on every recording (no chunk lists)
+    "inventory_scan_mode": "single_pass",
+    # maximum number of hosts to scan at the same time
+    "inventory_max_hosts": 4,
+    # number of disks to scan concurrently on each host
+    "inventory_disk_parallelism": 8,
+    # seconds after which an unused jive5ab control connection is closed
+    "control_idle_timeout": 60,
+    # maximum number of unused control connections kept per jive5ab
+    "control_max_idle": 4,
+    # seconds between inventory refreshes of a FlexBuff view in watch mode
+    "inventory_watch_interval": 60,
+    # maximum number of hosts to run scan/file checks on at the same time
+    "check_max_hosts": 4,
+    # number of concurrent checks per host, checks that depend on the
+    # scan set or bank of jive5ab always run one at a time
+    "check_max_per_host": 4,
+    # maximum number of m5copy transfers of a batch running at the same
+    # time, in total, per source host and per destination host
+    # (a Mark5 always does one transfer at a time)
+    "transfer_max_total": 4,
+    "transfer_max_per_source": 4,
+    "transfer_max_per_destination": 4,
+    # sqlite file to keep the state of m5copy batches in, such that
+    # unfinished batches can be resumed after a restart, empty to disable
+    "transfer_journal": "~/.jcm/transfers.sqlite",
+    # CSV file to record the progress and rate of m5copy transfers in,
+    # empty to disable
+    "transfer_telemetry": "~/.jcm/transfers.csv",
+    # link probes of the m5copy window: seconds per probe, the UDT rates
+    # (Mbps) and MTUs to try besides TCP
+    "link_probe_seconds": 10,
+    "link_probe_udt_rates": [1000, 2000, 4000],
+    "link_probe_mtus": [1500, 9000],
+    # JSON file to remember the fastest probed settings per host pair in,
+    # empty to disable
+    "link_tuning": "~/.jcm/links.json",
+    # number of output lines of a running command kept in memory
+    "command_output_lines": 1000,
+    # directory to write the full output of every command to, empty to
+    # disable, logs of commands that succeeded are removed unless
+    # command_keep_logs is set
+    "command_log_directory": "~/.jcm/logs",
+    "command_keep_logs": False,
+    # remember successful check replies of recordings that didn't change
+    "check_cache": True,
+    # also store them in the catalog, to remember them between sessions
+    "check_cache_on_disk": True,
+    # share one ssh connection per host between all remote commands
+    "ssh_multiplexing": True,
+    # seconds before an unused shared ssh connection is closed
+    "ssh_idle_timeout": 300,
+    # maximum number of concurrent remote commands per host
+    "ssh_max_channels": 8,
+}
+
+def get_settings():
+    settings = dict(default_settings)
+    settings.update(get_config().get("settings", {}))
+    return settings
+
+def parse_host(host):
+    """
+    host: [user@]<control_ip/host>[:port[:data_ip]]
+    returns Bunch(user, machine, port, data_ip), user None if not given,
+    port 2620 and data_ip the host if not given
+    """
+    machine = host.strip()
+    at_index = machine.find("@")
+    if at_index != -1:
+        user = machine[:at_index]
+        machine = machine[at_index+1:]
+    else:
+        user = None
+    
+    colon_index = machine.rfind(":")
+    if colon_index != -1:
+        last = machine[colon_index+1:]
+        machine = machine[:colon_index]
+        colon_index = machine.rfind(":")
+        if colon_index == -1:
+            port = int(last)
+            data_ip = machine
+        else:
+            data_ip = last
+            port = int(machine[colon_index+1:])
+            machine = machine[:colon_index]
+    else:
+        port = 2620
+        data_ip = machine
+    return Bunch(user=user, machine=machine, port=port, data_ip=data_ip)
 
 def get_mark5s():
     return get_machine("mark5")
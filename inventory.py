@@ -0,0 +1,112 @@
+"""
+Taking the inventory of (multiple) FlexBuffs.
+This module doesn't depend on Qt.
+"""
+
+from inventory_backend import get_backend, run_in_threads
+from inventory_store import Chunk_Store
+
+import collections
+import functools
+import time
+
+def get_flexbuff_meta_data(check, is_mark6_data_format=False, failed=None,
+                           scan_mode="du", chunks=None, progress=None,
+                           max_threads=None, disk_parallelism=1):
+    """
+    Check: a list of flexbuff machines to check
+    Returns a 3-tuple (usage, available, errors)
+    usage = 
+      { flexbuff : { experiment : { station : { scan : number of bytes } } } }
+    available = 
+      { flexbuff : [sum of disk sizes in bytes, sum of bytes used over 
+                    all disks, sum of bytes available over all disks] }
+    errors = { flexbuff : { mount point : [recordings] } }
+    failed: optional set, the machine names of the flexbuffs that could not
+    be checked will be added to it
+    scan_mode: "du" or "single_pass", in single pass mode, the sizes of all
+    chunks and the disk usage are collected in one remote command
+    (flexbuffs using the local inventory backend are always scanned in one
+    pass)
+    chunks: optional dict, it will be filled with
+      { flexbuff : inventory_store.Chunk_Store }
+    for the flexbuffs of which the inventory backend lists all chunks
+    progress: optional callable(flexbuff, records, state), called from the
+    checking threads while the output is being parsed, 
+      records = [(experiment, station, scan, recording, number of bytes)],
+        the number of bytes is to be added to what was reported before
+      state = "scanning", "done" or "failed"
+    max_threads: maximum number of flexbuffs to check at the same time,
+    None for all at once
+    disk_parallelism: number of disks (or recordings, in du mode) to scan 
+    concurrently on each flexbuff
+    """
+    # [ FLEXBUF ][ EXP ][ STATION ][ SCAN ] = <number>
+    usage = collections.defaultdict(
+        lambda: collections.defaultdict(
+            lambda: collections.defaultdict(
+                lambda: collections.defaultdict(int))))
+    available = collections.defaultdict(list)
+    errors = collections.defaultdict(lambda: collections.defaultdict(list))
+    if chunks is None:
+        chunks = {}
+    def check_and_record_failure(backend, usage, available, errors, chunks):
+        flexbuff = backend.flexbuff
+        batcher = Inventory_Batcher(flexbuff.machine, progress) \
+                  if progress else None
+        try:
+            backend.scan(usage, available, errors, chunks, 
+                         is_mark6_data_format, batcher, disk_parallelism)
+            success = True
+        except Exception as e:
+            print "{f}: {e}".format(f=flexbuff.machine, e=e)
+            success = False
+        if not success and (failed is not None):
+            failed.add(flexbuff.machine)
+        if batcher:
+            batcher.finish(success)
+
+    tasks = []
+    for flexbuff in check:
+        backend = get_backend(flexbuff, scan_mode)
+        flexbuff_chunks = Chunk_Store()
+        if backend.lists_chunks:
+            chunks[flexbuff.machine] = flexbuff_chunks
+        tasks.append(functools.partial(
+            check_and_record_failure,
+            backend, 
+            usage[flexbuff.machine], 
+            available[flexbuff.machine], 
+            errors[flexbuff.machine],
+            flexbuff_chunks))
+    run_in_threads(tasks, max_threads)
+
+    return (usage, available, errors)
+
+class Inventory_Batcher(object):
+    """
+    Collects the inventory records of one flexbuff and passes them on to
+    'callback' in batches, to limit the number of (GUI) updates
+    """
+    def __init__(self, flexbuff, callback, size=1000, interval=0.5):
+        self.flexbuff = flexbuff
+        self.callback = callback
+        self.size = size
+        self.interval = interval
+        self.records = []
+        self.last_flush = time.time()
+
+    def add(self, record):
+        self.records.append(record)
+        if (len(self.records) >= self.size) or \
+           (time.time() - self.last_flush >= self.interval):
+            self.flush()
+
+    def flush(self, state="scanning"):
+        records = self.records
+        self.records = []
+        self.last_flush = time.time()
+        self.callback(self.flexbuff, records, state)
+
+    def finish(self, success):
+        self.flush("done" if success else "failed")
@@ -0,0 +1,518 @@
+"""
+Inventory backends, the ways to take the inventory of a FlexBuff.
+The SSH backend runs shell tools on the FlexBuff, the local backend reads 
+the disks directly, for when this program runs on the FlexBuff itself.
+This module doesn't depend on Qt.
+"""
+
+import ssh_pool
+
+import threading
+import collections
+import subprocess
+import Queue
+import re
+import pipes
+import glob
+import stat
+import socket
+import getpass
+import os
+import os.path
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # backport for python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+disk_pattern = {
+    "flexbuff" : "/mnt/disk*",
+    "mark6" : "/mnt/disks/*/*/data"
+}
+
+file_regexp = {
+    "flexbuff" : re.compile(
+        "^/mnt/disk[0-9]{1,3}/"
+        "(?P<experiment>[^_/]+)_(?P<station>[^_/]+)_(?P<scan>[^/]+)/"
+        "(?P=experiment)_(?P=station)_(?P=scan)\.[0-9]{8}"),
+    "mark6" : re.compile(
+        "^/mnt/disks/[1-4]/[0-7]/data/"
+        "(?P<experiment>[^_/]+)_(?P<station>[^_/]+)_(?P<scan>[^/]+)/"
+        "(?P=experiment)_(?P=station)_(?P=scan)\.[0-9]{8}")
+}
+
+dir_regexp = {
+    "flexbuff" : re.compile(
+        "^/mnt/disk[0-9]{1,3}/"
+        "(?P<experiment>[^_/]+)_(?P<station>[^_/]+)_(?P<scan>[^/]+)/"),
+    "mark6" : re.compile(
+        "^/mnt/disks/[1-4]/[0-7]/data/"
+        "(?P<experiment>[^_/]+)_(?P<station>[^_/]+)_(?P<scan>[^/]+)/")
+}
+
+du_error_regexp = {
+    "flexbuff" : re.compile(
+        "^du: cannot access.*(?P<disk>/mnt/disk[0-9]{1,3}/)"
+        "(?P<recording>[^/\s]+)"),
+    "mark6" : re.compile(
+        "^du: cannot access.*(?P<disk>/mnt/disks/[1-4]/[0-7]/data/)"
+        "(?P<recording>[^/\s]+)")
+}
+
+find_error_regexp = {
+    "flexbuff" : re.compile(
+        "^find: .*(?P<disk>/mnt/disk[0-9]{1,3}/)"
+        "(?P<recording>[^/\s']+)"),
+    "mark6" : re.compile(
+        "^find: .*(?P<disk>/mnt/disks/[1-4]/[0-7]/data/)"
+        "(?P<recording>[^/\s']+)")
+}
+
+def split_recording(recording):
+    """
+    returns (experiment, station, scan) of a vbs style recording name
+    or (None, None, None) for recordings not following that style
+    """
+    split = recording.split("_")
+    if len(split) < 3:
+        return (None, None, None)
+    return (split[0].upper(), split[1].capitalize(), "_".join(split[2:]))
+
+def run_in_threads(tasks, max_threads=None):
+    """
+    Call all tasks (callables without arguments), in at most 'max_threads'
+    threads at the same time (None for a thread per task),
+    returns when all tasks are done
+    """
+    queue = Queue.Queue()
+    for task in tasks:
+        queue.put(task)
+    def worker():
+        while True:
+            try:
+                task = queue.get_nowait()
+            except Queue.Empty:
+                return
+            task()
+
+    number_of_threads = len(tasks) if max_threads is None \
+                        else min(len(tasks), max_threads)
+    threads = [threading.Thread(target=worker) \
+               for _ in xrange(number_of_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+class Streaming_Process(object):
+    """
+    Iterate over the lines (without line end) of stdout of the process 
+    as they arrive, stderr is collected in a separate thread, 
+    to prevent the process from blocking on a full pipe
+    """
+    def __init__(self, args):
+        self.process = subprocess.Popen(
+            args=args,
+            bufsize=-1,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        self.error_lines = []
+        self._error_thread = threading.Thread(target=self._read_errors)
+        self._error_thread.start()
+
+    def _read_errors(self):
+        for line in iter(self.process.stderr.readline, ""):
+            self.error_lines.append(line.rstrip("\n"))
+
+    def __iter__(self):
+        # don't iterate over the file object itself, 
+        # its read ahead buffering would block the stream
+        for line in iter(self.process.stdout.readline, ""):
+            yield line.rstrip("\n")
+
+    def wait(self):
+        """
+        Pre: stdout has been read completely
+        returns the return code of the process
+        """
+        self._error_thread.join()
+        return self.process.wait()
+
+def check_flexbuff(flexbuff, usage, available, errors, recording_name=None,
+                   is_mark6_data_format=False, batcher=None, 
+                   disk_parallelism=1):
+    """
+    if recording_name:
+     usage has to be a dict, it will be filled in with {chunk path: size}
+     available is ignored
+    else:
+     usage has to be a defaultdict, it will be filled in with:
+     {experiment: {station: {(scan, recording): size}}}
+     batcher: optional Inventory_Batcher to pass on the records as they are 
+     parsed
+     disk_parallelism: number of recordings to run du on concurrently
+    returns whether the check succeeded
+    """
+    try:
+        check_flexbuff_usage(flexbuff, usage, errors, recording_name, 
+                             is_mark6_data_format, batcher, disk_parallelism)
+        if not recording_name:
+            check_flexbuff_availability(flexbuff, available)
+
+    except Exception as e:
+        print "{f}: {e}".format(f=flexbuff.machine, e=e)
+        return False
+    return True
+
+def check_flexbuff_usage(flexbuff, usage, errors, recording_name, 
+                         is_mark6_data_format, batcher=None, 
+                         disk_parallelism=1):
+    find_type = "f"
+    if recording_name is not None:
+        depth = 0
+        if is_mark6_data_format:
+            recording_path = recording_name
+        else:
+            recording_path = (os.path.join(recording_name, recording_name) + 
+                              ".*")
+    else:
+        depth = 1
+        if not is_mark6_data_format:
+            find_type = "d"
+        recording_path = ""
+
+    if disk_parallelism > 1:
+        # line buffered output, such that the lines of the concurrent du
+        # processes don't get mixed
+        du = "xargs -P {n} -n 16 stdbuf -oL du".format(n=disk_parallelism)
+    else:
+        du = "xargs du"
+    script = "find {p}/{r}  -mindepth {d}  -maxdepth {d} -type {t} | "\
+             "{du} -b -s --exclude lost+found/".format(
+                 p=disk_pattern[flexbuff.machine_type],
+                 r=recording_path,
+                 d=depth,
+                 t=find_type,
+                 du=du)
+
+    recording_regex = re.compile("^(?P<bytes>\d+)\s+(?P<recording>\S+)\s*$")
+    unexpected = None
+    with flexbuff_ssh_channel(flexbuff):
+        process = Streaming_Process(flexbuff_ssh_args(flexbuff, script))
+        for line in process:
+            if (line == "") or unexpected:
+                continue
+            match = recording_regex.match(line)
+            if match:
+                size = int(match.group("bytes"))
+                if recording_name:
+                    path = match.group("recording")
+                    usage[path] = size
+                else:
+                    recording = os.path.split(match.group("recording"))[1]
+                    (experiment, station, scan) = split_recording(recording)
+                    usage[experiment][station][(scan, recording)] += size
+                    if batcher:
+                        batcher.add((experiment, station, scan, recording, 
+                                     size))
+            else:
+                # keep on reading, such that the process can finish
+                unexpected = line
+
+        returncode = process.wait()
+    if returncode != 0:
+        if returncode not in [1, 123]:
+            # return code of du when encoutering disk problems (123)
+            # or permission problems (1)
+            raise RuntimeError("du failed with return code {r}".format(
+                r=returncode))
+        for line in process.error_lines:
+            if line == "":
+                continue
+            match = du_error_regexp[flexbuff.machine_type].match(line)
+            if match:
+                errors[match.group("disk")].append(match.group("recording"))
+    if unexpected is not None:
+        raise RuntimeError(
+            "Unexpected line on du output: '{line}'".format(line=unexpected))
+
+def flexbuff_ssh_args(flexbuff, script):
+    """
+    returns the arguments to execute the bash 'script' on 'flexbuff'
+    """
+    return ssh_pool.ssh_args(flexbuff.user, flexbuff.machine, 
+                             "bash -c {s}".format(s=pipes.quote(script)))
+
+def flexbuff_ssh_channel(flexbuff):
+    """
+    context manager to hold one of the ssh channels to 'flexbuff'
+    """
+    return ssh_pool.channel(flexbuff.user, flexbuff.machine)
+
+# separates the chunk listing from the df output in single pass mode
+inventory_df_marker = "--- jcm df ---"
+
+def check_flexbuff_chunks(flexbuff, usage, available, errors, chunks,
+                          is_mark6_data_format, batcher=None, 
+                          disk_parallelism=1):
+    # vbs recordings are directories of chunks, 
+    # mark6 recordings are files (one per disk)
+    depth = 1 if is_mark6_data_format else 2
+    find = "find {{}} -mindepth {d} -maxdepth {d} -type f "\
+           "-printf '%s %p\\n'".format(d=depth)
+    if disk_parallelism > 1:
+        # a find per disk, line buffered, such that the lines of the 
+        # concurrent find processes don't get mixed
+        find = "printf '%s\\n' {p}/ | xargs -d '\\n' -P {n} -I{{}} "\
+               "stdbuf -oL {f}".format(
+                   p=disk_pattern[flexbuff.machine_type],
+                   n=disk_parallelism,
+                   f=find)
+    else:
+        find = find.format(disk_pattern[flexbuff.machine_type] + "/")
+    script = "{f}; echo '{m}'; df -B 1 --total {p}".format(
+        f=find,
+        m=inventory_df_marker,
+        p=disk_pattern[flexbuff.machine_type])
+    with flexbuff_ssh_channel(flexbuff):
+        process = Streaming_Process(flexbuff_ssh_args(flexbuff, script))
+
+        lines = iter(process)
+        for line in lines:
+            if line == inventory_df_marker:
+                break
+            if line == "":
+                continue
+            (size, path) = line.split(" ", 1)
+            size = int(size)
+            if is_mark6_data_format:
+                recording = os.path.basename(path)
+            else:
+                recording = os.path.basename(os.path.dirname(path))
+                if recording == "lost+found":
+                    continue
+            (experiment, station, scan) = split_recording(recording)
+            usage[experiment][station][(scan, recording)] += size
+            chunks.add(recording, path, size)
+            if batcher:
+                batcher.add((experiment, station, scan, recording, size))
+        parse_df_total(lines, available)
+
+        returncode = process.wait()
+    if returncode not in [0, 1]:
+        # df returns 1 on problems with some of the disks
+        raise RuntimeError("inventory failed with return code {r}".format(
+            r=returncode))
+    for line in process.error_lines:
+        match = find_error_regexp[flexbuff.machine_type].match(line)
+        if match:
+            errors[match.group("disk")].append(match.group("recording"))
+
+def parse_df_total(lines, available):
+    regex = re.compile("^total\s+(?P<total>\d+)\s+(?P<used>\d+)\s+"
+                       "(?P<available>\d+)\s+\d+%")
+    for line in lines:
+        match = regex.match(line)
+        if match:
+            available[:] = [int(match.group("total")),
+                            int(match.group("used")),
+                            int(match.group("available"))]
+
+def check_flexbuff_availability(flexbuff, available):
+    # disk space available
+    with flexbuff_ssh_channel(flexbuff):
+        output = subprocess.check_output(
+            flexbuff_ssh_args(flexbuff, "df -B 1 --total /mnt/disk*"))
+    parse_df_total(output.split('\n'), available)
+
+class Inventory_Backend(object):
+    """
+    Interface of the inventory backends
+    """
+    # whether scan fills in the chunks of every recording
+    lists_chunks = False
+
+    def __init__(self, flexbuff):
+        self.flexbuff = flexbuff
+
+    def scan(self, usage, available, errors, chunks, 
+             is_mark6_data_format=False, batcher=None, disk_parallelism=1):
+        """
+        Take the inventory of the flexbuff, raises an exception on failure
+        usage has to be a defaultdict, it will be filled in with:
+         {experiment: {station: {(scan, recording): size}}}
+        available will be filled in with: 
+         [sum of disk sizes, sum of bytes used, sum of bytes available]
+        errors has to be a defaultdict(list), it will be filled in with:
+         {mount point: [recordings]}
+        chunks has to be an inventory_store.Chunk_Store, if lists_chunks, 
+        the chunks of every recording will be added to it
+        batcher: optional Inventory_Batcher to pass on the records as they are 
+        found
+        disk_parallelism: number of disks to scan concurrently
+        """
+        raise NotImplementedError()
+
+    def list_chunks(self, recording, is_mark6_data_format=False):
+        """
+        returns {chunk path: size} of 'recording', 
+        raises an exception on failure
+        """
+        raise NotImplementedError()
+
+class SSH_Inventory_Backend(Inventory_Backend):
+    def __init__(self, flexbuff, scan_mode="single_pass"):
+        """
+        scan_mode: "du" or "single_pass", see get_flexbuff_meta_data
+        """
+        super(SSH_Inventory_Backend, self).__init__(flexbuff)
+        self.lists_chunks = (scan_mode == "single_pass")
+
+    def scan(self, usage, available, errors, chunks, 
+             is_mark6_data_format=False, batcher=None, disk_parallelism=1):
+        if self.lists_chunks:
+            check_flexbuff_chunks(self.flexbuff, usage, available, errors, 
+                                  chunks, is_mark6_data_format, batcher, 
+                                  disk_parallelism)
+        else:
+            check_flexbuff_usage(self.flexbuff, usage, errors, None, 
+                                 is_mark6_data_format, batcher, 
+                                 disk_parallelism)
+            check_flexbuff_availability(self.flexbuff, available)
+
+    def list_chunks(self, recording, is_mark6_data_format=False):
+        chunks = {}
+        check_flexbuff_usage(self.flexbuff, chunks, 
+                             collections.defaultdict(list), recording,
+                             is_mark6_data_format)
+        return chunks
+
+def _list_directory(directory, directories):
+    """
+    returns [(path, size)] of the regular files, or the paths of the 
+    directories if 'directories', in 'directory', 
+    symbolic links are not followed (like find)
+    """
+    if scandir is not None:
+        if directories:
+            return [entry.path for entry in scandir(directory) \
+                    if entry.is_dir(follow_symlinks=False)]
+        return [(entry.path, entry.stat(follow_symlinks=False).st_size) \
+                for entry in scandir(directory) \
+                if entry.is_file(follow_symlinks=False)]
+    result = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        status = os.lstat(path)
+        if directories:
+            if stat.S_ISDIR(status.st_mode):
+                result.append(path)
+        elif stat.S_ISREG(status.st_mode):
+            result.append((path, status.st_size))
+    return result
+
+class Local_Inventory_Backend(Inventory_Backend):
+    """
+    Reads the disks directly, in this process, no processes are spawned
+    """
+    lists_chunks = True
+
+    def __init__(self, flexbuff, pattern=None):
+        """
+        pattern: the disk mount points pattern, 
+          defaults to the one of the flexbuff machine type
+        """
+        super(Local_Inventory_Backend, self).__init__(flexbuff)
+        self.pattern = pattern if pattern is not None \
+                       else disk_pattern[flexbuff.machine_type]
+
+    def scan(self, usage, available, errors, chunks, 
+             is_mark6_data_format=False, batcher=None, disk_parallelism=1):
+        disks = sorted(glob.glob(self.pattern))
+        lock = threading.Lock()
+
+        def add(recording, files):
+            (experiment, station, scan) = split_recording(recording)
+            with lock:
+                for (path, size) in files:
+                    usage[experiment][station][(scan, recording)] += size
+                    chunks.add(recording, path, size)
+                    if batcher:
+                        batcher.add((experiment, station, scan, recording, 
+                                     size))
+
+        def scan_disk(disk):
+            mount_point = os.path.join(disk, "")
+            try:
+                if is_mark6_data_format:
+                    # recordings are files, one per disk
+                    for (path, size) in _list_directory(disk, False):
+                        add(os.path.basename(path), [(path, size)])
+                    return
+                recording_directories = _list_directory(disk, True)
+            except OSError as e:
+                print "warning, failed to scan {d}: {e}".format(d=disk, e=e)
+                return
+            for directory in recording_directories:
+                recording = os.path.basename(directory)
+                if recording == "lost+found":
+                    continue
+                try:
+                    files = _list_directory(directory, False)
+                except OSError:
+                    with lock:
+                        errors[mount_point].append(recording)
+                    continue
+                add(recording, files)
+
+        run_in_threads([lambda disk=disk: scan_disk(disk) for disk in disks],
+                       max(1, disk_parallelism))
+
+        totals = [0, 0, 0]
+        for disk in disks:
+            status = os.statvfs(disk)
+            totals[0] += status.f_blocks * status.f_frsize
+            totals[1] += (status.f_blocks - status.f_bfree) * status.f_frsize
+            totals[2] += status.f_bavail * status.f_frsize
+        if disks:
+            available[:] = totals
+
+    def list_chunks(self, recording, is_mark6_data_format=False):
+        if is_mark6_data_format:
+            paths = glob.glob(os.path.join(self.pattern, recording))
+        else:
+            paths = glob.glob(os.path.join(self.pattern, recording, 
+                                           recording + ".*"))
+        return {path : os.path.getsize(path) for path in paths \
+                if os.path.isfile(path)}
+
+_local_names = None
+def is_this_machine(flexbuff):
+    """
+    returns whether flexbuff refers to the machine this program runs on,
+    as the user running this program
+    """
+    global _local_names
+    if flexbuff.user not in [None, getpass.getuser()]:
+        return False
+    if _local_names is None:
+        _local_names = set(["localhost", socket.gethostname(), 
+                            socket.getfqdn()])
+    return flexbuff.machine in _local_names
+
+def get_backend(flexbuff, scan_mode="single_pass"):
+    """
+    returns the inventory backend to use for flexbuff,
+    which can be set in the configuration (inventory_backend: local or ssh),
+    by default the local backend is used for this machine
+    """
+    backend = getattr(flexbuff, "inventory_backend", None)
+    if backend is None:
+        backend = "local" if is_this_machine(flexbuff) else "ssh"
+    if backend == "local":
+        return Local_Inventory_Backend(flexbuff)
+    return SSH_Inventory_Backend(flexbuff, scan_mode)
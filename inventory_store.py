@@ -0,0 +1,379 @@
+"""
+Compact, column oriented, table of the recordings of (multiple) FlexBuffs.
+Every recording is a row, the experiment, station and scan names are
+interned, sizes and presence are stored per host in arrays. The rows are
+sorted by (experiment, station, scan, recording), such that the recordings
+of a station and the stations of an experiment are contiguous ranges,
+with the sizes and hosts of those groups computed once, when the table is
+built.
+This module doesn't depend on Qt.
+"""
+
+import array
+
+class Interned_Names(object):
+    """
+    Maps names to small integer ids and back
+    """
+    def __init__(self):
+        self.names = []
+        self._ids = {}
+
+    def intern(self, name):
+        id_ = self._ids.get(name)
+        if id_ is None:
+            id_ = len(self.names)
+            self._ids[name] = id_
+            self.names.append(name)
+        return id_
+
+    def id(self, name):
+        """
+        returns the id of name, None if unknown
+        """
+        return self._ids.get(name)
+
+    def __getitem__(self, id_):
+        return self.names[id_]
+
+    def __len__(self):
+        return len(self.names)
+
+class Inventory_Store(object):
+    # array type code for byte counts, 64 bit on the (linux) hosts we run on
+    size_type = "l"
+
+    def __init__(self, usage):
+        """
+        usage =
+          { flexbuff : { experiment : { station : { (scan, recording) : bytes}}}}
+        recordings with experiment None (not vbs-type data) are ignored
+        """
+        self.hosts = sorted(usage.keys())
+        self.experiment_names = Interned_Names()
+        self.station_names = Interned_Names()
+        self.scan_names = Interned_Names()
+        self.recordings = []
+
+        # first pass, collect the recordings and per host sizes by key
+        # { (experiment id, station id, scan id, recording) : {host : bytes} }
+        sizes = {}
+        for host_index, host in enumerate(self.hosts):
+            for experiment, station_data in usage[host].items():
+                if experiment is None:
+                    # used to indicate not-vbs-type data
+                    continue
+                experiment_id = self.experiment_names.intern(experiment)
+                for station, scan_data in station_data.items():
+                    station_id = self.station_names.intern(station)
+                    for ((scan, recording), size) in scan_data.items():
+                        key = (experiment_id, station_id,
+                               self.scan_names.intern(scan), recording)
+                        sizes.setdefault(key, {})[host_index] = size
+
+        keys = sorted(sizes.keys(), key=lambda key: (
+            self.experiment_names[key[0]],
+            self.station_names[key[1]],
+            self.scan_names[key[2]],
+            key[3]))
+
+        # row columns
+        self.experiment = array.array("i")
+        self.station = array.array("i")
+        self.scan = array.array("i")
+        self.size = array.array(self.size_type)
+        # number of hosts the recording is present on
+        self.copies = array.array("i")
+        self.host_size = [array.array(self.size_type) for _ in self.hosts]
+        self.host_presence = [array.array("B") for _ in self.hosts]
+        # group rollups, experiment groups and station groups are numbered in
+        # row order, the group columns are indexed by group number
+        self.experiment_groups = array.array("i") # experiment ids
+        self.experiment_first_station = array.array("i")
+        self.experiment_size = array.array(self.size_type)
+        self.experiment_copies = array.array("i")
+        self.experiment_hosts = [] # bit masks over host indices
+        self.station_groups = array.array("i") # station ids
+        self.station_first_row = array.array("i")
+        self.station_size = array.array(self.size_type)
+        self.station_copies = array.array("i")
+        self.station_hosts = []
+        # { experiment id : experiment group }
+        self._experiment_group = {}
+
+        previous = None
+        for row, key in enumerate(keys):
+            (experiment_id, station_id, scan_id, recording) = key
+            if (previous is None) or (previous[0] != experiment_id):
+                self._experiment_group[experiment_id] = \
+                    len(self.experiment_groups)
+                self.experiment_groups.append(experiment_id)
+                self.experiment_first_station.append(len(self.station_groups))
+                self.experiment_size.append(0)
+                self.experiment_copies.append(0)
+                self.experiment_hosts.append(0)
+            if (previous is None) or (previous[:2] != key[:2]):
+                self.station_groups.append(station_id)
+                self.station_first_row.append(row)
+                self.station_size.append(0)
+                self.station_copies.append(0)
+                self.station_hosts.append(0)
+            previous = key
+
+            self.experiment.append(experiment_id)
+            self.station.append(station_id)
+            self.scan.append(scan_id)
+            self.recordings.append(recording)
+            host_sizes = sizes.pop(key)
+            copies = len(host_sizes)
+            total = 0
+            mask = 0
+            for host_index in xrange(len(self.hosts)):
+                size = host_sizes.get(host_index)
+                if size is None:
+                    self.host_size[host_index].append(0)
+                    self.host_presence[host_index].append(0)
+                else:
+                    self.host_size[host_index].append(size)
+                    self.host_presence[host_index].append(1)
+                    total += size
+                    mask |= 1 << host_index
+            self.size.append(total)
+            self.copies.append(copies)
+            self.experiment_size[-1] += total
+            self.experiment_copies[-1] += copies
+            self.experiment_hosts[-1] |= mask
+            self.station_size[-1] += total
+            self.station_copies[-1] += copies
+            self.station_hosts[-1] |= mask
+        # sentinels, such that group ranges are [first[i], first[i+1])
+        self.experiment_first_station.append(len(self.station_groups))
+        self.station_first_row.append(len(self.recordings))
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def _hosts(self, mask):
+        return [host for index, host in enumerate(self.hosts) \
+                if mask & (1 << index)]
+
+    def experiments(self):
+        """
+        returns the sorted list of experiment names
+        """
+        return [self.experiment_names[id_] for id_ in self.experiment_groups]
+
+    def experiment_group(self, experiment):
+        """
+        returns the group number of experiment, None if unknown
+        """
+        return self._experiment_group.get(
+            self.experiment_names.id(experiment))
+
+    def station_group_range(self, experiment_group):
+        """
+        returns the range of station groups of the experiment group
+        """
+        return xrange(self.experiment_first_station[experiment_group],
+                      self.experiment_first_station[experiment_group + 1])
+
+    def station_group(self, experiment, station):
+        """
+        returns the group number of (experiment, station), None if unknown
+        """
+        experiment_group = self.experiment_group(experiment)
+        station_id = self.station_names.id(station)
+        if (experiment_group is None) or (station_id is None):
+            return None
+        for group in self.station_group_range(experiment_group):
+            if self.station_groups[group] == station_id:
+                return group
+        return None
+
+    def row_range(self, station_group):
+        """
+        returns the range of rows of the station group
+        """
+        return xrange(self.station_first_row[station_group],
+                      self.station_first_row[station_group + 1])
+
+    def find(self, experiment, station, scan):
+        """
+        returns the row of the recording of (experiment, station, scan),
+        None if unknown
+        """
+        group = self.station_group(experiment, station)
+        if group is None:
+            return None
+        # rows within a station are sorted by scan name
+        (low, end) = (self.station_first_row[group],
+                      self.station_first_row[group + 1])
+        high = end
+        while low < high:
+            middle = (low + high) // 2
+            if self.scan_names[self.scan[middle]] < scan:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < end) and (self.scan_names[self.scan[low]] == scan):
+            return low
+        return None
+
+    def experiment_name(self, experiment_group):
+        return self.experiment_names[self.experiment_groups[experiment_group]]
+
+    def station_name(self, station_group):
+        return self.station_names[self.station_groups[station_group]]
+
+    def scan_name(self, row):
+        return self.scan_names[self.scan[row]]
+
+    def experiment_hosts_of(self, experiment_group):
+        return self._hosts(self.experiment_hosts[experiment_group])
+
+    def station_hosts_of(self, station_group):
+        return self._hosts(self.station_hosts[station_group])
+
+    def row_hosts(self, row):
+        """
+        returns the hosts on which the recording of row is present
+        """
+        return [host for index, host in enumerate(self.hosts) \
+                if self.host_presence[index][row]]
+
+    def row_host_size(self, row, host):
+        """
+        returns the number of bytes of the recording of row on host
+        """
+        return self.host_size[self.hosts.index(host)][row]
+
+    def select(self, experiment=None, station=None, recordings=None):
+        """
+        returns the rows of the recordings of experiment (and station, if
+        given) and of the named recordings, in row order
+        raises KeyError for an unknown experiment, station or recording
+        """
+        rows = set()
+        if experiment is not None:
+            experiment_group = self.experiment_group(experiment)
+            if experiment_group is None:
+                raise KeyError("unknown experiment '{e}'".format(
+                    e=experiment))
+            if station is None:
+                groups = self.station_group_range(experiment_group)
+            else:
+                group = self.station_group(experiment, station)
+                if group is None:
+                    raise KeyError("unknown station '{s}' of '{e}'".format(
+                        s=station, e=experiment))
+                groups = [group]
+            for group in groups:
+                rows.update(self.row_range(group))
+        if recordings:
+            row_of = {recording : row \
+                      for (row, recording) in enumerate(self.recordings)}
+            for recording in recordings:
+                row = row_of.get(recording)
+                if row is None:
+                    raise KeyError("unknown recording '{r}'".format(
+                        r=recording))
+                rows.add(row)
+        return sorted(rows)
+
+class Chunk_Store(object):
+    """
+    The chunks (files) of the recordings of one FlexBuff, as listed by an
+    inventory. Every chunk is a row: its path, interned with the recording
+    name replaced by a placeholder (such that e.g. 
+    /mnt/disk3/<rec>/<rec>.00000001 is shared by all recordings), and its
+    size. The rows of a recording are linked, such that chunks can be added
+    in any order.
+    Reads like { recording : { chunk path : bytes } }, the chunks of a
+    recording are expanded to a dict when asked for.
+    """
+    placeholder = "\0"
+
+    def __init__(self):
+        self.templates = Interned_Names()
+        self.template = array.array("i")
+        self.size = array.array(Inventory_Store.size_type)
+        # the row of the chunk of the same recording added before, -1 if none
+        self.previous = array.array("i")
+        self._last = {} # { recording : row of its last added chunk }
+
+    def add(self, recording, path, size):
+        self.template.append(self.templates.intern(
+            path.replace(recording, self.placeholder)))
+        self.size.append(size)
+        self.previous.append(self._last.get(recording, -1))
+        self._last[recording] = len(self.size) - 1
+
+    def chunks(self, recording):
+        """
+        yields (chunk path, bytes) of recording, last added first
+        """
+        row = self._last.get(recording, -1)
+        while row != -1:
+            yield (self.templates[self.template[row]].replace(
+                       self.placeholder, recording),
+                   self.size[row])
+            row = self.previous[row]
+
+    def get(self, recording, default=None):
+        """
+        returns { chunk path : bytes } of recording, default if unknown
+        """
+        if recording not in self._last:
+            return default
+        result = {}
+        for (path, size) in self.chunks(recording):
+            # a chunk added again replaces the earlier one
+            result.setdefault(path, size)
+        return result
+
+    def __getitem__(self, recording):
+        result = self.get(recording)
+        if result is None:
+            raise KeyError(recording)
+        return result
+
+    def __contains__(self, recording):
+        return recording in self._last
+
+    def __len__(self):
+        return len(self._last)
+
+    def keys(self):
+        return self._last.keys()
+
+    def rows(self):
+        """
+        yields (recording, chunk path, bytes) of all chunks
+        """
+        for recording in self._last.keys():
+            for (path, size) in self.get(recording).items():
+                yield (recording, path, size)
+
+def diff_sorted(old, new):
+    """
+    old, new: sorted sequences of unique keys
+    yields (old index, new index) pairs in key order,
+    (old index, None) for keys only in old, (None, new index) for keys only
+    in new
+    """
+    (i, j) = (0, 0)
+    while (i < len(old)) and (j < len(new)):
+        if old[i] < new[j]:
+            yield (i, None)
+            i += 1
+        elif new[j] < old[i]:
+            yield (None, j)
+            j += 1
+        else:
+            yield (i, j)
+            i += 1
+            j += 1
+    for i in xrange(i, len(old)):
+        yield (i, None)
+    for j in xrange(j, len(new)):
+        yield (None, j)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
-import machine_widget
+import time
+# start of the startup time measurement, before the (slow) imports
+start_time = time.time()
 
 import PyQt4.QtGui as QtGui
 import PyQt4.QtCore as QtCore
@@ -11,6 +13,8 @@ import logging
 class Main_Window(QtGui.QSplitter):
     def __init__(self, parent=None):
         super(Main_Window, self).__init__(QtCore.Qt.Horizontal, parent)
+        # the modules of the program are imported where they are first used
+        import machine_widget
         # two widgets to allow copying
         self.left = machine_widget.Machine_Widget(self)
         self.right = machine_widget.Machine_Widget(self)
@@ -22,19 +26,94 @@ class Main_Window(QtGui.QSplitter):
     def await_machine_threads(self):
         for widget in [self.left, self.right]:
             widget.await_threads()
-        
+
+    def offer_resume(self):
+        """
+        offer to continue the m5copy batches that didn't finish in an 
+        earlier session
+        """
+        from transfer_journal import get_journal
+        journal = get_journal()
+        if journal is None:
+            return
+        try:
+            batches = journal.unfinished_batches()
+        except Exception as e:
+            print "warning, transfer journal failed: {e}".format(e=e)
+            return
+        if not batches:
+            return
+        from m5copy_widget import M5copy_Dialog
+        # batches of which the owner still runs are not ours to take
+        batches = [batch for batch in batches \
+                   if (batch.kind == M5copy_Dialog.command) and \
+                   batch.orphaned]
+        if not batches:
+            return
+        answer = QtGui.QMessageBox.question(
+            self, "Unfinished transfers",
+            "There {v} {n} unfinished transfer batch{es} from an earlier "
+            "session:\n{t}\n\nResume?".format(
+                v="is" if len(batches) == 1 else "are",
+                n=len(batches),
+                es="" if len(batches) == 1 else "es",
+                t="\n".join("{t} ({n} commands left)".format(
+                    t=batch.title,
+                    n=len([job for job in batch.jobs \
+                           if job.state != "done"])) \
+                             for batch in batches)),
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.No)
+        for batch in batches:
+            try:
+                if not journal.claim_batch(batch):
+                    # another instance was first
+                    continue
+            except Exception as e:
+                print "warning, transfer journal failed: {e}".format(e=e)
+                continue
+            if answer == QtGui.QMessageBox.Yes:
+                dialog = M5copy_Dialog.resumed(batch, self)
+                dialog.show()
+                dialog.raise_()
+            else:
+                try:
+                    journal.discard_batch(batch.id)
+                except Exception as e:
+                    print "warning, transfer journal failed: {e}".format(e=e)
+
+def report_startup_time(quit):
+    """
+    called once the event loop runs, i.e. the main window is shown
+    quit: exit after reporting, to measure from a script
+    """
+    startup_time = time.time() - start_time
+    logging.info("startup took %.3f s", startup_time)
+    if quit:
+        print "startup time: {t:.3f} s".format(t=startup_time)
+        QtGui.QApplication.instance().quit()
                
 if __name__ == "__main__":
     logging.basicConfig(
         format="%(asctime)s - %(levelname)s - %(filename)s@%(lineno)s: "
                "%(message)s",
         level=logging.DEBUG)
-    app = QtGui.QApplication(sys.argv)
+    # --startup-time: report the time to show the main window and exit
+    measure_startup = "--startup-time" in sys.argv
+    app = QtGui.QApplication([arg for arg in sys.argv \
+                              if arg != "--startup-time"])
     window = Main_Window()
     size = window.size()
     size.setHeight(800)
     window.resize(size)
     app.lastWindowClosed.connect(window.await_machine_threads)
+    import ssh_pool
+    import control_pool
+    # after the threads are done, no more remote commands will be started
+    app.lastWindowClosed.connect(ssh_pool.close_all)
+    app.lastWindowClosed.connect(control_pool.close_all)
     window.setWindowTitle("Jive5ab Copy Manager")
     window.show()
+    QtCore.QTimer.singleShot(0, lambda: report_startup_time(measure_startup))
+    if not measure_startup:
+        QtCore.QTimer.singleShot(0, window.offer_resume)
     sys.exit(app.exec_())
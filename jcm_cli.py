@@ -0,0 +1,723 @@
+#!/usr/bin/env python
+"""
+Command line interface to the inventories, checks and m5copy batches,
+for scripts and cron jobs. Tables are written to stdout as tab separated
+values with a header line, or as JSON, messages go to stderr.
+This module doesn't depend on Qt.
+
+Examples:
+  jcm_cli.py hosts
+  jcm_cli.py ls flexbuff aribox --cached
+  jcm_cli.py ls mark5 10.88.0.50 --bank A
+  jcm_cli.py check flexbuff aribox --experiment ev123 --station On
+  jcm_cli.py copy flexbuff aribox ev123_on_no0001 --to flexbuff flexbuf0
+  jcm_cli.py ls flexbuff aribox | awk 'NR>1 && $3=="Wb" {print $5}' | \\
+    jcm_cli.py copy flexbuff aribox - --to file jops@host:2620 \\
+    --directory /data/ev123
+"""
+
+from import_proxy import (get_settings, get_machine, parse_host,
+                          Hashable_Bunch, execute_query)
+from inventory import get_flexbuff_meta_data
+from inventory_store import Inventory_Store
+from catalog import get_catalog
+from checks import run_checks, flexbuff_check, mark5_check, file_check
+from mark5_directory import read_bank
+from file_listing import list_directory
+from m5copy_commands import (generate_commands, with_data_port,
+                             flexbuff_source, flexbuff_destination,
+                             mark5_source, mark5_destination, file_source,
+                             file_destination)
+from transfer_scheduler import Transfer_Scheduler
+from transfer_journal import get_journal, reconcile
+from batch_jobs import Batch_Jobs
+import control_pool
+import ssh_pool
+
+import argparse
+import collections
+import subprocess
+import threading
+import signal
+import shlex
+import Queue
+import json
+import time
+import sys
+import os.path
+
+class Usage_Error(Exception):
+    pass
+
+def message(text):
+    print >> sys.stderr, text
+
+def write_table(columns, rows, format_):
+    """
+    rows: sequences of values in the order of columns
+    """
+    if format_ == "json":
+        json.dump([collections.OrderedDict(zip(columns, row)) \
+                   for row in rows],
+                  sys.stdout, indent=1)
+        sys.stdout.write("\n")
+        return
+    sys.stdout.write("\t".join(columns) + "\n")
+    for row in rows:
+        sys.stdout.write("\t".join("" if value is None else str(value) \
+                                   for value in row) + "\n")
+
+def read_arguments(values):
+    """
+    returns values, with "-" replaced by the lines of stdin
+    """
+    result = []
+    for value in values:
+        if value == "-":
+            result.extend(line.strip() for line in sys.stdin \
+                          if line.strip())
+        else:
+            result.append(value)
+    return result
+
+# machines
+
+def configured_flexbuffs():
+    """
+    returns [(flexbuff, local, station)], remote flexbuffs are named after
+    their control IP, as in the machine views
+    """
+    flexbuffs = [(fb, True, None) for fb in get_machine("local_flexbuff")]
+    for fb in get_machine("remote_flexbuff"):
+        flexbuffs.append((Hashable_Bunch(user=fb.user,
+                                         machine=fb.control_ip,
+                                         port=fb.port,
+                                         control_ip=fb.control_ip,
+                                         data_ip=fb.data_ip,
+                                         machine_type=fb.machine_type),
+                          False, fb.station))
+    return flexbuffs
+
+def find_flexbuffs(names):
+    """
+    names: configured machine names, control IPs, stations, "local" for
+    all local FlexBuffs, or [user@]host[:port[:data_ip]]
+    returns the list of flexbuff Hashable_Bunch
+    """
+    configured = configured_flexbuffs()
+    result = []
+    for name in names:
+        if name == "local":
+            found = [fb for (fb, local, _) in configured if local]
+        else:
+            found = [fb for (fb, _, station) in configured \
+                     if name in [fb.machine, fb.control_ip, station]]
+        if not found:
+            host = parse_host(name)
+            found = [Hashable_Bunch(user=host.user, machine=host.machine,
+                                    port=host.port, control_ip=host.machine,
+                                    data_ip=host.data_ip,
+                                    machine_type="flexbuff")]
+        for flexbuff in found:
+            if flexbuff not in result:
+                result.append(flexbuff)
+    return result
+
+def find_machine(type_, name):
+    """
+    type_: "mark5" or "file"
+    returns the configured machine with name or control IP name,
+    or the machine described by [user@]host[:port[:data_ip]]
+    """
+    for machine in get_machine(type_):
+        if name in [machine.machine, machine.control_ip]:
+            return machine
+    host = parse_host(name)
+    return Hashable_Bunch(user=host.user, machine=host.machine,
+                          control_ip=host.machine, port=host.port,
+                          data_ip=host.data_ip)
+
+def data_format(args):
+    return "mark6" if args.mark6 else "vbs"
+
+def flexbuff_inventory(flexbuffs, args):
+    """
+    returns (Inventory_Store, chunks, failed) of the flexbuffs, scanned or
+    from the catalog (args.cached), the catalog is updated with the scan
+    chunks = { flexbuff : inventory_store.Chunk_Store }
+    """
+    machines = [fb.machine for fb in flexbuffs]
+    catalog = get_catalog()
+    if args.cached:
+        if not catalog:
+            raise Usage_Error("the catalog is disabled, cannot use --cached")
+        (usage, _, updated) = catalog.load(machines, data_format(args))
+        failed = set(machines) - set(updated.keys())
+        for machine in sorted(failed):
+            message("warning, no inventory of {m} in the catalog".format(
+                m=machine))
+        return (Inventory_Store(usage), {}, failed)
+
+    settings = get_settings()
+    failed = set()
+    chunks = {}
+    (usage, available, _) = get_flexbuff_meta_data(
+        flexbuffs, args.mark6, failed, settings["inventory_scan_mode"],
+        chunks, None, settings["inventory_max_hosts"],
+        settings["inventory_disk_parallelism"])
+    for machine in sorted(failed):
+        message("warning, failed to scan {m}".format(m=machine))
+    if catalog:
+        try:
+            for machine in machines:
+                if machine not in failed:
+                    catalog.store(machine, data_format(args),
+                                  usage[machine], available[machine],
+                                  chunks.get(machine))
+        except Exception as e:
+            message("warning, inventory catalog failed: {e}".format(e=e))
+    usage = {machine : usage[machine] for machine in machines \
+             if machine not in failed}
+    return (Inventory_Store(usage), chunks, failed)
+
+def flexbuff_selection(args):
+    """
+    returns [(flexbuff, recording, bytes, chunks)] of the selected
+    recordings, chunks = { chunk path : bytes } or None if unknown
+    """
+    flexbuffs = find_flexbuffs(args.machines)
+    recordings = read_arguments(args.recordings)
+    if (not recordings) and (args.experiment is None):
+        raise Usage_Error("select recordings, or an experiment")
+    (store, chunks, _) = flexbuff_inventory(flexbuffs, args)
+    try:
+        rows = store.select(
+            None if args.experiment is None else args.experiment.upper(),
+            None if args.station is None else args.station.capitalize(),
+            recordings)
+    except KeyError as e:
+        raise Usage_Error(e.args[0])
+    by_machine = {fb.machine : fb for fb in flexbuffs}
+    return [(by_machine[host], store.recordings[row],
+             store.row_host_size(row, host),
+             chunks.get(host, {}).get(store.recordings[row])) \
+            for row in rows for host in store.row_hosts(row)]
+
+def mark5_selection(args):
+    """
+    returns (mark5, [(bank, number, scan, bytes)], vsn, info) of the
+    selected scans (by number or name), all scans if none are selected,
+    info: the bank as returned by read_bank
+    """
+    mark5 = find_machine("mark5", args.machine)
+    bank = args.bank.upper()
+    with control_pool.connection(mark5.control_ip, mark5.port) as s:
+        reply = execute_query(s, "bank_set?", ["0", "1"])
+        vsn = {reply[index-1] : reply[index] for index in [3, 5] \
+               if len(reply) > index}.get(bank)
+        info = read_bank(s, bank, vsn)
+    selected = read_arguments(getattr(args, "scans", []))
+    names = [scan for (_, scan, _) in info.scans]
+    result = []
+    for (number, scan, size) in info.scans:
+        if (not selected) or (str(number) in selected) or \
+           (scan in selected):
+            # m5copy selects duplicate recordings by number
+            result.append((bank, number,
+                           str(number) if names.count(scan) > 1 else scan,
+                           size))
+    return (mark5, result, vsn, info)
+
+def file_sizes(machine, paths):
+    """
+    returns { path : bytes } of files, listing each directory once
+    """
+    directories = {}
+    sizes = {}
+    for path in paths:
+        (directory, name) = os.path.split(path)
+        if directory not in directories:
+            directories[directory] = {
+                entry_name : size for (entry_name, is_directory, size) in \
+                list_directory(machine.user, machine.control_ip,
+                               directory or "/") \
+                if not is_directory}
+        if name not in directories[directory]:
+            raise Usage_Error("no file '{p}' on {m}".format(
+                p=path, m=machine.control_ip))
+        sizes[path] = directories[directory][name]
+    return sizes
+
+# commands
+
+def hosts_command(args):
+    rows = []
+    types = [args.type] if args.type else ["flexbuff", "mark5", "file"]
+    if "flexbuff" in types:
+        for (fb, local, station) in configured_flexbuffs():
+            rows.append(("flexbuff", fb.machine, fb.user, fb.control_ip,
+                         fb.port, fb.data_ip,
+                         "local" if local else station))
+    for type_ in ["mark5", "file"]:
+        if type_ in types:
+            for machine in get_machine(type_):
+                rows.append((type_, machine.machine,
+                             getattr(machine, "user", None), machine.control_ip,
+                             machine.port, machine.data_ip, None))
+    write_table(["type", "machine", "user", "control_ip", "port", "data_ip",
+                 "location"], rows, args.format)
+    return 0
+
+def ls_flexbuff_command(args):
+    flexbuffs = find_flexbuffs(args.machines)
+    (store, chunks, failed) = flexbuff_inventory(flexbuffs, args)
+    if args.chunks:
+        write_table(["machine", "recording", "chunk", "bytes"],
+                    [(machine, recording, path, size) \
+                     for machine in sorted(chunks.keys()) \
+                     for recording in sorted(chunks[machine].keys()) \
+                     for (path, size) in \
+                     sorted(chunks[machine][recording].items())],
+                    args.format)
+    else:
+        rows = []
+        for row in xrange(len(store)):
+            for host in store.row_hosts(row):
+                rows.append((host,
+                             store.experiment_names[store.experiment[row]],
+                             store.station_names[store.station[row]],
+                             store.scan_name(row),
+                             store.recordings[row],
+                             store.row_host_size(row, host)))
+        write_table(["machine", "experiment", "station", "scan", "recording",
+                     "bytes"], rows, args.format)
+    return 1 if failed else 0
+
+def ls_mark5_command(args):
+    (mark5, scans, vsn, info) = mark5_selection(args)
+    if info.cached:
+        message("{b}: last known directory of {v}".format(
+            b=args.bank.upper(), v=vsn))
+    write_table(["machine", "bank", "vsn", "number", "recording", "bytes"],
+                [(mark5.control_ip, bank, vsn, number, scan, size) \
+                 for (bank, number, scan, size) in scans],
+                args.format)
+    return 0
+
+def ls_file_command(args):
+    machine = find_machine("file", args.machine)
+    write_table(["machine", "path", "type", "bytes"],
+                [(machine.control_ip, os.path.join(args.path, name),
+                  "directory" if is_directory else "file", size) \
+                 for (name, is_directory, size) in \
+                 list_directory(machine.user, machine.control_ip,
+                                args.path)],
+                args.format)
+    return 0
+
+def run_check_tasks(tasks, args):
+    settings = get_settings()
+    results = []
+    lock = threading.Lock()
+    def done(task, reply, result):
+        with lock:
+            results.append((task, reply, result))
+    run_checks(tasks, done, settings["check_max_hosts"],
+               settings["check_max_per_host"])
+    columns = ["machine", "recording", "format", "data_rate", "problems",
+               "cached"]
+    if args.replies:
+        columns.append("reply")
+    write_table(columns,
+                [(task.machine, task.recording, result.format,
+                  result.data_rate, result.problems, int(result.cached)) + \
+                 ((reply,) if args.replies else ()) \
+                 for (task, reply, result) in results],
+                args.format)
+    return 1 if any(result.problems for (_, _, result) in results) else 0
+
+def check_flexbuff_command(args):
+    return run_check_tasks(
+        [flexbuff_check(flexbuff, recording, size, chunks) \
+         for (flexbuff, recording, size, chunks) in flexbuff_selection(args)],
+        args)
+
+def check_mark5_command(args):
+    (mark5, scans, vsn, _) = mark5_selection(args)
+    return run_check_tasks(
+        [mark5_check(mark5, bank, number, scan, vsn, size) \
+         for (bank, number, scan, size) in scans],
+        args)
+
+def check_file_command(args):
+    machine = find_machine("file", args.machine)
+    sizes = file_sizes(machine, read_arguments(args.paths))
+    return run_check_tasks(
+        [file_check(machine, path, size) \
+         for (path, size) in sorted(sizes.items())],
+        args)
+
+class Batch_Runner(object):
+    """
+    Runs the m5copy commands of a batch as M5copy_Dialog does: concurrently
+    as far as the transfer limits allow, with the state of the commands in
+    the transfer journal and their progress in the telemetry
+    """
+    def __init__(self, commands, expected_sizes, title, verbose=False):
+        self.commands = commands
+        self.title = title
+        self.verbose = verbose
+        self.jobs = Batch_Jobs("m5copy", commands, expected_sizes,
+                               telemetry=True, warn=message)
+        self.events = Queue.Queue() # (index, output text or None at the end)
+        self.processes = {} # {index : Popen}
+        settings = get_settings()
+        self.scheduler = Transfer_Scheduler(
+            max_total=settings["transfer_max_total"],
+            max_per_source=settings["transfer_max_per_source"],
+            max_per_destination=settings["transfer_max_per_destination"])
+
+    def _read(self, index, process):
+        while True:
+            text = os.read(process.stdout.fileno(), 4096)
+            if not text:
+                break
+            self.events.put((index, text))
+        self.events.put((index, None))
+
+    def _start(self, index, slot):
+        command = self.commands[index]
+        process = subprocess.Popen(
+            shlex.split(with_data_port(command, slot)),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.processes[index] = process
+        self.jobs.start(index)
+        message("started {n}/{t}: {c}".format(n=index+1,
+                                              t=len(self.commands),
+                                              c=command))
+        reader = threading.Thread(target=self._read, args=(index, process))
+        reader.daemon = True
+        reader.start()
+
+    def _output(self, index, text):
+        for (_line, progress) in self.jobs.output(index, text):
+            if (progress is not None) and self.verbose:
+                (percentage, rate) = progress
+                message("{n}: {p:.1f}% {r}".format(n=index+1, p=percentage,
+                                                   r=rate or ""))
+
+    def _finish(self, index):
+        process = self.processes.pop(index)
+        success = (process.wait() == 0)
+        self.scheduler.finish(index)
+        output = self.jobs.finish(index, success)
+        message("{s} {n}/{t}: {c}".format(
+            s="finished" if success else "failed",
+            n=index+1, t=len(self.commands), c=self.commands[index]))
+        if not success:
+            message(output.text())
+            if output.log_file_name:
+                message("full output: {f}".format(f=output.log_file_name))
+
+    def interrupt(self):
+        """
+        interrupt the running commands, keep their journal state to resume
+        them later
+        """
+        self.jobs.stopping = True
+        self.scheduler.clear_pending()
+        for process in self.processes.values():
+            try:
+                os.kill(process.pid, signal.SIGINT)
+            except OSError:
+                pass
+
+    def run(self):
+        """
+        returns whether all commands succeeded
+        """
+        self.jobs.create_batch(self.title)
+        for (index, command) in enumerate(self.commands):
+            self.scheduler.add(index, command)
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            self.interrupt()
+            self._run()
+        success = all(state == "done" for state in self.jobs.states)
+        if success:
+            self.jobs.discard_batch()
+        return success
+
+    def _run(self):
+        while True:
+            if not self.jobs.stopping:
+                for (index, slot) in self.scheduler.next_jobs():
+                    try:
+                        self._start(index, slot)
+                    except Exception as e:
+                        message("failed to start '{c}': {e}".format(
+                            c=self.commands[index], e=e))
+                        self.scheduler.finish(index)
+                        self.jobs.finish(index, False)
+            if not self.processes:
+                return
+            # a timeout keeps KeyboardInterrupt deliverable
+            try:
+                (index, text) = self.events.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if text is None:
+                self._finish(index)
+            else:
+                self._output(index, text)
+
+def run_batch(commands, expected_sizes, title, args):
+    runner = Batch_Runner(commands, expected_sizes, title, args.verbose)
+    success = runner.run()
+    write_table(["number", "command", "state", "seconds"],
+                [(index + 1, command, runner.jobs.states[index],
+                  None if runner.jobs.durations[index] is None else \
+                  int(runner.jobs.durations[index])) \
+                 for (index, command) in enumerate(commands)],
+                args.format)
+    return 0 if success else 1
+
+def copy_destination(args):
+    (type_, name) = args.to
+    if type_ not in ["flexbuff", "mark5", "file"]:
+        raise Usage_Error("unknown destination type '{t}'".format(t=type_))
+    if type_ == "flexbuff":
+        flexbuffs = find_flexbuffs([name])
+        if len(flexbuffs) != 1:
+            raise Usage_Error("choose one FlexBuff as the destination")
+        return flexbuff_destination(flexbuffs[0],
+                                    "mk6" if args.mark6 else "vbs")
+    if type_ == "mark5":
+        if args.to_bank is None:
+            raise Usage_Error("give the bank to copy to (--to-bank)")
+        return mark5_destination(find_machine("mark5", name),
+                                 args.to_bank.upper())
+    if args.directory is None:
+        raise Usage_Error("give the directory to copy to (--directory)")
+    return file_destination(find_machine("file", name), args.directory)
+
+def copy_command(args):
+    destination = copy_destination(args)
+    if args.source == "flexbuff":
+        selection = flexbuff_selection(args)
+        if len(selection) > len(set(selected_recording for \
+                                    (_flexbuff, selected_recording, _size,
+                                     _chunks) in selection)):
+            raise Usage_Error("some recordings are present on multiple "
+                              "FlexBuffs, select one FlexBuff")
+        recordings = [(flexbuff_source(flexbuff,
+                                       "mk6" if args.mark6 else "vbs"),
+                       recording, size) \
+                      for (flexbuff, recording, size, _chunks) in selection]
+        from_ = ", ".join(sorted(set(flexbuff.machine for \
+                                     (flexbuff, _recording, _size, _chunks) \
+                                     in selection)))
+    elif args.source == "mark5":
+        (mark5, scans, _vsn, _info) = mark5_selection(args)
+        recordings = [(mark5_source(mark5, bank), scan, size) \
+                      for (bank, _number, scan, size) in scans]
+        from_ = mark5.control_ip
+    else:
+        machine = find_machine("file", args.machine)
+        sizes = file_sizes(machine, read_arguments(args.paths))
+        recordings = [(file_source(machine), path, size) \
+                      for (path, size) in sorted(sizes.items())]
+        from_ = machine.control_ip
+    if not recordings:
+        raise Usage_Error("nothing selected to copy")
+
+    (commands, expected_sizes) = generate_commands(
+        recordings, destination, udt=args.udt, mtu=args.mtu, rate=args.rate,
+        extra=args.options,
+        rename=None if args.rename is None else tuple(args.rename))
+    if args.dry_run:
+        for command in commands:
+            print command
+        return 0
+    return run_batch(commands, expected_sizes,
+                     "{s} -> {d}".format(s=from_, d=args.to[1]), args)
+
+def batches_command(args):
+    journal = get_journal()
+    if journal is None:
+        raise Usage_Error("the transfer journal is disabled")
+    write_table(["batch", "title", "created", "jobs", "unfinished", "owner"],
+                [(batch.id, batch.title,
+                  time.strftime("%Y-%m-%d %H:%M:%S",
+                                time.localtime(batch.created)),
+                  len(batch.jobs),
+                  len([job for job in batch.jobs if job.state != "done"]),
+                  "" if batch.orphaned else "{h}:{p}".format(
+                      h=batch.owner_host, p=batch.owner_pid)) \
+                 for batch in journal.unfinished_batches() \
+                 if batch.kind == "m5copy"],
+                args.format)
+    return 0
+
+def resume_command(args):
+    journal = get_journal()
+    if journal is None:
+        raise Usage_Error("the transfer journal is disabled")
+    batches = [batch for batch in journal.unfinished_batches() \
+               if batch.id == args.batch]
+    if not batches:
+        raise Usage_Error("no unfinished batch {b}".format(b=args.batch))
+    batch = batches[0]
+    if not (batch.orphaned or args.force):
+        raise Usage_Error("batch {b} is owned by process {p} on {h}, which "
+                          "might still be running it".format(
+                              b=batch.id, p=batch.owner_pid,
+                              h=batch.owner_host))
+    if not journal.claim_batch(batch):
+        raise Usage_Error("batch {b} was resumed by another process".format(
+            b=batch.id))
+    jobs = reconcile(journal, batch)
+    # the remaining commands run as a new batch
+    journal.discard_batch(batch.id)
+    return run_batch([job.command for job in jobs],
+                     {job.command : job.size for job in jobs \
+                      if job.size is not None},
+                     batch.title, args)
+
+# argument parsing
+
+def add_flexbuff_selection(parser):
+    parser.add_argument("recordings", nargs="*",
+                        help="recordings (or chunk paths), - to read them "
+                        "from stdin")
+    parser.add_argument("--experiment", help="select the recordings of an "
+                        "experiment")
+    parser.add_argument("--station", help="with --experiment, select the "
+                        "recordings of a station")
+
+def add_inventory_options(parser):
+    parser.add_argument("--mark6", action="store_true",
+                        help="Mark6 data format")
+    parser.add_argument("--cached", action="store_true",
+                        help="use the last known inventory from the catalog "
+                        "instead of scanning")
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Jive5ab Copy Manager, command line interface")
+    parser.add_argument("--format", choices=["tsv", "json"], default="tsv",
+                        help="output format of tables")
+    commands = parser.add_subparsers(dest="command")
+
+    hosts = commands.add_parser("hosts", help="list the configured machines")
+    hosts.add_argument("type", nargs="?",
+                       choices=["flexbuff", "mark5", "file"])
+    hosts.set_defaults(function=hosts_command)
+
+    ls = commands.add_parser("ls", help="list an inventory")
+    ls_types = ls.add_subparsers(dest="type")
+    ls_flexbuff = ls_types.add_parser("flexbuff")
+    ls_flexbuff.add_argument("machines", nargs="+",
+                             help="machine, control IP, station, 'local' or "
+                             "[user@]host[:port[:data_ip]]")
+    add_inventory_options(ls_flexbuff)
+    ls_flexbuff.add_argument("--chunks", action="store_true",
+                             help="list the file chunks of the recordings")
+    ls_flexbuff.set_defaults(function=ls_flexbuff_command)
+    ls_mark5 = ls_types.add_parser("mark5")
+    ls_mark5.add_argument("machine")
+    ls_mark5.add_argument("--bank", default="A", choices=["A", "B", "a", "b"])
+    ls_mark5.set_defaults(function=ls_mark5_command)
+    ls_file = ls_types.add_parser("file")
+    ls_file.add_argument("machine")
+    ls_file.add_argument("path")
+    ls_file.set_defaults(function=ls_file_command)
+
+    check = commands.add_parser("check", help="scan_check?/file_check? "
+                                "recordings")
+    check.add_argument("--replies", action="store_true",
+                       help="include the replies of jive5ab")
+    check_types = check.add_subparsers(dest="type")
+    check_flexbuff = check_types.add_parser("flexbuff")
+    check_flexbuff.add_argument("machines", nargs=1)
+    add_flexbuff_selection(check_flexbuff)
+    add_inventory_options(check_flexbuff)
+    check_flexbuff.set_defaults(function=check_flexbuff_command)
+    check_mark5 = check_types.add_parser("mark5")
+    check_mark5.add_argument("machine")
+    check_mark5.add_argument("scans", nargs="*",
+                             help="scan numbers or names, all if none")
+    check_mark5.add_argument("--bank", default="A",
+                             choices=["A", "B", "a", "b"])
+    check_mark5.set_defaults(function=check_mark5_command)
+    check_file = check_types.add_parser("file")
+    check_file.add_argument("machine")
+    check_file.add_argument("paths", nargs="+")
+    check_file.set_defaults(function=check_file_command)
+
+    copy = commands.add_parser("copy", help="run a batch of m5copy "
+                               "transfers")
+    copy.add_argument("--to", nargs=2, metavar=("TYPE", "MACHINE"),
+                      required=True, help="destination type (flexbuff, "
+                      "mark5 or file) and machine")
+    copy.add_argument("--to-bank", help="bank of a Mark5 destination")
+    copy.add_argument("--directory", help="directory of a file destination")
+    copy.add_argument("--udt", action="store_true", help="use UDT")
+    copy.add_argument("--rate", default="", help="UDT rate (Mbps)")
+    copy.add_argument("--mtu", default="9000", help="UDT MTU")
+    copy.add_argument("--options", default="-t 120",
+                      help="extra m5copy options")
+    copy.add_argument("--rename", nargs=2, metavar=("REGEX", "FORMAT"),
+                      help="rename the recordings, FORMAT is filled with the "
+                      "named groups of REGEX")
+    copy.add_argument("--dry-run", action="store_true",
+                      help="only print the commands")
+    copy.add_argument("-v", "--verbose", action="store_true",
+                      help="print the progress of the transfers")
+    copy_types = copy.add_subparsers(dest="source")
+    copy_flexbuff = copy_types.add_parser("flexbuff")
+    copy_flexbuff.add_argument("machines", nargs=1)
+    add_flexbuff_selection(copy_flexbuff)
+    add_inventory_options(copy_flexbuff)
+    copy_mark5 = copy_types.add_parser("mark5")
+    copy_mark5.add_argument("machine")
+    copy_mark5.add_argument("scans", nargs="*",
+                            help="scan numbers or names, all if none")
+    copy_mark5.add_argument("--bank", default="A",
+                            choices=["A", "B", "a", "b"])
+    copy_file = copy_types.add_parser("file")
+    copy_file.add_argument("machine")
+    copy_file.add_argument("paths", nargs="+")
+    copy.set_defaults(function=copy_command, mark6=False)
+
+    batches = commands.add_parser("batches", help="list the unfinished "
+                                  "m5copy batches in the transfer journal")
+    batches.set_defaults(function=batches_command)
+    resume = commands.add_parser("resume", help="continue an unfinished "
+                                 "m5copy batch")
+    resume.add_argument("batch", type=int)
+    resume.add_argument("-v", "--verbose", action="store_true",
+                        help="print the progress of the transfers")
+    resume.add_argument("--force", action="store_true",
+                        help="resume the batch even if its owner (e.g. a "
+                        "process on another host) might still be running it")
+    resume.set_defaults(function=resume_command)
+    return parser
+
+def main(argv):
+    args = create_parser().parse_args(argv)
+    try:
+        return args.function(args)
+    except Usage_Error as e:
+        message("error: {e}".format(e=e))
+        return 2
+    except Exception as e:
+        message("error: {e}".format(e=e))
+        return 1
+    finally:
+        ssh_pool.close_all()
+        control_pool.close_all()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
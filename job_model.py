@@ -0,0 +1,154 @@
+"""
+Table model of the commands of a Command_Dialog, a row per command with its
+state, bytes, data rate and duration. Changing a row only emits the change
+of that row, such that batches of thousands of commands stay responsive.
+"""
+
+from shared import format_bytes
+
+import PyQt4.QtGui as QtGui
+import PyQt4.QtCore as QtCore
+
+import time
+
+class Job(object):
+    __slots__ = ["command", "state", "size", "percentage", "rate", "started",
+                 "finished"]
+
+    def __init__(self, command):
+        self.command = command
+        self.state = "pending" # pending, running, done or failed
+        self.size = None # expected number of bytes, None if unknown
+        self.percentage = None
+        self.rate = None # as reported by the command
+        self.started = None
+        self.finished = None
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "{h}:{m:02d}:{s:02d}".format(
+        h=seconds // 3600, m=(seconds // 60) % 60, s=seconds % 60)
+
+class Job_List_Model(QtCore.QAbstractTableModel):
+    header_labels = ["Command", "State", "Bytes", "Rate", "Duration"]
+    (command_column, state_column, bytes_column, rate_column,
+     duration_column) = range(len(header_labels))
+
+    def __init__(self, parent=None):
+        super(Job_List_Model, self).__init__(parent)
+        self.jobs = []
+        self.running = set() # rows of the running jobs
+
+    def set_commands(self, commands):
+        self.beginResetModel()
+        self.jobs = [Job(command) for command in commands]
+        self.running = set()
+        self.endResetModel()
+
+    def commands(self):
+        return [job.command for job in self.jobs]
+
+    def _row_changed(self, row, first_column=0,
+                     last_column=len(header_labels) - 1):
+        self.dataChanged.emit(self.index(row, first_column),
+                              self.index(row, last_column))
+
+    def reset_states(self):
+        self.set_commands(self.commands())
+
+    def set_state(self, row, state, size=None):
+        """
+        state: pending, running, done or failed
+        size: expected number of bytes, when starting
+        """
+        job = self.jobs[row]
+        job.state = state
+        if state == "running":
+            job.size = size
+            job.started = time.time()
+            job.finished = None
+            self.running.add(row)
+        else:
+            if job.started is not None:
+                job.finished = time.time()
+            if (state == "done") and (job.started is not None):
+                job.percentage = 100.0
+            self.running.discard(row)
+        self._row_changed(row)
+
+    def set_progress(self, row, percentage, rate=None):
+        job = self.jobs[row]
+        job.percentage = percentage
+        if rate is not None:
+            job.rate = rate
+        self._row_changed(row, self.state_column, self.rate_column)
+
+    def update_durations(self):
+        """
+        to be called periodically, updates the duration of the running jobs
+        """
+        for row in self.running:
+            self._row_changed(row, self.duration_column, self.duration_column)
+
+    def _text(self, job, column):
+        if column == self.command_column:
+            return job.command
+        if column == self.state_column:
+            if (job.state == "running") and (job.percentage is not None):
+                return "running {p:.1f}%".format(p=job.percentage)
+            return job.state
+        if column == self.bytes_column:
+            if job.size is None:
+                return ""
+            if (job.percentage is None) or (job.percentage >= 100):
+                return format_bytes(job.size, 6).strip()
+            return "{d} of {t}".format(
+                d=format_bytes(int(job.size * job.percentage / 100), 6).strip(),
+                t=format_bytes(job.size, 6).strip())
+        if column == self.rate_column:
+            return job.rate or ""
+        if column == self.duration_column:
+            if job.started is None:
+                return ""
+            return format_duration((job.finished or time.time()) - job.started)
+        return ""
+
+    # QAbstractTableModel interface
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.jobs)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.header_labels)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return QtCore.QVariant()
+        job = self.jobs[index.row()]
+        if role in [QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole]:
+            return QtCore.QVariant(self._text(job, index.column()))
+        if (role == QtCore.Qt.BackgroundRole) and (job.state == "running"):
+            return QtCore.QVariant(QtGui.QBrush(
+                QtGui.QColor(QtCore.Qt.yellow).lighter(160)))
+        if (role == QtCore.Qt.ForegroundRole) and (job.state == "failed"):
+            return QtCore.QVariant(QtGui.QBrush(QtCore.Qt.red))
+        if (role == QtCore.Qt.FontRole) and (job.state == "done"):
+            font = QtGui.QFont()
+            font.setWeight(QtGui.QFont.Bold)
+            return QtCore.QVariant(font)
+        if (role == QtCore.Qt.TextAlignmentRole) and \
+           (index.column() in [self.bytes_column, self.rate_column,
+                               self.duration_column]):
+            return QtCore.QVariant(int(QtCore.Qt.AlignRight |
+                                       QtCore.Qt.AlignVCenter))
+        return QtCore.QVariant()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal) and \
+           (role == QtCore.Qt.DisplayRole) and \
+           (0 <= section < len(self.header_labels)):
+            return QtCore.QVariant(self.header_labels[section])
+        return QtCore.QVariant()
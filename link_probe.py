@@ -0,0 +1,236 @@
+"""
+Finding the fastest m5copy protocol settings for a link.
+A probe is a short m5copy of a source recording to /dev/null on the
+destination, interrupted after a few seconds, of which the data rate is
+taken from the progress output. A probe is done for TCP and for UDT at a
+few rates and MTUs. The fastest settings are remembered per host pair.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import Bunch, get_settings
+from transfer_scheduler import transfer_endpoints
+from transfer_telemetry import parse_progress, parse_rate
+from output_capture import Output_Capture
+from m5copy_commands import udt_arguments, port_option_regexp
+
+import subprocess
+import threading
+import shlex
+import signal
+import json
+import time
+import os
+import os.path
+import re
+
+# data port of the probes, out of the range used by concurrent transfers
+probe_data_port = 2699
+
+# scheme://host:port[:data ip]/...
+destination_regexp = re.compile(
+    "^(?P<scheme>[a-zA-Z0-9]+)://(?P<host>[^:/]+):(?P<port>\d+)"
+    "(:(?P<data_ip>[^/]+))?/")
+
+def probe_destination(destination):
+    """
+    returns the m5copy destination writing to /dev/null on the host of
+    destination (an m5copy destination URL), None if not understood
+    """
+    match = destination_regexp.match(destination)
+    if not match:
+        return None
+    return "file://{h}:{p}:{d}//dev/null".format(
+        h=match.group("host"), p=match.group("port"),
+        d=match.group("data_ip") or match.group("host"))
+
+def probe_options(settings=None):
+    """
+    returns [Bunch(protocol, rate, mtu)] to probe, rate in Mbps,
+    rate and mtu are None for TCP
+    """
+    if settings is None:
+        settings = get_settings()
+    options = [Bunch(protocol="tcp", rate=None, mtu=None)]
+    for mtu in settings["link_probe_mtus"]:
+        for rate in settings["link_probe_udt_rates"]:
+            options.append(Bunch(protocol="udt", rate=rate, mtu=mtu))
+    return options
+
+def option_arguments(option):
+    """
+    returns the m5copy arguments of a probe option, as M5copy_Dialog
+    generates them
+    """
+    if option.protocol != "udt":
+        return ""
+    return udt_arguments(option.mtu, option.rate)
+
+def describe(option):
+    if option.protocol != "udt":
+        return "TCP"
+    return "UDT {r} Mbps, MTU {m}".format(r=option.rate, m=option.mtu)
+
+def run_probe(command, seconds, stop=None):
+    """
+    run an m5copy command line for at most seconds,
+    returns the mean data rate in bytes/s it reported, None if none
+    """
+    process = subprocess.Popen(shlex.split(command),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = Output_Capture(max_lines=20)
+    rates = []
+    def read():
+        while True:
+            text = os.read(process.stdout.fileno(), 4096)
+            if not text:
+                break
+            for line in output.feed(text):
+                progress = parse_progress(line)
+                if progress and progress[1]:
+                    rates.append(parse_rate(progress[1]))
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+
+    end = time.time() + seconds
+    while (process.poll() is None) and (time.time() < end) and \
+          not (stop and stop.is_set()):
+        time.sleep(0.1)
+    if process.poll() is None:
+        # let m5copy stop the transfer on both ends
+        os.kill(process.pid, signal.SIGINT)
+        end = time.time() + 10
+        while (process.poll() is None) and (time.time() < end):
+            time.sleep(0.1)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    reader.join(1)
+
+    rates = [rate for rate in rates if rate is not None]
+    if len(rates) > 1:
+        # the first rate includes setting up the transfer
+        rates = rates[1:]
+    if not rates:
+        print "link probe '{c}' gave no data rate:\n{o}".format(
+            c=command, o=output.text())
+        return None
+    return sum(rates) / len(rates)
+
+def probe_link(source, destination, extra="", options=None, seconds=None,
+               progress=None, stop=None):
+    """
+    source: m5copy source URL of a recording
+    destination: m5copy destination URL of the transfers to tune
+    progress: callable(option, rate in bytes/s or None), per probe
+    returns [(option, rate)], None if the destination is not understood
+    """
+    if options is None:
+        options = probe_options()
+    if seconds is None:
+        seconds = get_settings()["link_probe_seconds"]
+    target = probe_destination(destination)
+    if target is None:
+        return None
+    # the probes use their own data port
+    extra = port_option_regexp.sub(" ", extra).strip()
+    results = []
+    for option in options:
+        if stop and stop.is_set():
+            break
+        command = "m5copy -p {p} {o}{e} {s} {d}".format(
+            p=probe_data_port, o=option_arguments(option), e=extra,
+            s=source, d=target)
+        try:
+            rate = run_probe(command, seconds, stop)
+        except Exception as e:
+            print "link probe '{c}' failed: {e}".format(c=command, e=e)
+            rate = None
+        results.append((option, rate))
+        if progress:
+            progress(option, rate)
+    return results
+
+def fastest(results):
+    """
+    returns the (option, rate) with the highest rate, None if none
+    """
+    measured = [(option, rate) for (option, rate) in results \
+                if rate is not None]
+    if not measured:
+        return None
+    return max(measured, key=lambda (option, rate): rate)
+
+def host_pair(source, destination):
+    """
+    returns the key of the link between two m5copy URLs
+    """
+    endpoints = transfer_endpoints("{s} {d}".format(s=source, d=destination))
+    if None in endpoints:
+        return None
+    return "{s} -> {d}".format(s=endpoints[0].host, d=endpoints[1].host)
+
+class Link_Tuning(object):
+    """
+    JSON file of the fastest probed settings per host pair
+    """
+    def __init__(self, file_name):
+        self.file_name = os.path.expanduser(file_name)
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.file_name, "r") as input_:
+                return json.load(input_)
+        except IOError:
+            return {}
+
+    def lookup(self, pair):
+        """
+        returns Bunch(protocol, rate, mtu, measured, time) of pair,
+        None if not probed
+        measured: bytes/s of the probe, time: of the probe
+        """
+        with self._lock:
+            entry = self._load().get(pair)
+        if entry is None:
+            return None
+        return Bunch(**dict((str(key), value) \
+                            for (key, value) in entry.items()))
+
+    def store(self, pair, option, measured):
+        with self._lock:
+            links = self._load()
+            links[pair] = {"protocol": option.protocol, "rate": option.rate,
+                           "mtu": option.mtu, "measured": measured,
+                           "time": time.time()}
+            temporary = self.file_name + ".tmp"
+            with open(temporary, "w") as output:
+                json.dump(links, output, indent=1, sort_keys=True)
+            os.rename(temporary, self.file_name)
+
+_tuning = None
+_tuning_lock = threading.Lock()
+def get_link_tuning():
+    """
+    Returns the process wide store of link tuning results,
+    or None if remembering them is disabled
+    """
+    global _tuning
+    with _tuning_lock:
+        if _tuning is None:
+            file_name = get_settings()["link_tuning"]
+            if not file_name:
+                _tuning = False
+            else:
+                try:
+                    _tuning = Link_Tuning(file_name)
+                except Exception as e:
+                    print "warning, failed to open link tuning "\
+                        "'{f}': {e}".format(f=file_name, e=e)
+                    _tuning = False
+        return _tuning or None
@@ -0,0 +1,121 @@
+"""
+Generating m5copy command lines: the source and destination URLs of the
+machine types and the commands of a batch of recordings, as used by the
+m5copy window and the command line interface.
+This module doesn't depend on Qt.
+"""
+
+import re
+
+# data port m5copy uses without -p option
+data_port = 2630
+port_option_regexp = re.compile("(^|\s)-p\s+(?P<port>\d+)")
+
+def disk_selection(flexbuff):
+    if flexbuff.machine_type == "mark6":
+        return "mk6"
+    else:
+        return flexbuff.machine_type
+
+def flexbuff_source(flexbuff, data_format="vbs"):
+    """
+    data_format: "vbs" or "mk6"
+    """
+    return "{data}://{host}:{port}/{type_}/".format(
+        data=data_format,
+        host=flexbuff.machine,
+        port=flexbuff.port,
+        type_=disk_selection(flexbuff))
+
+def flexbuff_destination(flexbuff, data_format="vbs"):
+    return "{data}://{host}:{port}:{data_ip}/{type_}/".format(
+        data=data_format,
+        host=flexbuff.control_ip,
+        port=flexbuff.port,
+        data_ip=flexbuff.data_ip,
+        type_=disk_selection(flexbuff))
+
+def mark5_source(mark5, bank):
+    return "mk5://{host}:{port}/{bank}/".format(
+        host=mark5.control_ip, port=mark5.port, bank=bank)
+
+def mark5_destination(mark5, bank):
+    return "mk5://{host}:{port}:{data_ip}/{bank}/".format(
+        host=mark5.control_ip, port=mark5.port, data_ip=mark5.data_ip,
+        bank=bank)
+
+def file_source(machine):
+    return "file://{host}:{port}/".format(
+        host=machine.control_ip, port=machine.port)
+
+def file_destination(machine, directory):
+    return "file://{host}:{port}:{data_ip}/{dirname}/".format(
+        host=machine.control_ip,
+        port=machine.port,
+        data_ip=machine.data_ip,
+        dirname=directory)
+
+def udt_arguments(mtu="", rate=""):
+    """
+    returns the m5copy options to use UDT,
+    mtu: MTU, rate: Mbps, empty or None for the m5copy default
+    """
+    udt = "-udt "
+    if mtu not in ["", None]:
+        udt += "-m {m} ".format(m=mtu)
+    if rate not in ["", None]:
+        udt += "-r {r} ".format(r=int(float(rate)*1e6))
+    return udt
+
+def generate_commands(recordings, destination, udt=False, mtu="", rate="",
+                      extra="", rename=None):
+    """
+    recordings: [(source URL, recording[, number of bytes])]
+    destination: destination URL
+    udt, mtu, rate: see udt_arguments
+    rename: (regular expression, format) to rename the recordings with,
+      the format is filled with the named groups of the expression
+    returns (commands, {command : number of bytes of the source recording})
+    """
+    commands = []
+    expected_sizes = {}
+    for recording in recordings:
+        dest = destination
+        if rename is not None:
+            (regex, format_) = rename
+            match = re.match(regex, recording[1])
+            if match:
+                try:
+                    dest = destination + \
+                        format_.format(**match.groupdict()).lower()
+                except Exception as e:
+                    print "warning, failed to rename recording:", e
+            else:
+                print "warning, recording '{r}' failed to match regular "\
+                    "expression".format(r=recording[1])
+
+        command = "m5copy {udt}{extra} {src} {dest}".format(
+            udt=udt_arguments(mtu, rate) if udt else "",
+            extra=extra,
+            src=recording[0] + recording[1],
+            dest=dest)
+        commands.append(command)
+        if len(recording) > 2:
+            expected_sizes[command] = recording[2]
+    return (commands, expected_sizes)
+
+def with_data_port(command, slot):
+    """
+    returns command using its own data port, for concurrent transfers to
+    the same destination, slot: see Transfer_Scheduler.next_jobs
+    """
+    if slot == 0:
+        return command
+    match = port_option_regexp.search(command)
+    if match:
+        return command[:match.start("port")] + \
+            str(int(match.group("port")) + slot) + \
+            command[match.end("port"):]
+    return re.sub("^(\s*m5copy)\s",
+                  "\\1 -p {p} ".format(p=data_port + slot),
+                  command, 1)
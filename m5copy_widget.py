@@ -1,79 +1,231 @@
 from command_widget import Command_Progress_Widget, Command_Dialog
+from transfer_scheduler import Transfer_Scheduler
+from import_proxy import get_settings
+from transfer_telemetry import (get_telemetry, parse_progress, read_samples,
+                                summarize, format_summary)
+from m5copy_commands import generate_commands, with_data_port
+from link_probe import (probe_link, fastest, host_pair, describe,
+                        get_link_tuning)
+from shared import Text_Edit_Dialog
 
 import PyQt4.QtGui as QtGui
+import PyQt4.QtCore as QtCore
 
-import re
+import threading
+import time
 
 class M5copy_Progress_Widget(Command_Progress_Widget):
-    progress_re = re.compile("(?P<percentage>\d+(\.\d+)?)%"
-                             "(\s+(?P<rate>\d+(\.\d+) .byte/s))?")
-    
     def __init__(self, total_commands, parent=None):
         super(M5copy_Progress_Widget, self).__init__(total_commands, parent)
         self.label_layout.addStretch(1)
-        self.data_rate_label = QtGui.QLabel(self)
-        self.label_layout.addWidget(self.data_rate_label)
-        
-        self.progress_bar = QtGui.QProgressBar(self)
-        self.layout.addWidget(self.progress_bar)
-        self.progress_bar.setRange(0, 100*100)
-
-    def set_command_index(self, index):
-        super(M5copy_Progress_Widget, self).set_command_index(index)
-        self.progress_bar.setValue(0)
-
-    def process_output(self, text):
-        super(M5copy_Progress_Widget, self).process_output(text)
-        match = self.progress_re.search(text)
-        if match:
-            groupdict = match.groupdict()
-            percentage = float(groupdict["percentage"])
-            self.progress_bar.setValue(int(percentage*100))
-            rate = groupdict.get("rate")
+        self.jobs_layout = QtGui.QVBoxLayout()
+        self.layout.addLayout(self.jobs_layout)
+        # {command index : (widget, progress bar, data rate label)}
+        self.job_widgets = {}
+
+    def command_started(self, index):
+        super(M5copy_Progress_Widget, self).command_started(index)
+        widget = QtGui.QWidget(self)
+        layout = QtGui.QHBoxLayout(widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(QtGui.QLabel("#{n}".format(n=index+1), widget))
+        progress_bar = QtGui.QProgressBar(widget)
+        progress_bar.setRange(0, 100*100)
+        progress_bar.setValue(0)
+        layout.addWidget(progress_bar, 1)
+        data_rate_label = QtGui.QLabel(widget)
+        layout.addWidget(data_rate_label)
+        self.jobs_layout.addWidget(widget)
+        self.job_widgets[index] = (widget, progress_bar, data_rate_label)
+
+    def command_finished(self, index):
+        super(M5copy_Progress_Widget, self).command_finished(index)
+        (widget, _, _) = self.job_widgets.pop(index)
+        self.jobs_layout.removeWidget(widget)
+        widget.deleteLater()
+
+    def process_output(self, index, line):
+        super(M5copy_Progress_Widget, self).process_output(index, line)
+        progress = parse_progress(line)
+        if progress and (index in self.job_widgets):
+            (_, progress_bar, data_rate_label) = self.job_widgets[index]
+            (percentage, rate) = progress
+            progress_bar.setValue(int(percentage*100))
             if rate:
-                self.data_rate_label.setText(rate)
+                data_rate_label.setText(rate)
 
 class M5copy_Dialog(Command_Dialog):
     command = "m5copy"
     progress_display_class = M5copy_Progress_Widget
+    journaled = True
+    telemetry = True
+
+    # link probe option, data rate in bytes/s or None
+    probe_done = QtCore.pyqtSignal(object, object)
+    # [(option, rate)] or None
+    probing_finished = QtCore.pyqtSignal(object)
     
+    def create_scheduler(self):
+        settings = get_settings()
+        return Transfer_Scheduler(
+            max_total=settings["transfer_max_total"],
+            max_per_source=settings["transfer_max_per_source"],
+            max_per_destination=settings["transfer_max_per_destination"])
+
+    def prepare_command(self, command, slot):
+        """
+        concurrent transfers to the same destination need their own data port
+        """
+        return with_data_port(command, slot)
+
+    def command_output(self, index, line, progress):
+        if progress is not None:
+            (percentage, rate) = progress
+            self.jobs.set_progress(index, percentage, rate)
+
+    def _show_statistics(self):
+        telemetry = get_telemetry()
+        if telemetry is None:
+            text = "Transfer telemetry is disabled (transfer_telemetry)."
+        else:
+            try:
+                text = format_summary(summarize(read_samples(
+                    telemetry.file_name)))
+            except IOError:
+                text = "No transfers recorded yet."
+        dialog = Text_Edit_Dialog(text, self)
+        dialog.setWindowTitle("Link statistics")
+        dialog.show()
+        dialog.raise_()
+
+    def _link(self):
+        """
+        returns (source URL, host pair) of the link to tune, None if there is
+        nothing to tune
+        """
+        if (not self.recordings) or (not self.destination):
+            return None
+        source = self.recordings[0][0] + self.recordings[0][1]
+        pair = host_pair(source, self.destination)
+        if pair is None:
+            return None
+        return (source, pair)
+
+    def _apply_tuning(self, protocol, rate, mtu):
+        udt = (protocol == "udt")
+        self.udt_button.setChecked(udt)
+        self.tcp_button.setChecked(not udt)
+        if udt:
+            self.rate_widget.setText("" if rate is None else str(rate))
+            self.mtu_widget.setText("" if mtu is None else str(mtu))
+        # the user applies, such that edited commands aren't replaced
+        self._protocol_changed()
+
+    def _show_remembered_tuning(self):
+        link = self._link()
+        tuning = get_link_tuning()
+        if (link is None) or (tuning is None):
+            return
+        try:
+            result = tuning.lookup(link[1])
+        except Exception as e:
+            print "warning, failed to read link tuning: {e}".format(e=e)
+            return
+        if result is None:
+            return
+        self._apply_tuning(result.protocol, result.rate, result.mtu)
+        self.tuning_label.setText("{o}: {m:.0f} MB/s ({t})".format(
+            o=describe(result), m=result.measured / 1e6,
+            t=time.strftime("%Y-%m-%d", time.localtime(result.time))))
+
+    def _tune_link(self):
+        link = self._link()
+        if link is None:
+            QtGui.QMessageBox.critical(self, "Cannot tune link",
+                                       "No source or destination to probe.")
+            return
+        if self._processes:
+            # a probe would bypass the transfer limits and measure a busy
+            # link
+            QtGui.QMessageBox.critical(self, "Cannot tune link",
+                                       "Transfers are running.")
+            return
+        self.tune_button.setEnabled(False)
+        self.tuning_label.setText("Probing...")
+        extra = str(self.extra_widget.text())
+        def probe():
+            results = None
+            try:
+                results = probe_link(
+                    link[0], self.destination, extra,
+                    progress=lambda option, rate: \
+                    self.probe_done.emit(option, rate),
+                    stop=self._probe_stop)
+            finally:
+                self.probing_finished.emit(results)
+        thread = threading.Thread(target=probe)
+        thread.daemon = True
+        thread.start()
+
+    def _show_probe(self, option, rate):
+        self.tuning_label.setText("Probing... {o}: {r}".format(
+            o=describe(option),
+            r="failed" if rate is None else \
+            "{m:.0f} MB/s".format(m=rate / 1e6)))
+
+    def _probing_finished(self, results):
+        self.tune_button.setEnabled(not self._processes)
+        best = fastest(results) if results else None
+        if best is None:
+            self.tuning_label.setText("No probe succeeded")
+            return
+        (option, rate) = best
+        self._apply_tuning(option.protocol, option.rate, option.mtu)
+        self.tuning_label.setText("{o}: {m:.0f} MB/s".format(
+            o=describe(option), m=rate / 1e6))
+        tuning = get_link_tuning()
+        if tuning is not None:
+            try:
+                tuning.store(self._link()[1], option, rate)
+            except Exception as e:
+                print "warning, failed to store link tuning: {e}".format(e=e)
+
+    def _stop_probe(self):
+        self._probe_stop.set()
+
+    def stop(self):
+        self._stop_probe()
+        super(M5copy_Dialog, self).stop()
+
+    def _run_commands(self):
+        # no probes while the batch runs
+        self.tune_button.setEnabled(False)
+        super(M5copy_Dialog, self)._run_commands()
+
+    def _handle_error(self):
+        super(M5copy_Dialog, self)._handle_error()
+        self.tune_button.setEnabled(self._link() is not None)
+
+    def _batch_finished(self):
+        super(M5copy_Dialog, self)._batch_finished()
+        self.tune_button.setEnabled(self._link() is not None)
+
     def _protocol_changed(self):
         self.udt_widget.setEnabled(
             self.protocol_buttons.checkedButton().text() == "UDT")
 
     def generate_commands(self):
-        commands = []
-        for recording in self.recordings:
-            if self.protocol_buttons.checkedButton().text() == "UDT":
-                udt = "-udt "
-                mtu = str(self.mtu_widget.text())
-                if mtu != "":
-                    udt += "-m {m} ".format(m=mtu)
-                rate = str(self.rate_widget.text())
-                if rate != "":
-                    udt += "-r {r} ".format(r=int(float(rate)*1e6))
-            else:
-                udt = ""
-
-            dest = self.destination
-            if self.do_replace.isChecked():
-                match = re.match(str(self.format_regex.text()), recording[1])
-                if match:
-                    try:
-                        dest = self.destination + \
-                        str(self.replace_format.text()).\
-                            format(**match.groupdict()).lower()
-                    except Exception as e:
-                        print "warning, failed to rename recording:", e
-                else:
-                    print "warning, recording '{r}' failed to match regular "\
-                        "expression".format(r=recording[1])
-            
-            commands.append("m5copy {udt}{extra} {src} {dest}".format(
-                udt=udt,
-                extra=str(self.extra_widget.text()),
-                src="".join(recording),
-                dest=dest))
+        rename = None
+        if self.do_replace.isChecked():
+            rename = (str(self.format_regex.text()),
+                      str(self.replace_format.text()))
+        (commands, self.expected_sizes) = generate_commands(
+            self.recordings, self.destination,
+            udt=(self.protocol_buttons.checkedButton().text() == "UDT"),
+            mtu=str(self.mtu_widget.text()),
+            rate=str(self.rate_widget.text()),
+            extra=str(self.extra_widget.text()),
+            rename=rename)
         return commands
 
     def add_config_widgets(self, master_layout):
@@ -81,10 +233,12 @@ class M5copy_Dialog(Command_Dialog):
         protocol_widget = QtGui.QGroupBox("Protocol", self)
         protocol_layout = QtGui.QVBoxLayout(protocol_widget)
         self.protocol_buttons = QtGui.QButtonGroup(protocol_widget)
-        tcp_button = QtGui.QRadioButton("TCP", protocol_widget)
+        self.tcp_button = tcp_button = \
+            QtGui.QRadioButton("TCP", protocol_widget)
         protocol_layout.addWidget(tcp_button)
         self.protocol_buttons.addButton(tcp_button)
-        udt_button = QtGui.QRadioButton("UDT", protocol_widget)
+        self.udt_button = udt_button = \
+            QtGui.QRadioButton("UDT", protocol_widget)
         protocol_layout.addWidget(udt_button)
         self.protocol_buttons.addButton(udt_button)
         network_layout.addWidget(protocol_widget)
@@ -99,6 +253,18 @@ class M5copy_Dialog(Command_Dialog):
         self.mtu_widget.setText("9000")
         udt_layout.addWidget(self.mtu_widget, 1, 1)
         network_layout.addWidget(self.udt_widget)
+        statistics_button = QtGui.QPushButton("Link statistics", self)
+        statistics_button.clicked.connect(self._show_statistics)
+        tuning_layout = QtGui.QVBoxLayout()
+        tuning_layout.addWidget(statistics_button)
+        self.tune_button = QtGui.QPushButton("Tune link", self)
+        self.tune_button.setToolTip("Probe the data rate of TCP and UDT "
+                                    "settings and choose the fastest")
+        self.tune_button.clicked.connect(self._tune_link)
+        tuning_layout.addWidget(self.tune_button)
+        self.tuning_label = QtGui.QLabel(self)
+        tuning_layout.addWidget(self.tuning_label)
+        network_layout.addLayout(tuning_layout)
 
         self.protocol_buttons.buttonClicked.connect(self._protocol_changed)
         tcp_button.setChecked(True)
@@ -140,6 +306,21 @@ class M5copy_Dialog(Command_Dialog):
                  parent=None):
         self.destination = destination
         self.options = options
+        self._probe_stop = threading.Event()
         super(M5copy_Dialog, self).__init__(recordings, parent)
         self.setWindowTitle("{s} -> {d}".format(s=from_, d=to))
+        self.probe_done.connect(self._show_probe)
+        self.probing_finished.connect(self._probing_finished)
+        self.finished.connect(lambda result: self._stop_probe())
+        self.tune_button.setEnabled(self._link() is not None)
+        self._show_remembered_tuning()
+
+    @classmethod
+    def resumed(cls, batch, parent=None):
+        """
+        returns a dialog continuing a batch from the transfer journal
+        """
+        dialog = cls([], "", "", "", None, parent)
+        dialog.resume(batch)
+        return dialog
 
@@ -1,6 +1,3 @@
-import mark5_view
-import flexbuff_view
-import file_view
 import import_proxy
 from import_proxy import Bunch, Hashable_Bunch
 
@@ -72,32 +69,9 @@ class Machine_Widget(QtGui.QWidget):
             for fm in import_proxy.get_file_machines())
 
     def _parse_host(self, host, machine_type):
-        machine = host.strip()
-        # machine: [user@]<control_ip/host>[:port[:data_ip]]
-
-        at_index = machine.find("@")
-        if at_index != -1:
-            user = machine[:at_index]
-            machine = machine[at_index+1:]
-        else:
-            user = None
-        
-        colon_index = machine.rfind(":")
-        if colon_index != -1:
-            last = machine[colon_index+1:]
-            machine = machine[:colon_index]
-            colon_index = machine.rfind(":")
-            if colon_index == -1:
-                port = int(last)
-                data_ip = machine
-            else:
-                data_ip = last
-                port = int(machine[colon_index+1:])
-                machine = machine[:colon_index]
-        else:
-            port = 2620
-            data_ip = machine
-
+        parsed = import_proxy.parse_host(host)
+        (user, machine, port, data_ip) = (parsed.user, parsed.machine,
+                                          parsed.port, parsed.data_ip)
 
         if machine_type == "Mark5":
             self.machine_types[machine_type][host] = Hashable_Bunch(
@@ -132,7 +106,13 @@ class Machine_Widget(QtGui.QWidget):
 
     def _reload_clicked(self):
         host = self.host.currentText()
-        self._host_selected(host)
+        if hasattr(self.view, "refresh") and \
+           (self.view_selection == (str(self.machine_type.currentText()), 
+                                    str(host))):
+            # only apply what changed to the view
+            self.view.refresh()
+        else:
+            self._host_selected(host)
 
     def _cleanup_references(self):
          # make a copy of the list as items might be removed
@@ -157,6 +137,8 @@ class Machine_Widget(QtGui.QWidget):
             w.copy_from.connect(self.copy_from)
             self.widget_references.append(w)
         self.view = w
+        self.view_selection = (str(self.machine_type.currentText()), 
+                               str(host))
         self.master_layout.addWidget(self.view)
             
     def _create_machine_type_widget(self, host):
@@ -175,12 +157,17 @@ class Machine_Widget(QtGui.QWidget):
             args = self.machine_types[machine_type][host]
             
         try:
+            # the views are imported when a machine type is first used, 
+            # for a fast startup
             machine = str(self.machine_type.currentText())
             if machine == "Mark5":
+                import mark5_view
                 return mark5_view.Mark5_View(args, self)
             elif machine == "FlexBuff":
+                import flexbuff_view
                 return flexbuff_view.Flexbuff_View(args, self)
             elif machine == "File":
+                import file_view
                 path = str(self.file_selection.text())
                 if len(path) == 0:
                     QtGui.QMessageBox.critical(self, "No path selected", 
@@ -236,13 +223,12 @@ class Machine_Widget(QtGui.QWidget):
     def __init__(self, parent = None):
         super(Machine_Widget, self).__init__(parent)
 
-        self._initialize_machine_types()
-
         self.master_layout = QtGui.QVBoxLayout(self)
         selection_widget = self._create_selection_widget()
         self.master_layout.addWidget(selection_widget)
 
         self.view = QtGui.QWidget(self)
+        self.view_selection = None
         self.master_layout.addWidget(self.view)
 
         # the machine widget can have thread to collect information
@@ -0,0 +1,187 @@
+"""
+Listing the scan directory of the active bank of a Mark5.
+Instead of a round trip per query, many queries are sent before the replies
+are read, the replies are matched to the queries in order.
+The directories are cached per module (VSN), in memory and in the catalog.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import (get_reader, split_reply, QueryReturnCodeError,
+                          Bunch, execute_query)
+from catalog import get_catalog
+import socket_util
+
+import logging
+import threading
+import time
+
+def pipeline_queries(socket, queries, window=64):
+    """
+    send the queries, with at most window queries waiting for a reply,
+    yields the split replies in the order of the queries
+    """
+    reader = get_reader(socket)
+    sent = 0
+    for index in xrange(len(queries)):
+        if sent - index < window // 2 and sent < len(queries):
+            # refill the window
+            send = queries[sent:index + window]
+            socket_util.retry_interrupted(lambda: socket.sendall(
+                "".join([query + ";\n\r" for query in send])))
+            sent += len(send)
+        reply = reader.read_reply()
+        logging.debug("pipelined '%s', reply '%s'" % (queries[index], reply))
+        yield split_reply(reply)
+
+def _check(query, split, acceptable_replies=["0"]):
+    if (len(split) < 2) or (split[1] not in acceptable_replies):
+        raise QueryReturnCodeError("'{q}' failed with reply '{r}'".format(
+            q=query, r=" : ".join(split)), split[1] if len(split) > 1 else None)
+    return split
+
+def supports_scandir(socket):
+    """
+    whether jive5ab supports getting the directory entry of a scan 
+    in one query
+    """
+    (split,) = list(pipeline_queries(socket, ["scandir? 1"]))
+    return (len(split) >= 6) and (split[1] == "0")
+
+def list_scans(socket, scans, progress=None, window=64, batch_size=100):
+    """
+    socket: control socket of a Mark5, with the bank to list active
+    scans: number of scans on the bank (from dir_info?)
+    Returns [(scan number, recording, number of bytes)]
+    progress: optional callable([(scan number, recording, number of bytes)]),
+    called with the scans as they arrive
+    """
+    if scans == 0:
+        return []
+    result = []
+    batch = []
+    def add(entry):
+        result.append(entry)
+        batch.append(entry)
+        if progress and (len(batch) >= batch_size):
+            progress(list(batch))
+            del batch[:]
+
+    if supports_scandir(socket):
+        # !scandir? 0 : <#scans> : <recording> : <start byte> : <length> ;
+        queries = ["scandir? {n}".format(n=number) \
+                   for number in xrange(1, scans + 1)]
+        for number, reply in enumerate(
+                pipeline_queries(socket, queries, window), 1):
+            _check("scandir? {n}".format(n=number), reply)
+            add((number, reply[3], int(reply[5])))
+    else:
+        # select each scan and query it
+        # !scan_set? 0 : <number> : <recording> : <start byte> : <end byte> ;
+        queries = []
+        for number in xrange(1, scans + 1):
+            queries += ["scan_set={n}".format(n=number), "scan_set?"]
+        replies = pipeline_queries(socket, queries, window)
+        for index, reply in enumerate(replies):
+            _check(queries[index], reply)
+            if index % 2 == 1:
+                add((int(reply[2]), reply[3], int(reply[5]) - int(reply[4])))
+    if progress and batch:
+        progress(batch)
+    return result
+
+_modules = {} # {vsn : Bunch(scans, bytes, entries, updated)}
+_modules_lock = threading.Lock()
+def get_module_directory(vsn):
+    """
+    returns the last known directory of the module with vsn,
+    Bunch(scans, bytes, entries, updated), entries as returned by list_scans,
+    None if unknown
+    """
+    with _modules_lock:
+        module = _modules.get(vsn)
+    if module is not None:
+        return module
+    catalog = get_catalog()
+    if catalog:
+        try:
+            module = catalog.load_module(vsn)
+        except Exception as e:
+            print "warning, module catalog failed: {e}".format(e=e)
+    if module is not None:
+        with _modules_lock:
+            _modules[vsn] = module
+    return module
+
+def store_module_directory(vsn, scans, bytes_, entries):
+    """
+    scans, bytes_: as reported by dir_info? for the module
+    """
+    with _modules_lock:
+        _modules[vsn] = Bunch(scans=scans, bytes=bytes_, entries=entries,
+                              updated=time.time())
+    catalog = get_catalog()
+    if catalog:
+        try:
+            catalog.store_module(vsn, scans, bytes_, entries)
+        except Exception as e:
+            print "warning, module catalog failed: {e}".format(e=e)
+
+def is_valid(module, dir_info):
+    """
+    whether the cached module directory matches dir_info? of the module
+    """
+    return (module is not None) and \
+        (module.scans == int(dir_info[2])) and \
+        (module.bytes == int(dir_info[3]))
+
+def select_bank(socket, bank):
+    """
+    make bank the active bank of the Mark5, waiting for the switch
+    """
+    reply = execute_query(socket, "bank_set?", ["0", "1"])
+    while reply[1] == "1":
+        time.sleep(0.1)
+        reply = execute_query(socket, "bank_set?", ["0", "1"])
+    if reply[2] != bank:
+        reply = execute_query(socket, "bank_set={b}".format(b=bank), 
+                              ["0", "1"])
+        while reply[1] in ["1", "6"]:
+            time.sleep(0.1)
+            reply = execute_query(socket, "bank_set?", ["0", "6"])
+    assert reply[2] == bank
+
+def read_bank(socket, bank, vsn=None, progress=None):
+    """
+    returns Bunch(scans, size, scan_count, cached) of the module in bank,
+    scans as returned by list_scans, cached: whether the directory is the
+    last known one of the module
+    the bank is only activated if the directory of the module (vsn) isn't
+    known
+    progress: optional callable(scan_count, scans), called with the scans
+    as they arrive
+    """
+    module = get_module_directory(vsn) if vsn else None
+    active = execute_query(socket, "bank_set?", ["0", "1"])[2]
+    if (active != bank) and (module is not None):
+        # the module directory is known, 
+        # no need to switch banks just to look at it
+        if progress:
+            progress(module.scans, module.entries)
+        return Bunch(scans=module.entries, size=module.bytes,
+                     scan_count=module.scans, cached=True)
+
+    select_bank(socket, bank)
+    dir_info = execute_query(socket, "dir_info?", ["0"])
+    scan_count = int(dir_info[2])
+    size = int(dir_info[3])
+    if is_valid(module, dir_info):
+        if progress:
+            progress(scan_count, module.entries)
+        scans = module.entries
+    else:
+        scans = list_scans(
+            socket, scan_count, 
+            (lambda batch: progress(scan_count, batch)) if progress else None)
+        if vsn:
+            store_module_directory(vsn, scan_count, size, scans)
+    return Bunch(scans=scans, size=size, scan_count=scan_count, cached=False)
@@ -1,19 +1,25 @@
 from abstract_machine_view import (Invalid_Selection_Exception, 
-                                   Abstract_Machine_View, Tree_Widget_Item)
+                                   Abstract_Machine_View, Target_Thread)
+from tree_model import Tree_Node
 
-from import_proxy import execute_query, send_query
+from checks import mark5_check
+from m5copy_commands import mark5_source, mark5_destination
+from control_client import Control_Client
 from shared import format_bytes
+from mark5_directory import get_module_directory, read_bank
+import control_pool
 
-import PyQt4.QtGui as QtGui
 import PyQt4.QtCore as QtCore
 
-import socket
-import contextlib
-import time
-import collections
-
 class Mark5_View(Abstract_Machine_View):
     header_labels = ["Bank", "VSN", "#scan", "Recording", "Size"]
+
+    # bank, [(scan number, recording, bytes)]
+    # emitted from the loading thread while the directory is being listed
+    bank_scans = QtCore.pyqtSignal(str, list)
+    # bank, VSN, last known directory of the module (or None)
+    # emitted from the thread looking up the module directory
+    module_directory = QtCore.pyqtSignal(str, str, object)
     
     def _get_selection(self):
         indices = self.view.selectedIndexes()
@@ -24,164 +30,221 @@ class Mark5_View(Abstract_Machine_View):
             if not index.parent().isValid():
                 raise Invalid_Selection_Exception("Can only operate on "
                     "recordings, not banks.")
-            bank = str(self.view.itemFromIndex(index.parent()).text(
-                self.header_labels.index("Bank")))
+            bank = self.model.node(index.parent()).key
             assert bank in ["A", "B"]
-            scan = str(self.view.itemFromIndex(index).text(
-                self.header_labels.index("Recording")))
-            number = int(str(self.view.itemFromIndex(index).text(
-                self.header_labels.index("#scan"))))
-            row_bank_scan[(bank,index.row())] = (number, scan)
+            # scan nodes have key (number, recording), the loading item None
+            key = self.model.node(index).key
+            if key is not None:
+                row_bank_scan[(bank,index.row())] = key
         return [(bank, row_bank_scan[(bank, row)]) \
                 for (bank, row) in sorted(row_bank_scan.keys())]
 
-    def _check_selection(self, selection):
-        text = ""
-        with contextlib.closing(self._create_socket()) as s:
-            for (bank, (number, scan)) in selection:
-                self._select_bank(s, bank)
-                execute_query(s, "scan_set={scan}".format(scan=number), ["0"])
-                reply = send_query(s, "scan_check?")
-                text += reply
-        return text
+    def _check_tasks(self, selection):
+        return [mark5_check(self.mark5, bank, number, scan,
+                            self.bank_vsn.get(bank),
+                            self.recording_sizes[bank].get(number)) \
+                for (bank, (number, scan)) in selection]
 
     def _emit_copy(self, selection):
         self.copy_from.emit(
             self.mark5.control_ip, 
-            [("mk5://{host}:{port}/{bank}/".format(
-                host=self.mark5.control_ip, port=self.mark5.port, bank=bank), 
-              str(number) if scan in self.duplicate_recording[bank] else scan) 
+            [(mark5_source(self.mark5, bank),
+              str(number) if scan in self.duplicate_recording[bank] else scan,
+              self.recording_sizes[bank][number])
              for (bank, (number, scan)) in selection])
 
 
     def _get_m5copy_to(self):
         indices = self.view.selectedIndexes()
-        items = list(set(self.view.itemFromIndex(index) for index in indices))
-        if (len(items) != 1) or \
-           (items[0].childIndicatorPolicy() != \
-           Tree_Widget_Item.ShowIndicator):
+        nodes = list(set(self.model.node(index) for index in indices))
+        if (len(nodes) != 1) or (not nodes[0].expandable):
             raise Invalid_Selection_Exception("Only one bank has to be "
                 "selected as the target bank to copy to.")
 
-        return (self.mark5.control_ip, "mk5://{host}:{port}:{data_ip}/{bank}/".\
-                format(
-                    host=self.mark5.control_ip, 
-                    port=self.mark5.port,
-                    data_ip=self.mark5.data_ip,
-                    bank=str(items[0].text(self.header_labels.index("Bank")))))
-
-    def _selection_size(self, selection):
-        return sum([self.recording_sizes[bank][number] \
-                    for (bank, (number, scan)) in selection])
+        return (self.mark5.control_ip,
+                mark5_destination(self.mark5, nodes[0].key))
+
+    def _row_totals(self, index):
+        if not index.parent().isValid():
+            raise Invalid_Selection_Exception("Can only operate on "
+                "recordings, not banks.")
+        bank = self.model.node(index.parent()).key
+        key = self.model.node(index).key
+        if key is None:
+            # loading item
+            return (None, 0, 0)
+        (number, _) = key
+        # all banks can be selected together
+        return (None, 1, self.recording_sizes[bank][number])
 
     def _create_view_widget(self):
-        self.view = QtGui.QTreeWidget(self)
-        self.banks = {bank : Tree_Widget_Item(self.view) \
+        self.view = self._create_tree_view(self)
+        self.banks = {bank : Tree_Node(
+                          {self.header_labels.index("Bank"): bank}, key=bank,
+                          expandable=False)
                       for bank in ["A", "B"]}
         self.recording_sizes = {bank : {} for bank in self.banks.keys()}
+        self.bank_vsn = {} # {bank : VSN of the module in the bank}
         self.duplicate_recording = {bank: set() for bank in self.banks.keys()}
-        for bank, item in self.banks.items():
-            item.setText(self.header_labels.index("Bank"), bank)
-
-        with contextlib.closing(self._create_socket()) as s:
-            reply = execute_query(s, "bank_set?", ["0"])
-            for index in [3,5]:
-                if len(reply) > index:
-                    bank = reply[index-1]
-                    if bank in self.banks.keys():
-                        vsn = reply[index]
-                        bank_item = self.banks[bank]
-                        bank_item.setText(self.header_labels.index("VSN"), vsn)
-                        bank_item.setChildIndicatorPolicy(
-                            Tree_Widget_Item.ShowIndicator)
-                        if index == 3: # active bank
-                            dir_info = execute_query(s, "dir_info?", ["0"])
-                            bank_item.setText(self.header_labels.index("#scan"),
-                                              dir_info[2])
-                            bank_item.setText(self.header_labels.index("Size"),
-                                              format_bytes(
-                                                  int(dir_info[3]),
-                                                  self.bytes_print_size))
-                        else:
-                            # don't want to activate the bank just yet
-                            bank_item.setText(self.header_labels.index("#scan"),
-                                              "?")
-                            bank_item.setText(self.header_labels.index("Size"),
-                                              "?")
+        # {bank : recordings listed so far}
+        self.bank_recordings = {bank: set() for bank in self.banks.keys()}
+        for bank in sorted(self.banks.keys()):
+            self.model.append_child(self.model.root, self.banks[bank])
+
+        # ask for the modules without waiting for the replies, the banks
+        # become expandable once their module is known
+        self.control = Control_Client(self.mark5.control_ip, self.mark5.port,
+                                      parent=self)
+        self.control.query("bank_set?", self._show_banks, self._control_failed,
+                           ["0"])
         return self.view
 
-    def _create_socket(self, timeout=10):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(timeout)
-        s.connect((self.mark5.control_ip, self.mark5.port))
-        return s
-
-    def _select_bank(self, socket, bank):
-        reply = execute_query(socket, "bank_set?", ["0", "1"])
-        while reply[1] == "1":
-            time.sleep(0.1)
-            reply = execute_query(socket, "bank_set?", ["0", "1"])
-        if reply[2] != bank:
-            reply = execute_query(socket, "bank_set={b}".format(b=bank), 
-                                  ["0", "1"])
-            while reply[1] in ["1", "6"]:
-                time.sleep(0.1)
-                reply = execute_query(socket, "bank_set?", ["0", "6"])
-        assert reply[2] == bank
+    def _show_banks(self, reply):
+        for index in [3,5]:
+            if len(reply) > index:
+                bank = reply[index-1]
+                if bank in self.banks.keys():
+                    vsn = reply[index]
+                    self.bank_vsn[bank] = vsn
+                    bank_item = self.banks[bank]
+                    self.model.set_text(
+                        bank_item, self.header_labels.index("VSN"), vsn)
+                    self.model.set_expandable(bank_item, True)
+                    if index == 3: # active bank
+                        self.control.query(
+                            "dir_info?", 
+                            lambda dir_info, bank_item=bank_item: \
+                            self._show_dir_info(bank_item, dir_info),
+                            self._control_failed, ["0"])
+                    else:
+                        # don't want to activate the bank just yet,
+                        # show what is known of the module
+                        self._lookup_module(bank, vsn)
+
+    def _lookup_module(self, bank, vsn):
+        # the directory might have to come from the catalog, 
+        # don't wait for that in the GUI thread
+        thread = Target_Thread(
+            lambda: self.module_directory.emit(bank, vsn,
+                                               get_module_directory(vsn)),
+            self)
+        self.lookup_threads.append(thread)
+        thread.start()
+
+    def _show_module(self, bank, vsn, module):
+        bank = str(bank)
+        bank_item = self.banks[bank]
+        if (self.bank_vsn.get(bank) != str(vsn)) or \
+           (bank_item in self.background_data) or \
+           (bank_item.child_count() > 0):
+            # the bank is already being listed
+            return
+        self.model.set_text(
+            bank_item, self.header_labels.index("#scan"),
+            "?" if module is None else str(module.scans))
+        self.model.set_text(
+            bank_item, self.header_labels.index("Size"),
+            "?" if module is None else format_bytes(
+                module.bytes, self.bytes_print_size))
+
+    def _show_dir_info(self, bank_item, dir_info):
+        if bank_item.child_count() > 0:
+            # already listed in the background
+            return
+        self.model.set_text(bank_item, self.header_labels.index("#scan"),
+                            dir_info[2])
+        self.model.set_text(bank_item, self.header_labels.index("Size"),
+                            format_bytes(int(dir_info[3]),
+                                         self.bytes_print_size))
+
+    def _control_failed(self, error):
+        print "{m}: {e}".format(m=self.mark5.control_ip, e=error)
+        for bank_item in self.banks.values():
+            if not bank_item.text(self.header_labels.index("VSN")):
+                self.model.set_text(bank_item, 
+                                    self.header_labels.index("VSN"), 
+                                    "unreachable")
+
+    def _connection(self, timeout=10):
+        return control_pool.connection(self.mark5.control_ip, self.mark5.port,
+                                       timeout)
+
+    def _scan_node(self, number, recording, size):
+        return Tree_Node(
+            {self.header_labels.index("#scan"): str(number),
+             self.header_labels.index("Recording"): recording,
+             self.header_labels.index("Size"): 
+             format_bytes(size, self.bytes_print_size)},
+            key=(number, recording),
+            expandable=False)
+
+    def _add_bank_scans(self, bank, scans):
+        bank = str(bank)
+        bank_item = self.banks[bank]
+        # the sizes are only touched in the GUI thread, before the scans
+        # can be selected
+        seen = self.bank_recordings[bank]
+        for (number, recording, bytes_) in scans:
+            self.recording_sizes[bank][number] = bytes_
+            if recording in seen:
+                self.duplicate_recording[bank].add(recording)
+            else:
+                seen.add(recording)
+        self.model.append_children(
+            bank_item, [self._scan_node(number, recording, size) \
+                        for (number, recording, size) in scans])
+        self.model.set_text(bank_item, self.header_labels.index("#scan"), 
+                            "{n}/{t}".format(n=len(bank_item.children),
+                                             t=self.bank_scan_count[bank]))
 
     def _display_bank_info(self, root):
         data = self.background_data[root]
-        root.setText(self.header_labels.index("#scan"), str(len(data.scans)))
-        root.setText(self.header_labels.index("Size"), 
-                     format_bytes(data.size, self.bytes_print_size))
-        for index, (recording, size) in enumerate(data.scans):
-            item = Tree_Widget_Item(root)
-            item.setText(self.header_labels.index("#scan"), str(index+1))
-            item.setText(self.header_labels.index("Recording"), recording)
-            item.setText(self.header_labels.index("Size"), 
-                         format_bytes(size, self.bytes_print_size))
+        self.model.set_text(root, self.header_labels.index("#scan"), 
+                            str(len(data.scans)) + \
+                            (" (cached)" if data.cached else ""))
+        self.model.set_text(root, self.header_labels.index("Size"), 
+                            format_bytes(data.size, self.bytes_print_size))
 
     def _get_bank_info(self, bank, root):
         data = self.background_data[root]
-        with contextlib.closing(self._create_socket()) as s:
-            self._select_bank(s, bank)
-
-            dir_info = execute_query(s, "dir_info?", ["0"])
-            # refresh display data
-            scans = int(dir_info[2])
-            data.size = int(dir_info[3])
-
-            data.scans = []
-            seen = set()
-            for scan_index in xrange(scans):
-                execute_query(s, "scan_set={i}".format(i=scan_index+1), 
-                              ["0"])
-                reply = execute_query(s, "scan_set?", ["0"])
-                number = int(reply[2])
-                recording = reply[3]
-                bytes_ = int(reply[5]) - int(reply[4])
-                self.recording_sizes[bank][number] = bytes_
-                data.scans.append((recording, bytes_))
-                if recording in seen:
-                    self.duplicate_recording[bank].add(recording)
-                else:
-                    seen.add(recording)
+        def progress(scan_count, scans):
+            self.bank_scan_count[bank] = scan_count
+            self.bank_scans.emit(bank, scans)
+        with self._connection() as s:
+            # the scans are added to the tree as they arrive
+            info = read_bank(s, bank, self.bank_vsn.get(bank), progress)
+            data.scans = info.scans
+            data.size = info.size
+            data.cached = info.cached
 
     def _expand_disk(self, index):
-        bank = str(self.view.itemFromIndex(index).text(
-            self.header_labels.index("Bank")))
+        bank = self.model.node(index).key
         bank_item = self.banks.get(bank)
-        if bank_item and (bank_item.childCount() == 0):
+        if bank_item and (bank_item.child_count() == 0):
             self.recording_sizes[bank] = {}
+            self.duplicate_recording[bank] = set()
+            self.bank_recordings[bank] = set()
             self.load_in_background(bank_item,
                 lambda: self._get_bank_info(bank, bank_item),
-                lambda: self._display_bank_info(bank_item))
+                lambda: self._display_bank_info(bank_item),
+                show_loading=False)
+            self.model.set_text(bank_item, self.header_labels.index("#scan"),
+                                "loading")
+
+    def await_threads(self):
+        super(Mark5_View, self).await_threads()
+        for thread in self.lookup_threads:
+            thread.wait()
 
     def __init__(self, mark5, parent=None):
         self.mark5 = mark5
+        self.lookup_threads = []
 
         super(Mark5_View, self).__init__(parent)
         
         self.view.expanded.connect(self._expand_disk)
+        self.bank_scans.connect(self._add_bank_scans)
+        self.module_directory.connect(self._show_module)
+        self.bank_scan_count = {} # {bank : number of scans being listed}
 
 
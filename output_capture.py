@@ -0,0 +1,93 @@
+"""
+Bounded capture of the output of long running commands.
+Only the last lines of the output are kept in memory, the full output can
+be written to a log file. The output stream is split in lines, progress
+lines ending in a carriage return count as separate lines.
+This module doesn't depend on Qt.
+"""
+
+import collections
+import tempfile
+import os
+import os.path
+import re
+
+line_end_regexp = re.compile("\r\n|\r|\n")
+
+class Output_Capture(object):
+    def __init__(self, max_lines=1000, log_directory=None, log_prefix=""):
+        """
+        max_lines: number of lines to keep in memory
+        log_directory: directory to write the full output to, a file per
+          capture, None for no log file
+        """
+        self.lines = collections.deque(maxlen=max_lines)
+        self.line_count = 0
+        self.partial = ""
+        self.log_file_name = None
+        self._log = None
+        if log_directory:
+            directory = os.path.expanduser(log_directory)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            (handle, self.log_file_name) = tempfile.mkstemp(
+                suffix=".log", prefix=log_prefix, dir=directory)
+            self._log = os.fdopen(handle, "wb")
+
+    def _add(self, line):
+        self.lines.append(line)
+        self.line_count += 1
+
+    def feed(self, text):
+        """
+        returns the lines completed by text, without line ends
+        """
+        if self._log is not None:
+            self._log.write(text)
+            self._log.flush()
+        data = self.partial + text
+        # a "\r\n" might be split over two reads
+        hold = ""
+        if data.endswith("\r"):
+            (data, hold) = (data[:-1], "\r")
+        lines = line_end_regexp.split(data)
+        self.partial = lines.pop() + hold
+        for line in lines:
+            self._add(line)
+        return lines
+
+    def close(self, keep_log=True):
+        """
+        end of the output, keep_log: False to remove the log file
+        returns the last line if it wasn't terminated, else None
+        """
+        line = None
+        if self.partial.rstrip("\r"):
+            line = self.partial.rstrip("\r")
+            self._add(line)
+        self.partial = ""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+            if not keep_log:
+                try:
+                    os.remove(self.log_file_name)
+                except OSError:
+                    pass
+                self.log_file_name = None
+        return line
+
+    def text(self):
+        """
+        returns the kept lines, with a note on the dropped lines if any
+        """
+        lines = list(self.lines)
+        if self.partial.rstrip("\r"):
+            lines.append(self.partial.rstrip("\r"))
+        dropped = self.line_count - len(self.lines)
+        if dropped > 0:
+            note = "({n} earlier lines not shown".format(n=dropped)
+            if self.log_file_name:
+                note += ", full output in {f}".format(f=self.log_file_name)
+            lines.insert(0, note + ")")
+        return "\n".join(lines)
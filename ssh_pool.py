@@ -0,0 +1,150 @@
+"""
+Shared ssh connections for all remote commands.
+OpenSSH connection multiplexing (ControlMaster/ControlPersist) is used,
+such that only the first command to a host pays for the connection set up,
+the master connection closes itself after being idle for a while.
+"""
+
+import import_proxy
+
+import subprocess
+import threading
+import contextlib
+import tempfile
+import shutil
+import atexit
+import os
+import os.path
+
+class SSH_Connection_Manager(object):
+    def __init__(self, idle_timeout=300, max_channels=8, multiplexing=True):
+        """
+        idle_timeout: seconds before an unused master connection closes
+        max_channels: maximum number of concurrent commands per host,
+          should not exceed MaxSessions of the ssh servers
+        multiplexing: if False, every command uses its own connection
+        """
+        self.idle_timeout = idle_timeout
+        self.max_channels = max_channels
+        self.multiplexing = multiplexing
+        self._lock = threading.Lock()
+        self._channels = {} # {destination : Semaphore}
+        self._masters = {} # {destination : (Lock, control path)}
+        self._control_directory = None
+
+    @staticmethod
+    def destination(user, host):
+        return host if user is None else "@".join([user, host])
+
+    def _master(self, destination):
+        with self._lock:
+            if self._control_directory is None:
+                # keep it short, unix socket paths are limited in length
+                self._control_directory = tempfile.mkdtemp(prefix="jcm_ssh_")
+            if destination not in self._masters:
+                self._masters[destination] = (
+                    threading.Lock(),
+                    os.path.join(self._control_directory,
+                                 str(len(self._masters))))
+            return self._masters[destination]
+
+    def _ensure_master(self, destination):
+        """
+        returns the control path of the (running) master connection
+        """
+        (lock, control_path) = self._master(destination)
+        with lock:
+            if not os.path.exists(control_path):
+                # the master is started by a separate, trivial, command with
+                # all output to /dev/null, because the backgrounded master
+                # keeps the stderr of the command that started it open,
+                # which would block anyone reading that until the master exits
+                with open(os.devnull, "r+") as devnull:
+                    subprocess.call(
+                        ["ssh", "-o", "PasswordAuthentication=no",
+                         "-o", "ControlMaster=auto",
+                         "-o", "ControlPath={p}".format(p=control_path),
+                         "-o", "ControlPersist={t}".format(
+                             t=self.idle_timeout),
+                         destination, "true"],
+                        stdin=devnull, stdout=devnull, stderr=devnull)
+        return control_path
+
+    def args(self, user, host, command):
+        """
+        returns the argument list to execute 'command' (a string,
+        interpreted by the login shell of 'user') on 'host'
+        """
+        destination = self.destination(user, host)
+        options = ["-o", "PasswordAuthentication=no"]
+        if self.multiplexing:
+            # if the master connection is gone, ssh falls back to
+            # a connection of its own
+            options += ["-o", "ControlMaster=no",
+                        "-o", "ControlPath={p}".format(
+                            p=self._ensure_master(destination))]
+        return ["ssh"] + options + [destination, command]
+
+    @contextlib.contextmanager
+    def channel(self, user, host):
+        """
+        reserves one of the concurrent channels to the host for the duration
+        of the context, blocks until one is available
+        """
+        destination = self.destination(user, host)
+        with self._lock:
+            semaphore = self._channels.get(destination)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self.max_channels)
+                self._channels[destination] = semaphore
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def close_all(self):
+        """
+        stop all master connections
+        """
+        with self._lock:
+            masters = self._masters.items()
+            self._masters = {}
+            control_directory = self._control_directory
+            self._control_directory = None
+        with open(os.devnull, "w") as devnull:
+            for destination, (_, control_path) in masters:
+                if os.path.exists(control_path):
+                    subprocess.call(
+                        ["ssh", "-o", "ControlPath={p}".format(p=control_path),
+                         "-O", "exit", destination],
+                        stdout=devnull, stderr=devnull)
+        if control_directory is not None:
+            shutil.rmtree(control_directory, ignore_errors=True)
+
+_manager = None
+_manager_lock = threading.Lock()
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            settings = import_proxy.get_settings()
+            _manager = SSH_Connection_Manager(
+                idle_timeout=settings["ssh_idle_timeout"],
+                max_channels=settings["ssh_max_channels"],
+                multiplexing=settings["ssh_multiplexing"])
+            # in case the application doesn't close the connections itself
+            atexit.register(_manager.close_all)
+        return _manager
+
+def ssh_args(user, host, command):
+    return get_manager().args(user, host, command)
+
+def channel(user, host):
+    return get_manager().channel(user, host)
+
+def close_all():
+    with _manager_lock:
+        manager = _manager
+    if manager is not None:
+        manager.close_all()
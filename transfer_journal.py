@@ -0,0 +1,245 @@
+"""
+On-disk journal of transfer batches, such that a batch survives the program
+closing or crashing. Every command of a batch is a job with a state:
+pending, running, done or failed. Jobs that were running when the program
+stopped are reconciled on restart by comparing the size of the destination
+recording with the size of the source, only unfinished jobs are resumed.
+Every batch records its owner (host and process id), only batches of which
+the owner stopped are offered to resume.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import Bunch, execute_query, get_settings
+import control_pool
+
+import sqlite3
+import contextlib
+import threading
+import shlex
+import time
+import os
+import os.path
+import re
+import errno
+import socket
+
+states = ["pending", "running", "done", "failed"]
+
+class Transfer_Journal(object):
+    schema = [
+        "CREATE TABLE IF NOT EXISTS batch ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " kind TEXT NOT NULL,"
+        " title TEXT NOT NULL,"
+        " created REAL NOT NULL,"
+        " owner_host TEXT,"
+        " owner_pid INTEGER)",
+        "CREATE TABLE IF NOT EXISTS job ("
+        " batch INTEGER NOT NULL,"
+        " number INTEGER NOT NULL,"
+        " command TEXT NOT NULL,"
+        " size INTEGER,"
+        " state TEXT NOT NULL,"
+        " updated REAL NOT NULL,"
+        " PRIMARY KEY (batch, number))",
+    ]
+    # columns added to the tables of existing journals
+    # {table : [(column, definition)]}
+    added_columns = {
+        "batch": [("owner_host", "TEXT"), ("owner_pid", "INTEGER")],
+    }
+
+    def __init__(self, file_name):
+        self.file_name = os.path.expanduser(file_name)
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            for statement in self.schema:
+                connection.execute(statement)
+            for (table, columns) in self.added_columns.items():
+                existing = set(row[1] for row in connection.execute(
+                    "PRAGMA table_info({t})".format(t=table)))
+                for (column, definition) in columns:
+                    if column not in existing:
+                        connection.execute(
+                            "ALTER TABLE {t} ADD COLUMN {c} {d}".format(
+                                t=table, c=column, d=definition))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        sqlite connections cannot be shared between threads,
+        so use a short lived connection per transaction
+        """
+        connection = sqlite3.connect(self.file_name, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create_batch(self, kind, title, jobs):
+        """
+        kind: the command of the batch, e.g. "m5copy"
+        jobs = [(number, command, expected destination bytes or None)]
+        returns the id of the new batch, all jobs are pending,
+        owned by this process
+        """
+        now = time.time()
+        with self._connect() as connection:
+            batch = connection.execute(
+                "INSERT INTO batch (kind, title, created, owner_host, "
+                "owner_pid) VALUES (?,?,?,?,?)",
+                (kind, title, now, socket.gethostname(),
+                 os.getpid())).lastrowid
+            connection.executemany(
+                "INSERT INTO job VALUES (?,?,?,?,?,?)",
+                [(batch, number, command, size, "pending", now) \
+                 for (number, command, size) in jobs])
+        return batch
+
+    def set_state(self, batch, number, state):
+        assert state in states
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE job SET state=?, updated=? WHERE batch=? AND number=?",
+                (state, time.time(), batch, number))
+
+    def claim_batch(self, batch):
+        """
+        take over batch (as returned by unfinished_batches) to resume it,
+        returns False if another process claimed it first
+        """
+        with self._connect() as connection:
+            return connection.execute(
+                "UPDATE batch SET owner_host=?, owner_pid=? "
+                "WHERE id=? AND owner_host IS ? AND owner_pid IS ?",
+                (socket.gethostname(), os.getpid(), batch.id,
+                 batch.owner_host, batch.owner_pid)).rowcount == 1
+
+    def discard_batch(self, batch):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM job WHERE batch=?", (batch,))
+            connection.execute("DELETE FROM batch WHERE id=?", (batch,))
+
+    def unfinished_batches(self):
+        """
+        returns [Bunch(id, kind, title, created, owner_host, owner_pid,
+        orphaned, jobs)] of the batches with jobs that are not done,
+        orphaned: whether the owner of the batch stopped (see owner_alive),
+        jobs = [Bunch(number, command, size, state)]
+        """
+        batches = []
+        with self._connect() as connection:
+            for (id_, kind, title, created, owner_host, owner_pid) in \
+                    connection.execute(
+                        "SELECT id, kind, title, created, owner_host, "
+                        "owner_pid FROM batch WHERE id IN "
+                        "(SELECT batch FROM job WHERE state!='done') "
+                        "ORDER BY id").fetchall():
+                jobs = [Bunch(number=number, command=str(command), size=size,
+                              state=str(state)) \
+                        for (number, command, size, state) in \
+                        connection.execute(
+                            "SELECT number, command, size, state FROM job "
+                            "WHERE batch=? ORDER BY number", (id_,))]
+                batches.append(Bunch(
+                    id=id_, kind=str(kind), title=title, created=created,
+                    owner_host=owner_host, owner_pid=owner_pid,
+                    orphaned=not owner_alive(owner_host, owner_pid),
+                    jobs=jobs))
+        return batches
+
+def owner_alive(host, pid):
+    """
+    whether the process that owns a batch might still be running,
+    a process on another host cannot be checked, it counts as running
+    batches of journals from before owners were recorded have no owner
+    """
+    if (host is None) or (pid is None):
+        return False
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: the process runs as another user
+        return e.errno != errno.ESRCH
+    return True
+
+# scheme://host:port[:data ip]/path
+destination_regexp = re.compile(
+    "^(?P<scheme>[a-zA-Z0-9]+)://(?P<host>[^:/]+):(?P<port>\d+)[^/]*"
+    "(?P<path>/.*)$")
+
+# destination types of which the recording size can be asked from jive5ab
+sized_schemes = ["vbs", "mk6"]
+
+def destination_size(command):
+    """
+    returns the number of bytes of the destination recording of an m5copy
+    command line, None if it cannot be determined
+    """
+    try:
+        urls = [argument for argument in shlex.split(command) \
+                if "://" in argument]
+    except ValueError:
+        return None
+    if len(urls) < 2:
+        return None
+    match = destination_regexp.match(urls[-1])
+    if (not match) or (match.group("scheme").lower() not in sized_schemes):
+        return None
+    path = match.group("path")
+    # without a name, the destination has the name of the source recording
+    name = path.split("/")[-1] or urls[0].split("/")[-1]
+    if not name:
+        return None
+    try:
+        with control_pool.connection(match.group("host"),
+                                     int(match.group("port"))) as s:
+            execute_query(s, "scan_set={n}".format(n=name), ["0"])
+            # !scan_set? 0 : <recording> : <start byte> : <end byte> ;
+            reply = execute_query(s, "scan_set?", ["0"])
+            return int(reply[-1]) - int(reply[-2])
+    except Exception as e:
+        print "failed to get the size of '{n}': {e}".format(n=name, e=e)
+        return None
+
+def reconcile(journal, batch, measure=destination_size):
+    """
+    decide on the jobs of batch that were running when the program stopped:
+    done if the destination has the expected size, pending otherwise
+    returns the jobs that are not done
+    """
+    for job in batch.jobs:
+        if job.state != "running":
+            continue
+        size = None if job.size is None else measure(job.command)
+        job.state = "done" if (size is not None) and (size == job.size) \
+                    else "pending"
+        journal.set_state(batch.id, job.number, job.state)
+    return [job for job in batch.jobs if job.state != "done"]
+
+_journal = None
+_journal_lock = threading.Lock()
+def get_journal():
+    """
+    Returns the process wide transfer journal,
+    or None if the journal is disabled or cannot be opened
+    """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            file_name = get_settings()["transfer_journal"]
+            if not file_name:
+                _journal = False
+            else:
+                try:
+                    _journal = Transfer_Journal(file_name)
+                except Exception as e:
+                    print "warning, failed to open transfer journal "\
+                        "'{f}': {e}".format(f=file_name, e=e)
+                    _journal = False
+        return _journal or None
@@ -0,0 +1,120 @@
+"""
+Deciding which commands of a batch of transfers may run at the same time.
+The source and destination of an m5copy command are taken from its URLs,
+transfers are limited in total, per source host and per destination host.
+A Mark5 can only do one transfer at a time, whether it is the source or the
+destination. Commands without URLs (e.g. vbs_rename) are only limited in
+total.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import Hashable_Bunch
+
+import collections
+import shlex
+import re
+
+url_regexp = re.compile("^(?P<scheme>[a-zA-Z0-9]+)://(?P<host>[^:/]*)")
+
+# URL schemes of which a host can only do one transfer at a time
+exclusive_schemes = ["mk5"]
+
+def _endpoint(argument):
+    match = url_regexp.match(argument)
+    if not match:
+        return None
+    return Hashable_Bunch(scheme=match.group("scheme").lower(),
+                          host=match.group("host"))
+
+def transfer_endpoints(command):
+    """
+    returns (source, destination) of an m5copy style command line,
+    as Hashable_Bunch(scheme, host), None if not found
+    """
+    try:
+        arguments = shlex.split(command)
+    except ValueError:
+        return (None, None)
+    endpoints = [endpoint for endpoint in map(_endpoint, arguments) \
+                 if endpoint is not None]
+    if len(endpoints) < 2:
+        return (None, None)
+    return (endpoints[0], endpoints[-1])
+
+class Transfer_Scheduler(object):
+    def __init__(self, max_total=1, max_per_source=None,
+                 max_per_destination=None):
+        """
+        max_*: maximum number of commands running at the same time,
+          None for no limit
+        """
+        self.max_total = max_total
+        self.max_per_source = max_per_source
+        self.max_per_destination = max_per_destination
+        self.pending = [] # [(key, limits, destination)] in order of adding
+        self.running = {} # {key : (limits, destination, slot)}
+        self.counts = collections.defaultdict(int) # {limit key : running}
+        # {destination host : set of slots in use}
+        self.slots = collections.defaultdict(set)
+
+    def _limits(self, source, destination):
+        """
+        returns [(counter key, limit)] a command is subject to
+        """
+        limits = [(("total",), self.max_total)]
+        if source is not None:
+            limits.append((("source", source.host), self.max_per_source))
+        if destination is not None:
+            limits.append((("destination", destination.host),
+                           self.max_per_destination))
+        for endpoint in set([source, destination]):
+            if (endpoint is not None) and \
+               (endpoint.scheme in exclusive_schemes):
+                limits.append((("exclusive", endpoint.host), 1))
+        return [(key, limit) for (key, limit) in limits if limit is not None]
+
+    def add(self, key, command):
+        """
+        queue a command, key identifies it in the results of next_jobs
+        """
+        (source, destination) = transfer_endpoints(command)
+        self.pending.append((key, self._limits(source, destination),
+                             None if destination is None \
+                             else destination.host))
+
+    def next_jobs(self):
+        """
+        returns [(key, slot)] of the queued commands that can start now,
+        in order of adding, these are considered running until finish(key)
+        slot: lowest number not in use by another running command to the
+          same destination, e.g. to choose a data port
+        """
+        started = []
+        still_pending = []
+        for (key, limits, destination) in self.pending:
+            if any(self.counts[limit_key] >= limit \
+                   for (limit_key, limit) in limits):
+                still_pending.append((key, limits, destination))
+                continue
+            for (limit_key, _) in limits:
+                self.counts[limit_key] += 1
+            slot = 0
+            if destination is not None:
+                used = self.slots[destination]
+                while slot in used:
+                    slot += 1
+                used.add(slot)
+            self.running[key] = (limits, destination, slot)
+            started.append((key, slot))
+        self.pending = still_pending
+        return started
+
+    def finish(self, key):
+        (limits, destination, slot) = self.running.pop(key)
+        for (limit_key, _) in limits:
+            self.counts[limit_key] -= 1
+        if destination is not None:
+            self.slots[destination].discard(slot)
+
+    def clear_pending(self):
+        self.pending = []
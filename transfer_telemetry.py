@@ -0,0 +1,262 @@
+"""
+Recording the throughput of transfers over time.
+Progress samples of every transfer (time, bytes, rate, percentage, source,
+destination, protocol) are appended to a CSV file, at most one sample per
+interval per transfer, such that the achieved rates of links and protocol
+settings can be compared afterwards, per host pair.
+This module doesn't depend on Qt.
+"""
+
+from import_proxy import Bunch, get_settings
+from transfer_scheduler import transfer_endpoints
+
+import threading
+import shlex
+import time
+import json
+import csv
+import os
+import os.path
+import re
+
+columns = ["time", "transfer", "source", "destination", "protocol",
+           "state", "percentage", "bytes", "rate"]
+
+rate_regexp = re.compile("(?P<value>\d+(\.\d+)?)\s*(?P<unit>.?)byte/s")
+rate_units = {"" : 1, "k" : 1e3, "m" : 1e6, "g" : 1e9}
+
+def parse_rate(text):
+    """
+    returns bytes/s of a rate like "112.5 Mbyte/s", None if not understood
+    """
+    match = rate_regexp.search(text)
+    if not match:
+        return None
+    factor = rate_units.get(match.group("unit").lower())
+    if factor is None:
+        return None
+    return float(match.group("value")) * factor
+
+progress_re = re.compile("(?P<percentage>\d+(\.\d+)?)%"
+                         "(\s+(?P<rate>\d+(\.\d+) .byte/s))?")
+
+def parse_progress(text):
+    """
+    returns (percentage, data rate text or None) of a line of m5copy
+    progress output, None if text doesn't contain progress
+    """
+    match = progress_re.search(text)
+    if not match:
+        return None
+    return (float(match.group("percentage")), match.group("rate"))
+
+def protocol_of(command):
+    """
+    returns the protocol with its settings of an m5copy command line,
+    e.g. "tcp" or "udt rate=500000000 mtu=9000"
+    """
+    try:
+        arguments = shlex.split(command)
+    except ValueError:
+        return "?"
+    if "-udt" not in arguments:
+        return "tcp"
+    protocol = "udt"
+    for (option, name) in [("-r", "rate"), ("-m", "mtu")]:
+        if option in arguments:
+            index = arguments.index(option)
+            if index + 1 < len(arguments):
+                protocol += " {n}={v}".format(n=name, v=arguments[index + 1])
+    return protocol
+
+class Transfer_Telemetry(object):
+    def __init__(self, file_name, interval=1.0):
+        """
+        file_name: CSV file to append the samples to
+        interval: minimum number of seconds between samples of a transfer
+        """
+        self.file_name = os.path.expanduser(file_name)
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._transfers = {} # {key : Bunch}
+
+    def _write(self, transfer, state):
+        row = [time.time(), transfer.id, transfer.source,
+               transfer.destination, transfer.protocol, state,
+               transfer.percentage, transfer.bytes,
+               "" if transfer.rate is None else transfer.rate]
+        with self._lock:
+            new_file = not os.path.exists(self.file_name)
+            with open(self.file_name, "ab") as output:
+                writer = csv.writer(output)
+                if new_file:
+                    writer.writerow(columns)
+                writer.writerow(row)
+        transfer.last_sample = time.time()
+
+    def start(self, key, command, size=None):
+        """
+        key: identifies the transfer in the calls to sample and finish
+        size: number of bytes to transfer, None if unknown
+        """
+        (source, destination) = transfer_endpoints(command)
+        self._transfers[key] = Bunch(
+            id="{t:x}-{k}".format(t=int(time.time()), k=key),
+            source="" if source is None else source.host,
+            destination="" if destination is None else destination.host,
+            protocol=protocol_of(command),
+            size=size,
+            percentage=0.0,
+            bytes="",
+            rate=None,
+            last_sample=0)
+
+    def sample(self, key, percentage, rate=None):
+        """
+        percentage: progress of the transfer, rate: bytes/s or None
+        """
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            return
+        transfer.percentage = percentage
+        if transfer.size is not None:
+            transfer.bytes = int(transfer.size * percentage / 100)
+        if rate is not None:
+            transfer.rate = rate
+        if time.time() - transfer.last_sample >= self.interval:
+            self._write(transfer, "running")
+
+    def finish(self, key, success):
+        transfer = self._transfers.pop(key, None)
+        if transfer is None:
+            return
+        if success:
+            transfer.percentage = 100.0
+            if transfer.size is not None:
+                transfer.bytes = transfer.size
+        self._write(transfer, "done" if success else "failed")
+
+def read_samples(file_name):
+    """
+    returns the samples in a telemetry file as Bunch per row
+    """
+    samples = []
+    with open(os.path.expanduser(file_name), "rb") as input_:
+        for row in csv.DictReader(input_):
+            try:
+                samples.append(Bunch(
+                    time=float(row["time"]),
+                    transfer=row["transfer"],
+                    source=row["source"],
+                    destination=row["destination"],
+                    protocol=row["protocol"],
+                    state=row["state"],
+                    percentage=float(row["percentage"]),
+                    bytes=int(row["bytes"]) if row["bytes"] else None,
+                    rate=float(row["rate"]) if row["rate"] else None))
+            except (KeyError, ValueError):
+                # e.g. a partially written last line
+                continue
+    return samples
+
+def export_json(file_name, output_file_name):
+    """
+    write the samples of a telemetry file as a JSON list of objects
+    """
+    with open(os.path.expanduser(output_file_name), "w") as output:
+        json.dump([sample.members() for sample in read_samples(file_name)],
+                  output, indent=1)
+
+def summarize(samples):
+    """
+    returns [Bunch(source, destination, protocol, transfers, failed, bytes,
+    mean_rate, min_rate, max_rate)] per host pair and protocol,
+    rates in bytes/s: mean over all rate samples, min and max of the mean
+    rate per transfer
+    """
+    transfers = {} # {transfer : Bunch}
+    for sample in samples:
+        transfer = transfers.setdefault(sample.transfer, Bunch(
+            key=(sample.source, sample.destination, sample.protocol),
+            state="running", bytes=None, rates=[]))
+        transfer.state = sample.state
+        if sample.bytes is not None:
+            transfer.bytes = sample.bytes
+        if (sample.rate is not None) and (sample.state == "running"):
+            transfer.rates.append(sample.rate)
+
+    pairs = {}
+    for transfer in transfers.values():
+        pair = pairs.setdefault(transfer.key, Bunch(
+            source=transfer.key[0], destination=transfer.key[1],
+            protocol=transfer.key[2], transfers=0, failed=0, bytes=0,
+            rates=[], transfer_rates=[]))
+        pair.transfers += 1
+        if transfer.state == "failed":
+            pair.failed += 1
+        elif (transfer.state == "done") and (transfer.bytes is not None):
+            pair.bytes += transfer.bytes
+        pair.rates.extend(transfer.rates)
+        if transfer.rates:
+            pair.transfer_rates.append(
+                sum(transfer.rates) / len(transfer.rates))
+
+    result = []
+    for key in sorted(pairs.keys()):
+        pair = pairs[key]
+        result.append(Bunch(
+            source=pair.source, destination=pair.destination,
+            protocol=pair.protocol, transfers=pair.transfers,
+            failed=pair.failed, bytes=pair.bytes,
+            mean_rate=sum(pair.rates) / len(pair.rates) \
+                if pair.rates else None,
+            min_rate=min(pair.transfer_rates) \
+                if pair.transfer_rates else None,
+            max_rate=max(pair.transfer_rates) \
+                if pair.transfer_rates else None))
+    return result
+
+def format_summary(summary):
+    """
+    returns a text table of the result of summarize, rates in MB/s
+    """
+    def rate(value):
+        return "-" if value is None else "{r:.1f}".format(r=value / 1e6)
+    rows = [["source", "destination", "protocol", "transfers", "failed",
+             "GB", "mean MB/s", "min MB/s", "max MB/s"]]
+    for pair in summary:
+        rows.append([pair.source, pair.destination, pair.protocol,
+                     str(pair.transfers), str(pair.failed),
+                     "{b:.1f}".format(b=pair.bytes / 1e9),
+                     rate(pair.mean_rate), rate(pair.min_rate),
+                     rate(pair.max_rate)])
+    widths = [max(len(row[column]) for row in rows) \
+              for column in xrange(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) \
+                               for (value, width) in zip(row, widths)) \
+                     for row in rows)
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+def get_telemetry():
+    """
+    Returns the process wide telemetry recorder,
+    or None if telemetry is disabled
+    """
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            file_name = get_settings()["transfer_telemetry"]
+            if not file_name:
+                _telemetry = False
+            else:
+                try:
+                    _telemetry = Transfer_Telemetry(file_name)
+                except Exception as e:
+                    print "warning, failed to open transfer telemetry "\
+                        "'{f}': {e}".format(f=file_name, e=e)
+                    _telemetry = False
+        return _telemetry or None
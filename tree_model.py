@@ -0,0 +1,262 @@
+"""
+Tree model for the machine views. The children of a node are either added
+explicitly or produced on demand from a source (canFetchMore/fetchMore),
+such that a station with tens of thousands of scans only creates the rows
+that are scrolled into view.
+"""
+
+import PyQt4.QtGui as QtGui
+import PyQt4.QtCore as QtCore
+
+class Tree_Node(object):
+    __slots__ = ["texts", "key", "expandable", "parent", "depth", "row",
+                 "children", "source", "source_size", "_renumber_from"]
+
+    def __init__(self, texts=None, key=None, expandable=None):
+        """
+        texts: { column : text }
+        key: free to use by the view, e.g. what the node represents
+        expandable: True/False to always/never show an expand indicator,
+          None to show it if the node has (or can fetch) children
+        """
+        self.texts = texts if texts is not None else {}
+        self.key = key
+        self.expandable = expandable
+        self.parent = None
+        self.depth = -1
+        self.row = 0
+        self.children = []
+        # callable(row) -> Tree_Node, producing the children on demand
+        self.source = None
+        self.source_size = 0
+        # the rows of the children from this index on might be outdated
+        self._renumber_from = None
+
+    def text(self, column):
+        return self.texts.get(column, "")
+
+    def child_count(self):
+        """
+        returns the number of children, including those not fetched yet
+        """
+        return max(len(self.children), self.source_size)
+
+    def row_of(self, child):
+        if self._renumber_from is not None:
+            for row in xrange(self._renumber_from, len(self.children)):
+                self.children[row].row = row
+            self._renumber_from = None
+        return child.row
+
+    def _invalidate_rows(self, row):
+        if (self._renumber_from is None) or (row < self._renumber_from):
+            self._renumber_from = row
+
+class Lazy_Tree_Model(QtCore.QAbstractItemModel):
+    # how many rows to create at once from a source
+    fetch_size = 500
+
+    def __init__(self, header_labels, parent=None):
+        super(Lazy_Tree_Model, self).__init__(parent)
+        self.header_labels = header_labels
+        self.root = Tree_Node()
+        # number of levels to show, None for all
+        self.depth_limit = None
+
+    def node(self, index):
+        """
+        returns the node of index, the root node for an invalid index
+        """
+        if not index.isValid():
+            return self.root
+        return index.internalPointer()
+
+    def index_of(self, node, column=0):
+        if node.parent is None:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.parent.row_of(node), column, node)
+
+    def _children_hidden(self, node):
+        return (self.depth_limit is not None) and \
+            (node.depth >= self.depth_limit - 1)
+
+    def _attach(self, parent, child, row):
+        child.parent = parent
+        child.depth = parent.depth + 1
+        child.row = row
+
+    # QAbstractItemModel interface
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self.node(parent)
+        if (row < 0) or (row >= len(node.children)) or \
+           (column < 0) or (column >= len(self.header_labels)):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self.index_of(index.internalPointer().parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        if self._children_hidden(node):
+            return 0
+        return len(node.children)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.header_labels)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self.node(parent)
+        if self._children_hidden(node):
+            return False
+        if node.expandable is not None:
+            return node.expandable
+        return node.child_count() > 0
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return (not self._children_hidden(node)) and \
+            (len(node.children) < node.source_size)
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        first = len(node.children)
+        last = min(first + self.fetch_size, node.source_size) - 1
+        if last < first:
+            return
+        self.beginInsertRows(parent, first, last)
+        for row in xrange(first, last + 1):
+            child = node.source(row)
+            self._attach(node, child, row)
+            node.children.append(child)
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and (role == QtCore.Qt.DisplayRole):
+            text = index.internalPointer().texts.get(index.column())
+            if text:
+                return QtCore.QVariant(text)
+        return QtCore.QVariant()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal) and \
+           (role == QtCore.Qt.DisplayRole) and \
+           (0 <= section < len(self.header_labels)):
+            return QtCore.QVariant(self.header_labels[section])
+        return QtCore.QVariant()
+
+    # modifications
+    def insert_child(self, parent, row, child):
+        """
+        insert child node before row of parent node,
+        for a parent node with a source, the children before row have to 
+        be created already
+        """
+        self.beginInsertRows(self.index_of(parent), row, row)
+        self._attach(parent, child, row)
+        parent.children.insert(row, child)
+        parent._invalidate_rows(row + 1)
+        self.endInsertRows()
+
+    def append_child(self, parent, child):
+        self.insert_child(parent, len(parent.children), child)
+
+    def append_children(self, parent, children):
+        """
+        append a list of child nodes to parent node,
+        the parent node shouldn't have a source
+        """
+        if not children:
+            return
+        first = len(parent.children)
+        self.beginInsertRows(self.index_of(parent),
+                             first, first + len(children) - 1)
+        for row, child in enumerate(children, first):
+            self._attach(parent, child, row)
+        parent.children.extend(children)
+        self.endInsertRows()
+
+    def set_source(self, parent, size, make_child):
+        """
+        let parent node have size children, created on demand by
+        make_child(row) -> Tree_Node
+        the view fetches the first children when the parent is expanded,
+        for an already expanded parent, call fetchMore
+        """
+        self.remove_children(parent)
+        parent.source = make_child
+        parent.source_size = size
+
+    def remove_child(self, child):
+        parent = child.parent
+        if parent is None:
+            return
+        row = parent.row_of(child)
+        self.beginRemoveRows(self.index_of(parent), row, row)
+        del parent.children[row]
+        parent._invalidate_rows(row)
+        child.parent = None
+        self.endRemoveRows()
+
+    def remove_children(self, parent):
+        if parent.children:
+            self.beginRemoveRows(self.index_of(parent),
+                                 0, len(parent.children) - 1)
+            for child in parent.children:
+                child.parent = None
+            parent.children = []
+            parent._renumber_from = None
+            self.endRemoveRows()
+        parent.source = None
+        parent.source_size = 0
+
+    def clear(self):
+        self.beginResetModel()
+        for child in self.root.children:
+            child.parent = None
+        self.root.children = []
+        self.root.source = None
+        self.root.source_size = 0
+        self.root._renumber_from = None
+        self.endResetModel()
+
+    def set_text(self, node, column, text):
+        node.texts[column] = text
+        if node.parent is not None:
+            index = self.index_of(node, column)
+            self.dataChanged.emit(index, index)
+
+    def set_expandable(self, node, expandable):
+        node.expandable = expandable
+        if node.parent is not None:
+            index = self.index_of(node)
+            self.dataChanged.emit(index, index)
+
+    def set_depth_limit(self, depth_limit):
+        """
+        only show depth_limit levels of the tree, None to show all levels
+        rows appear and disappear, views are reset (and collapse)
+        """
+        if depth_limit == self.depth_limit:
+            return
+        self.beginResetModel()
+        self.depth_limit = depth_limit
+        self.endResetModel()
+
+class Padding_Delegate(QtGui.QStyledItemDelegate):
+    """
+    In automatic column resizing mode (good), columns are close together (bad)
+    there doesn't seem to be a way to set spacing, so instead this delegate
+    adds spaces around the displayed text
+    """
+    spaces = 2
+    def displayText(self, value, locale):
+        text = super(Padding_Delegate, self).displayText(value, locale)
+        if text.isEmpty():
+            return text
+        add = self.spaces * " "
+        return QtCore.QString(add).append(text).append(add)